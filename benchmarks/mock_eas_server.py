@@ -0,0 +1,352 @@
+"""
+A local stand-in for the EAS GraphQL API, so the client side of these scripts can be exercised and benchmarked without
+touching a real EAS.
+
+Only the operations the scripts use are implemented: runWorkPackage, runIntrinsicWorkPackage, runCalibration,
+cancelWorkPackage, getActiveWorkPackages, getWorkPackageById, getWorkPackages (filtered by name), getCalibrationRun,
+listCalibrationRuns (filtered by name), getCalibrationSets and getTransformerTapSettings. Operations are recognised from
+the GraphQL document the SDK sends, one top-level field per line (with optional aliases), and the arguments are read from the request variables. No schema validation is done.
+
+Work packages and calibration runs progress from 0 to 100% over `job_seconds` and then complete. Latency, errors and
+payload sizes can be set on the command line (see --help) or on MockEasServer.
+
+Run standalone with:
+
+    python -m benchmarks.mock_eas_server --port 7654 --latency-ms 50
+
+and point eas_server in auth_config.json at host localhost, port 7654, protocol http.
+
+EWB is served over gRPC and isn't mocked here.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# A top-level field line, e.g. `  alias: getCalibrationRun(id: $id_0) {`
+_FIELD = re.compile(r"^(\s*)(?:(\w+):\s*)?(\w+)(?:\((.*)\))?\s*(\{)?\s*$")
+_ARGUMENT = re.compile(r"(\w+):\s*\$(\w+)")
+# Argument lists that were printed over several lines, as graphql-core does once a field's line gets long.
+_WRAPPED_ARGUMENTS = re.compile(r"\(\s*\n([^()]*)\)")
+
+
+def parse_operation(document: str, variables: Dict) -> List[Dict]:
+    """
+    The top-level fields of a GraphQL document as printed by the SDK, each with its response key, field name, arguments
+    and the names of its selected subfields.
+    """
+    document = _WRAPPED_ARGUMENTS.sub(lambda m: "(" + " ".join(m.group(1).split()) + ")", document)
+    lines = [line for line in document.splitlines() if line.strip()]
+    fields = []
+    depth = 0
+    for line in lines[1:]:
+        stripped = line.strip()
+        if stripped == "}":
+            depth -= 1
+            continue
+        match = _FIELD.match(line)
+        if match is None:
+            continue
+        _, alias, name, arguments, opens = match.groups()
+        if depth == 0:
+            fields.append({
+                "key": alias or name,
+                "name": name,
+                "arguments": {arg: variables.get(var) for arg, var in _ARGUMENT.findall(arguments or "")},
+                "selection": [],
+            })
+        elif depth == 1:
+            fields[-1]["selection"].append(name)
+        if opens:
+            depth += 1
+    return fields
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class MockEasState:
+    """The jobs known to the mock server. Thread safe, as requests are handled on a thread per connection."""
+
+    def __init__(self, job_seconds: float = 30.0, extra_active: int = 0, tap_records: int = 50):
+        self.job_seconds = job_seconds
+        self.tap_records = tap_records
+        self.lock = threading.Lock()
+        self.work_packages: Dict[str, Dict] = {}
+        self.calibrations: Dict[str, Dict] = {}
+        self.calibration_ids = itertools.count(1)
+        self.counts: Dict[str, int] = {}
+        # Synthetic work packages that never finish, to make getActiveWorkPackages payloads as large as a busy server's.
+        for i in range(extra_active):
+            self._add_work_package(f"background-{i}", fixed_progress=1 + i % 98)
+
+    def _add_work_package(self, name: str, fixed_progress: Optional[float] = None) -> str:
+        work_package_id = str(uuid.uuid4())
+        self.work_packages[work_package_id] = {
+            "name": name, "started": time.time(), "createdAt": _now_iso(), "cancelled": False,
+            "fixed_progress": fixed_progress,
+        }
+        return work_package_id
+
+    def _progress(self, job: Dict) -> float:
+        if job.get("fixed_progress") is not None:
+            return job["fixed_progress"]
+        return max(0.0, min(100.0, (time.time() - job["started"]) / self.job_seconds * 100)) if self.job_seconds else 100.0
+
+    def _work_package_status(self, job: Dict) -> str:
+        if job["cancelled"]:
+            return "CANCELLED"
+        progress = self._progress(job)
+        return "COMPLETED" if progress >= 100 else "RUNNING" if progress > 0 else "SETUP"
+
+    def resolve(self, field: Dict):
+        name, args = field["name"], field["arguments"]
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if name in ("runWorkPackage", "runIntrinsicWorkPackage"):
+                return self._add_work_package(args.get("workPackageName"))
+            if name == "cancelWorkPackage":
+                job = self.work_packages.get(args.get("workPackageId"))
+                if job is None:
+                    raise LookupError("404: No work package running with provided ID")
+                job["cancelled"] = True
+                return args["workPackageId"]
+            if name == "runCalibration":
+                run_id = str(next(self.calibration_ids))
+                self.calibrations[run_id] = {"name": args.get("calibrationName"), "started": time.time(),
+                                             "feeders": args.get("feeders") or []}
+                return run_id
+            if name == "getActiveWorkPackages":
+                return self._active_work_packages()
+            if name == "getWorkPackageById":
+                return self._work_package(args.get("id"), field["selection"])
+            if name == "getWorkPackages":
+                return self._work_packages((args.get("filter") or {}).get("name"), args.get("limit"))
+            if name == "getCalibrationRun":
+                return self._calibration_run(args.get("id"), field["selection"])
+            if name == "listCalibrationRuns":
+                return [self._calibration_run(run_id, field["selection"]) for run_id, job in self.calibrations.items()
+                        if args.get("name") in (None, job["name"])]
+            if name == "getCalibrationSets":
+                return sorted({c["name"] for c in self.calibrations.values() if self._progress(c) >= 100})
+            if name == "getTransformerTapSettings":
+                return self._tap_settings(args.get("calibrationName"), args.get("feeder"), field["selection"])
+        raise NotImplementedError(f"{name} is not implemented by the mock EAS server")
+
+    def _active_work_packages(self) -> Dict:
+        pending, in_progress = [], []
+        for work_package_id, job in self.work_packages.items():
+            status = self._work_package_status(job)
+            if status == "SETUP":
+                pending.append(work_package_id)
+            elif status == "RUNNING":
+                percent = int(self._progress(job))
+                in_progress.append({
+                    "id": work_package_id, "progressPercent": percent, "pending": 0, "generation": percent,
+                    "execution": percent, "resultProcessing": 0, "failureProcessing": 0, "complete": 0,
+                })
+        return {"pending": pending, "inProgress": in_progress}
+
+    def _work_package(self, work_package_id: str, selection: List[str]) -> Optional[Dict]:
+        job = self.work_packages.get(work_package_id)
+        if job is None:
+            return None
+        status = self._work_package_status(job)
+        values = {
+            "id": work_package_id, "name": job["name"], "status": status, "isDeleted": False,
+            "createdAt": job["createdAt"], "completedAt": _now_iso() if status == "COMPLETED" else None,
+        }
+        return {key: values.get(key) for key in selection}
+
+    def _work_packages(self, name: Optional[str], limit: Optional[int]) -> Dict:
+        matches = [
+            {"id": work_package_id, "name": job["name"], "createdAt": job["createdAt"],
+             "status": self._work_package_status(job), "isDeleted": False}
+            for work_package_id, job in self.work_packages.items()
+            if job["fixed_progress"] is None and (not name or name in (job["name"] or ""))
+        ]
+        return {"totalCount": len(matches), "offset": 0, "workPackages": matches[:limit] if limit else matches}
+
+    def _calibration_run(self, run_id: str, selection: List[str]) -> Optional[Dict]:
+        job = self.calibrations.get(run_id)
+        if job is None:
+            return None
+        done = self._progress(job) >= 100
+        values = {
+            "id": run_id, "runId": int(run_id), "name": job["name"], "feeders": job["feeders"],
+            "status": "COMPLETED" if done else "RUNNING",
+            "completedAt": _iso(job["started"] + self.job_seconds) if done else None,
+        }
+        return {key: values.get(key) for key in selection}
+
+    def _tap_settings(self, calibration_name: str, feeder: Optional[str], selection: List[str]) -> List[Dict]:
+        # Deterministic per calibration and feeder, so repeated fetches return the same settings.
+        rng = random.Random(f"{calibration_name}/{feeder}")
+        records = []
+        for i in range(self.tap_records):
+            values = {
+                "id": f"{feeder or 'tx'}-tx-{i}", "controlEnabled": rng.random() < 0.5, "highStep": 32, "lowStep": 1,
+                "nominalTapNum": 16, "stepVoltageIncrement": 0.625, "tapPosition": rng.randint(1, 32),
+            }
+            records.append({key: values.get(key) for key in selection})
+        return records
+
+
+class MockEasServer:
+    """
+    The mock EAS server, listening on `port` (0 picks a free port) once started. Each request waits `latency_ms` (plus up
+    to `jitter_ms`), fails with a GraphQL error with probability `error_rate`, or with an HTTP 503 with probability
+    `http_error_rate` (with a Retry-After header if `retry_after` is set). With probability `ambiguous_error_rate` a
+    request is carried out but answered with an HTTP 502, as when a proxy times out waiting for the response.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        http_error_rate: float = 0.0,
+        ambiguous_error_rate: float = 0.0,
+        retry_after: Optional[float] = None,
+        job_seconds: float = 30.0,
+        extra_active: int = 0,
+        tap_records: int = 50,
+        seed: Optional[int] = None,
+    ):
+        self.state = MockEasState(job_seconds=job_seconds, extra_active=extra_active, tap_records=tap_records)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.ambiguous_error_rate = ambiguous_error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self) -> "MockEasServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, which Nagle's algorithm would otherwise hold up on keep-alive
+            # connections.
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                delay = server.latency_ms + server.random.random() * server.jitter_ms
+                if delay:
+                    time.sleep(delay / 1000)
+
+                if server.random.random() < server.http_error_rate:
+                    headers = {"Retry-After": f"{server.retry_after:g}"} if server.retry_after is not None else {}
+                    self._respond(503, {"message": "Service unavailable"}, len(body), headers)
+                    return
+
+                request = json.loads(body)
+                fields = parse_operation(request["query"], request.get("variables") or {})
+                if server.random.random() < server.error_rate:
+                    self._respond(200, {"data": None, "errors": [{"message": "Injected error from the mock EAS server"}]}, len(body))
+                    return
+
+                data, errors = {}, []
+                for field in fields:
+                    try:
+                        data[field["key"]] = server.state.resolve(field)
+                    except Exception as e:
+                        data[field["key"]] = None
+                        errors.append({"message": str(e), "path": [field["key"]]})
+                if server.random.random() < server.ambiguous_error_rate:
+                    self._respond(502, {"message": "Bad gateway"}, len(body))
+                    return
+                self._respond(200, {"data": data, **({"errors": errors} if errors else {})}, len(body))
+
+            def _respond(self, status: int, payload: Dict, request_bytes: int, headers: Optional[Dict] = None):
+                response = json.dumps(payload).encode()
+                # Requests are handled on a thread per connection, so the counters are updated under the state's lock.
+                with server.state.lock:
+                    server.requests += 1
+                    server.request_bytes += request_bytes
+                    server.response_bytes += len(response)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                for header, value in (headers or {}).items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(response)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=7654)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a GraphQL error")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--ambiguous-error-rate", type=float, default=0.0,
+                        help="Fraction of requests carried out but answered with HTTP 502")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with HTTP 503 responses")
+    parser.add_argument("--job-seconds", type=float, default=30.0, help="Time for a job to go from 0 to 100%%")
+    parser.add_argument("--extra-active", type=int, default=0, help="Synthetic never-ending active work packages")
+    parser.add_argument("--tap-records", type=int, default=50, help="Tap setting records per feeder")
+    args = parser.parse_args()
+
+    server = MockEasServer(
+        port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate, ambiguous_error_rate=args.ambiguous_error_rate,
+        retry_after=args.retry_after, job_seconds=args.job_seconds, extra_active=args.extra_active,
+        tap_records=args.tap_records,
+    )
+    print(f"Mock EAS server listening on http://127.0.0.1:{server.port}/api/graphql")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
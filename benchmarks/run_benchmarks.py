@@ -0,0 +1,286 @@
+"""
+Benchmarks for the client side of the runners, against the mock EAS server in mock_eas_server.py.
+
+    python -m benchmarks.run_benchmarks [--output results.json] [--baseline baseline.json] [--quick]
+
+Measures:
+
+- submit: work package submissions per second through submit_shards, at several in-flight limits.
+- retries: the share of submissions that succeed, duplicates created and requests per submission when EAS fails some
+  requests outright and some after carrying them out, with the retry layer in resilience.py.
+- overrides: time to validate a large override file and build and serialise its work packages.
+- profiles: time to compile a yearly default profile from CSV with a cold and a warm cache, and to serialise a work
+  package carrying four yearly profiles.
+- monitor: client time per poll of get_active_work_packages with many active work packages, and the bytes per poll.
+- monitor_jobs: requests and client time per JobMonitor tick when following one job and when following many.
+- cold_start: time for a fresh interpreter to show `hcr.py --help` and to import each hcr subcommand's script.
+
+Results are printed and can be saved as JSON. Given a baseline saved from an earlier run, any metric that is more than
+--tolerance (default 25%) worse than the baseline is reported and the exit code is 1, so this can gate changes to the
+runners.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+from zepben.eas import FeederConfigsInput, HcGeneratorConfigInput, HcModelConfigInput, Query, WorkPackageInput
+from zepben.eas.client.eas_client import EasClient
+
+from benchmarks.mock_eas_server import MockEasServer
+from hcr import COMMANDS
+from job_monitor import JobMonitor
+from overrides import iter_feeder_config_batches, validate_override_file
+from profiles import resolve_profile
+from progress import ProgressTracker, extract_progress
+from resilience import CircuitBreaker, RetryPolicy, make_resilient
+from run_feeder_override_work_package import build_work_package as build_override_work_package
+from run_forecast_work_package import build_work_package as build_forecast_work_package
+from sharding import plan_shards, submit_shards
+
+# Whether a larger value of each metric is better, used when comparing against a baseline.
+HIGHER_IS_BETTER = {"submissions_per_second": True, "submitted_fraction": True}
+
+
+def mock_client(server: MockEasServer) -> EasClient:
+    return EasClient(host="127.0.0.1", port=server.port, protocol="http", verify_certificate=False, asynchronous=True)
+
+
+def timed(fn: Callable) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+async def bench_submit(shards: int, latency_ms: float) -> Dict[str, Dict]:
+    config = {"load_time": {"start1": "2024-01-01T00:00:00", "end1": "2025-01-01T00:00:00"}}
+    planned = plan_shards([f"feeder-{i}" for i in range(shards)], [2030], ["base"], shard_size=1)
+    results = {}
+    with MockEasServer(latency_ms=latency_ms) as server:
+        eas_client = mock_client(server)
+        for max_in_flight in (1, 4, 16):
+            start = time.perf_counter()
+            entries = await submit_shards(
+                eas_client,
+                planned,
+                lambda shard: build_forecast_work_package(config, shard["feeders"], shard["years"], shard["scenarios"]),
+                "benchmark",
+                max_in_flight=max_in_flight,
+            )
+            elapsed = time.perf_counter() - start
+            results[f"submit/in_flight={max_in_flight}"] = {
+                "submissions_per_second": sum(e["work_package_id"] is not None for e in entries) / elapsed,
+            }
+        await eas_client.close()
+    return results
+
+
+async def bench_retries(shards: int, error_rate: float) -> Dict[str, Dict]:
+    config = {"load_time": {"start1": "2024-01-01T00:00:00", "end1": "2025-01-01T00:00:00"}}
+    planned = plan_shards([f"feeder-{i}" for i in range(shards)], [2030], ["base"], shard_size=1)
+    with MockEasServer(http_error_rate=error_rate, ambiguous_error_rate=error_rate, retry_after=0, seed=1) as server:
+        eas_client = make_resilient(
+            mock_client(server),
+            RetryPolicy(max_attempts=8, base_delay=0.01, max_delay=0.1),
+            CircuitBreaker(reset_seconds=0.1),
+        )
+        entries = await submit_shards(
+            eas_client,
+            planned,
+            lambda shard: build_forecast_work_package(config, shard["feeders"], shard["years"], shard["scenarios"]),
+            "benchmark",
+            max_in_flight=8,
+        )
+        await eas_client.close()
+
+    submitted = sum(e["work_package_id"] is not None for e in entries)
+    return {
+        f"retries/error_rate={error_rate:g}": {
+            "submitted_fraction": submitted / len(entries),
+            "duplicates": len(server.state.work_packages) - submitted,
+            "requests_per_submission": server.requests / len(entries),
+        }
+    }
+
+
+def bench_overrides(directory: str, feeders: int, loads: int, steps: int) -> Dict[str, Dict]:
+    path = os.path.join(directory, "overrides.csv")
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["feeder", "load_id", "step", "load_watts", "load_var", "gen_watts", "gen_var"])
+        for f in range(feeders):
+            for load in range(loads):
+                for step in range(steps):
+                    writer.writerow([f"feeder-{f}", f"load-{load}", step, 1000.0 + step, 50.0, "", ""])
+
+    serialised = []
+
+    def build():
+        batches = iter_feeder_config_batches(path, years=[2030], scenarios=["base"], load_time=None)
+        for feeder_configs in batches:
+            work_package = build_override_work_package(FeederConfigsInput(configs=feeder_configs))
+            serialised.append(len(work_package.model_dump_json(by_alias=True)))
+
+    return {
+        f"overrides/{feeders}x{loads}x{steps}": {
+            "validate_seconds": timed(lambda: validate_override_file(path)),
+            "build_seconds": timed(build),
+            "payload_mb": sum(serialised) / 1e6,
+        }
+    }
+
+
+def bench_profiles(directory: str) -> Dict[str, Dict]:
+    path = os.path.join(directory, "profile.csv")
+    with open(path, "w") as file:
+        file.write("\n".join(str(500 + (i % 48) * 10.0) for i in range(17520)))
+
+    cold = timed(lambda: resolve_profile(directory, "profile.csv", 0.5, yearly=True))
+    profile = []
+    warm = timed(lambda: profile.extend(resolve_profile(directory, "profile.csv", 0.5, yearly=True)))
+
+    work_package = WorkPackageInput(generatorConfig=HcGeneratorConfigInput(model=HcModelConfigInput(
+        loadIntervalLengthHours=0.5, defaultLoadWatts=profile, defaultGenWatts=profile, defaultLoadVar=profile,
+        defaultGenVar=profile,
+    )))
+    payload = []
+    serialise = timed(lambda: payload.append(work_package.model_dump_json(by_alias=True)))
+    return {
+        "profiles/yearly_half_hourly": {
+            "compile_cold_seconds": cold,
+            "compile_warm_seconds": warm,
+            "serialise_seconds": serialise,
+            "payload_mb": len(payload[0]) / 1e6,
+        }
+    }
+
+
+async def bench_monitor(active: int, polls: int) -> Dict[str, Dict]:
+    with MockEasServer(extra_active=active) as server:
+        eas_client = mock_client(server)
+        tracker = ProgressTracker()
+        await eas_client.query(Query.get_active_work_packages())
+        bytes_before = server.response_bytes
+
+        start = time.perf_counter()
+        for _ in range(polls):
+            tracker.update(extract_progress(await eas_client.query(Query.get_active_work_packages())))
+        elapsed = time.perf_counter() - start
+        await eas_client.close()
+
+    return {
+        f"monitor/active={active}": {
+            "seconds_per_poll": elapsed / polls,
+            "response_kb_per_poll": (server.response_bytes - bytes_before) / polls / 1e3,
+        }
+    }
+
+
+async def bench_monitor_jobs(jobs: int, ticks: int) -> Dict[str, Dict]:
+    results = {}
+    # Long enough that nothing finishes during the benchmark, so every tick covers every job.
+    with MockEasServer(job_seconds=3600) as server:
+        eas_client = mock_client(server)
+        for count in (1, jobs):
+            monitor = JobMonitor(eas_client)
+            monitor.track_work_packages(server.state._add_work_package(f"monitored-{i}") for i in range(count // 2 or 1))
+            with server.state.lock:
+                run_ids = [str(next(server.state.calibration_ids)) for _ in range(count // 2)]
+                for run_id in run_ids:
+                    server.state.calibrations[run_id] = {"name": "monitored", "started": time.time(), "feeders": []}
+            monitor.track_calibrations(run_ids)
+            await monitor.tick()
+
+            requests_before = server.requests
+            start = time.perf_counter()
+            for _ in range(ticks):
+                await monitor.tick()
+            results[f"monitor_jobs/jobs={len(monitor.jobs)}"] = {
+                "seconds_per_tick": (time.perf_counter() - start) / ticks,
+                "requests_per_tick": (server.requests - requests_before) / ticks,
+            }
+        await eas_client.close()
+    return results
+
+
+def bench_cold_start(runs: int) -> Dict[str, Dict]:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def cold_start(*args) -> float:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args], cwd=root, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    results = {"cold_start/help": {"seconds": cold_start("hcr.py", "--help")}}
+    for path, command in COMMANDS.items():
+        results[f"cold_start/{'-'.join(path)}"] = {"seconds": cold_start("-c", f"import {command.module}")}
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> list:
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(name, {}).get(metric)
+            if not previous:
+                continue
+            change = (value - previous) / previous
+            worse = -change if HIGHER_IS_BETTER.get(metric, False) else change
+            if worse > tolerance:
+                regressions.append(f"{name} {metric}: {previous:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+async def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the runners against a mock EAS server.")
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--baseline", help="Compare against results saved from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--quick", action="store_true", help="Smaller workloads, for a fast smoke test")
+    args = parser.parse_args(argv[1:])
+
+    # Per-request and per-submission logging would otherwise dominate the timings.
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    scale = 0.1 if args.quick else 1
+
+    results = {}
+    results.update(await bench_submit(shards=int(200 * scale), latency_ms=20))
+    results.update(await bench_retries(shards=int(200 * scale), error_rate=0.2))
+    with tempfile.TemporaryDirectory() as directory:
+        results.update(bench_overrides(directory, feeders=int(20 * scale) or 1, loads=200, steps=48))
+        results.update(bench_profiles(directory))
+    results.update(await bench_monitor(active=int(200 * scale), polls=int(50 * scale)))
+    results.update(await bench_monitor_jobs(jobs=int(200 * scale), ticks=int(50 * scale)))
+    results.update(bench_cold_start(runs=1 if args.quick else 5))
+
+    for name, metrics in results.items():
+        print(f"{name:<36}" + "  ".join(f"{metric}={value:.4g}" for metric, value in metrics.items()))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv)))
@@ -0,0 +1,135 @@
+"""
+Run a calibration for each of a list of time periods, keeping at most a fixed number of calibration runs active at once,
+and track every run through a single JobMonitor, which polls all the active runs in one request, until they have all
+finished.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from zepben.eas import HcGeneratorConfigInput, Mutation
+from zepben.eas.client.eas_client import EasClient
+
+from job_monitor import CALIBRATION, JobMonitor
+from journal import Journal
+from utils import logger
+
+SUBMIT_FAILED = "SUBMIT_FAILED"
+
+
+def calibration_times(config) -> List[datetime]:
+    """
+    The calibration times to sweep over, from either a list of local times in `calibration_times`, or a range in
+    `calibration_time_range` with `start`, `end` (inclusive) and `step_hours`.
+    """
+    if "calibration_times" in config:
+        return [datetime.fromisoformat(t) for t in config["calibration_times"]]
+
+    time_range = config["calibration_time_range"]
+    start, end = datetime.fromisoformat(time_range["start"]), datetime.fromisoformat(time_range["end"])
+    step = timedelta(hours=time_range["step_hours"])
+    if step <= timedelta(0):
+        raise ValueError("calibration_time_range step_hours must be positive")
+
+    times = []
+    while start <= end:
+        times.append(start)
+        start += step
+    return times
+
+
+def period_calibration_name(calibration_name: str, calibration_time: datetime) -> str:
+    return f"{calibration_name}-{calibration_time:%Y%m%dT%H%M}"
+
+
+async def run_calibration_sweep(
+    eas_client: EasClient,
+    calibration_name: str,
+    times: List[datetime],
+    feeders: List[str],
+    generator_config: HcGeneratorConfigInput,
+    max_active: int = 4,
+    poll_seconds: float = 30.0,
+    journal: Optional[Journal] = None,
+) -> List[Dict]:
+    """
+    Submit one calibration per time in `times`, named after `calibration_name` and the time, keeping at most `max_active`
+    runs going at once. Returns the final state of every period once all runs have finished.
+
+    With a `journal` (keyed on "period"), each period is recorded before and after it is submitted. When resuming, the
+    journalled periods are used, and periods acknowledged before are tracked under their existing run IDs instead of
+    being submitted again.
+    """
+    periods = [
+        {"period": i, "calibration_time_local": t.isoformat(), "calibration_name": period_calibration_name(calibration_name, t),
+         "run_id": None, "status": None, "completed_at": None, "errors": []}
+        for i, t in enumerate(times)
+    ]
+    active: Dict[str, Dict] = {}
+    monitor = JobMonitor(eas_client)
+    if journal is not None:
+        periods = journal.plan(periods)
+        for entry in journal.acknowledged():
+            period = periods[entry["period"]]
+            period["run_id"] = entry["run_id"]
+            active[period["run_id"]] = period
+            monitor.track_calibrations([period["run_id"]])
+    pending = [period for period in reversed(periods) if period["run_id"] is None]
+
+    async def submit(period: Dict):
+        if journal is not None:
+            journal.submitting(period)
+        try:
+            result = await eas_client.mutation(Mutation.run_calibration(
+                calibration_name=period["calibration_name"],
+                calibration_time_local=datetime.fromisoformat(period["calibration_time_local"]),
+                feeders=feeders,
+                generator_config=generator_config,
+            ))
+            if "data" in result:
+                period["run_id"] = next(iter(result["data"].values()))
+                active[period["run_id"]] = period
+                monitor.track_calibrations([period["run_id"]])
+                logger.info(f"Calibration {period['calibration_name']} submitted as run {period['run_id']}")
+                if journal is not None:
+                    journal.acknowledge(period)
+                return
+            period["errors"] = [err["message"] for err in result["errors"]]
+        except Exception as e:
+            period["errors"] = [str(e)]
+        period["status"] = SUBMIT_FAILED
+        logger.error(f"Calibration {period['calibration_name']} failed to submit: {'; '.join(period['errors'])}")
+        if journal is not None:
+            journal.fail(period)
+
+    def update(period: Dict):
+        job = monitor.jobs[(CALIBRATION, str(period["run_id"]))]
+        if job["status"] != period["status"]:
+            logger.info(f"Calibration {period['calibration_name']}: {period['status']} -> {job['status']}")
+        period["status"], period["completed_at"] = job["status"], job["completed_at"]
+        if job["finished"]:
+            del active[period["run_id"]]
+
+    while pending or active:
+        to_submit = [pending.pop() for _ in range(min(len(pending), max_active - len(active)))]
+        await asyncio.gather(*(submit(period) for period in to_submit))
+        if active:
+            await asyncio.sleep(poll_seconds)
+            await monitor.tick()
+            for period in list(active.values()):
+                update(period)
+
+    return periods
+
+
+def print_sweep_table(periods: List[Dict]):
+    headers = ["period", "calibration_time_local", "calibration_name", "run_id", "status", "completed_at"]
+    rows = [[str(p[h]) if p[h] is not None else "" for h in headers] for p in periods]
+    widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+    for p in periods:
+        if p["errors"]:
+            print(f'{p["calibration_name"]}: {"; ".join(p["errors"])}')
@@ -1,14 +1,15 @@
 import asyncio
 import sys
 
-from utils import get_client, get_config_dir, print_cancel
+from utils import get_client, get_config_dir, get_option, print_cancel
 from zepben.eas import Mutation
 
 
 async def main(argv):
     config_dir = get_config_dir(argv)
     eas_client = get_client(config_dir)
-    work_package_id = input("Please enter ID of work package to cancel: ")
+    # Prompt only when no --id is given, so this can be scripted.
+    work_package_id = get_option(argv, "--id") or input("Please enter ID of work package to cancel: ")
     try:
         result = await eas_client.mutation(Mutation.cancel_work_package(work_package_id))
         print_cancel(result)
@@ -19,5 +20,4 @@ async def main(argv):
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main(sys.argv))
+    asyncio.run(main(sys.argv))
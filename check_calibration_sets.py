@@ -2,7 +2,8 @@ import asyncio
 import sys
 import pprint
 
-from utils import get_client, get_config_dir
+from clients import ClientManager
+from utils import get_config_dir
 from zepben.eas import Query
 
 """
@@ -12,13 +13,13 @@ Get the IDs of all calibration runs.
 
 async def print_loop(argv):
     config_dir = get_config_dir(argv)
-    eas_client = get_client(config_dir)
 
-    try:
-        result = await eas_client.query(Query.get_calibration_sets())
-        pprint.pprint(result)
-    except Exception as e:
-        print(e)
+    async with ClientManager(config_dir) as clients:
+        try:
+            result = await clients.eas_client.query(Query.get_calibration_sets())
+            pprint.pprint(result)
+        except Exception as e:
+            print(e)
 
 if __name__ == "__main__":
     asyncio.run(print_loop(sys.argv))
@@ -0,0 +1,109 @@
+"""
+A long-lived holder for the EAS client and EWB channel, for batch drivers that make many submissions, queries and
+monitor calls in one process.
+
+The auth config is parsed once, the EAS client keeps a pool of keep-alive HTTP connections and the EWB channel sends gRPC
+keep-alive pings, so connection and TLS setup is paid once rather than per call. Use it as an async context manager so
+both connections are closed on exit, even if the driver fails:
+
+    async with ClientManager(config_dir) as clients:
+        result = await clients.eas_client.query(Query.get_active_work_packages())
+"""
+
+import ssl
+from typing import TYPE_CHECKING, Optional
+
+from utils import get_client, get_ewb_channel, read_auth_config
+
+if TYPE_CHECKING:
+    import grpc.aio
+    from zepben.eas.client.eas_client import EasClient
+    from zepben.ewb import NetworkConsumerClient
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_SECONDS = 120.0
+
+
+class ClientManager:
+
+    def __init__(
+        self,
+        config_dir: str,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        keepalive_seconds: float = DEFAULT_KEEPALIVE_SECONDS,
+    ):
+        self.config_dir = config_dir
+        self.max_connections = max_connections
+        self.keepalive_seconds = keepalive_seconds
+        self._eas_client: Optional["EasClient"] = None
+        self._ewb_channel: Optional["grpc.aio.Channel"] = None
+        # The HTTP client EasClient built for itself, replaced by the pooled one and closed with the manager.
+        self._replaced_http_client = None
+
+    @property
+    def eas_client(self) -> "EasClient":
+        if self._eas_client is None:
+            import httpx
+
+            eas_client = get_client(self.config_dir)
+            # EasClient builds its HTTP client with httpx's default pool, which drops idle connections after 5 seconds -
+            # shorter than most monitor poll intervals. Swap in a pool that keeps connections open between calls.
+            # EasClient can't be given an HTTP client, so the one it built is kept to be closed along with the pooled one.
+            eas_server = read_auth_config(self.config_dir)["eas_server"]
+            self._replaced_http_client = eas_client.http_client
+            eas_client.http_client = httpx.AsyncClient(
+                headers=self._replaced_http_client.headers,
+                verify=_ssl_verify(eas_server.get("verify_certificate", True), eas_server.get("ca_filename")),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_seconds,
+                ),
+            )
+            self._eas_client = eas_client
+        return self._eas_client
+
+    @property
+    def ewb_channel(self) -> "grpc.aio.Channel":
+        if self._ewb_channel is None:
+            self._ewb_channel = get_ewb_channel(self.config_dir, options=[
+                ("grpc.keepalive_time_ms", int(self.keepalive_seconds * 1000)),
+                ("grpc.keepalive_timeout_ms", 20000),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.http2.max_pings_without_data", 0),
+            ])
+        return self._ewb_channel
+
+    def network_consumer_client(self) -> "NetworkConsumerClient":
+        from zepben.ewb import NetworkConsumerClient
+
+        # NetworkConsumerClient keeps everything it fetches in its own NetworkService, so hand out a fresh one per use
+        # rather than sharing a single ever-growing service. They all share the one underlying channel.
+        return NetworkConsumerClient(self.ewb_channel)
+
+    async def close(self):
+        if self._eas_client is not None:
+            await self._eas_client.close()
+            self._eas_client = None
+        if self._replaced_http_client is not None:
+            await self._replaced_http_client.aclose()
+            self._replaced_http_client = None
+        if self._ewb_channel is not None:
+            await self._ewb_channel.close()
+            self._ewb_channel = None
+
+    async def __aenter__(self) -> "ClientManager":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def _ssl_verify(verify_certificate: bool, ca_filename: Optional[str]):
+    # Mirrors how EasClient builds its verification context.
+    if not verify_certificate:
+        return False
+    try:
+        return ssl.create_default_context(cafile=ca_filename)
+    except ssl.SSLError:
+        return ssl.create_default_context(capath=ca_filename)
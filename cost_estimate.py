@@ -0,0 +1,287 @@
+"""
+Estimate the number of load flow solves, the runtime and the output volume of work packages before they are submitted.
+
+A forecast work package solves every feeder x year x scenario combination at every timestep of its time period, where
+the number of timesteps is the time period divided by HcSolveConfigInput.stepSizeMinutes. Fixed time feeder configs solve
+once per override step instead.
+
+Runtime and output volume are projected from the solve count with per-solve rates fitted to past runs. Each submitted
+work package is recorded with its solve count in a cost history alongside config.json, and its runtime is filled in from
+the work package's createdAt and completedAt once EAS reports it as completed. EAS has no start time for a work package,
+so the runtime includes any time it spent queued behind other work packages: the runtime estimates are of turnaround,
+from submission to results, on an instance as busy as it was for past runs. Output volume isn't available from EAS, so
+export_results.py records the size of the Parquet files it exports for each work package (see record_output). Until a
+work package with and one without raw results have been exported, the default rates below are used.
+"""
+
+import asyncio
+import math
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from zepben.eas import HcWorkPackageFields, Query, WorkPackageInput, WorkPackageState
+from zepben.eas.client.eas_client import EasClient
+
+from ledger import FINAL_STATUSES
+from utils import logger
+
+HISTORY_FILE_NAME = "cost_history.sqlite"
+DELETED = "DELETED"
+
+# Assumed when stepSizeMinutes isn't set on the work package.
+DEFAULT_STEP_SIZE_MINUTES = 60
+
+# Rough rates used until the cost history has completed runs to fit them from. Raw results store every meter's
+# voltages and every exception and overload at every timestep, so they are far larger than the summary metrics.
+DEFAULT_SECONDS_PER_SOLVE = 0.05
+DEFAULT_BYTES_PER_SOLVE = 2_000
+DEFAULT_RAW_BYTES_PER_SOLVE = 50_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    work_package_id TEXT PRIMARY KEY,
+    work_package_name TEXT NOT NULL,
+    solves INTEGER NOT NULL,
+    raw_results INTEGER NOT NULL,
+    submitted_at REAL NOT NULL,
+    runtime_seconds REAL,
+    output_bytes INTEGER,
+    status TEXT
+);
+"""
+
+
+class Rates(NamedTuple):
+    seconds_per_solve: float = DEFAULT_SECONDS_PER_SOLVE
+    bytes_per_solve: float = DEFAULT_BYTES_PER_SOLVE
+    raw_bytes_per_solve: float = DEFAULT_RAW_BYTES_PER_SOLVE
+
+
+class Estimate(NamedTuple):
+    work_package_name: str
+    feeders: int
+    solves: int
+    raw_results: bool
+    runtime_seconds: float
+    output_bytes: float
+
+
+def timesteps(start_time, end_time, step_size_minutes: int) -> int:
+    return max(1, math.ceil((end_time - start_time).total_seconds() / (step_size_minutes * 60)))
+
+
+def _fixed_time_steps(fixed_time) -> int:
+    # Every overridden list on a fixed time config has the same length, with each entry solved as its own timestep.
+    for override in fixed_time.overrides or []:
+        for values in (override.load_watts_override, override.load_var_override, override.gen_watts_override,
+                       override.gen_var_override):
+            if values:
+                return len(values)
+    return 1
+
+
+def count_solves(work_package: WorkPackageInput) -> Dict[str, int]:
+    """The number of distinct feeders and load flow solves a work package will run."""
+    generator_config = work_package.generator_config
+    solve = generator_config.solve if generator_config is not None else None
+    step_size_minutes = (solve.step_size_minutes if solve is not None else None) or DEFAULT_STEP_SIZE_MINUTES
+
+    configs = []
+    if work_package.forecast_config is not None:
+        forecast = work_package.forecast_config
+        configs += [(feeder, forecast) for feeder in forecast.feeders]
+    if work_package.feeder_configs is not None:
+        configs += [(config.feeder, config) for config in work_package.feeder_configs.configs]
+
+    solves = 0
+    for _, config in configs:
+        if config.fixed_time is not None:
+            steps = _fixed_time_steps(config.fixed_time)
+        else:
+            steps = timesteps(config.time_period.start_time, config.time_period.end_time, step_size_minutes)
+        solves += len(config.years) * len(config.scenarios) * steps
+
+    return {"feeders": len({feeder for feeder, _ in configs}), "solves": solves}
+
+
+def raw_results_enabled(work_package: WorkPackageInput) -> bool:
+    stored = work_package.result_processor_config.stored_results if work_package.result_processor_config else None
+    raw = work_package.generator_config.raw_results if work_package.generator_config else None
+    return any(
+        bool(getattr(config, field, False))
+        for config in (stored, raw) if config is not None
+        for field in ("voltage_exceptions_raw", "overloads_raw", "energy_meters_raw", "energy_meter_voltages_raw")
+    )
+
+
+def estimate(work_package: WorkPackageInput, work_package_name: str, rates: Rates = Rates()) -> Estimate:
+    counts = count_solves(work_package)
+    raw_results = raw_results_enabled(work_package)
+    bytes_per_solve = rates.raw_bytes_per_solve if raw_results else rates.bytes_per_solve
+    return Estimate(
+        work_package_name=work_package_name,
+        feeders=counts["feeders"],
+        solves=counts["solves"],
+        raw_results=raw_results,
+        runtime_seconds=counts["solves"] * rates.seconds_per_solve,
+        output_bytes=counts["solves"] * bytes_per_solve,
+    )
+
+
+def over_budget(estimates: List[Estimate], budget: Dict) -> List[str]:
+    """
+    Check the combined estimates against a budget with any of max_solves, max_runtime_hours and max_output_gb, and return
+    a description of each limit exceeded.
+    """
+    totals = {
+        "max_solves": (f"{sum(e.solves for e in estimates):,}", sum(e.solves for e in estimates), "solves"),
+        "max_runtime_hours": (None, sum(e.runtime_seconds for e in estimates) / 3600, "runtime hours"),
+        "max_output_gb": (None, sum(e.output_bytes for e in estimates) / 1e9, "output GB"),
+    }
+    return [
+        f"{formatted or f'{total:,.2f}'} {description} exceeds the budget of {budget[limit]:,}"
+        for limit, (formatted, total, description) in totals.items()
+        if budget.get(limit) is not None and total > budget[limit]
+    ]
+
+
+def print_estimates(estimates: List[Estimate]):
+    for e in estimates:
+        print(f"{e.work_package_name} feeders={e.feeders} solves={e.solves:,} raw_results={e.raw_results} "
+              f"runtime={e.runtime_seconds / 3600:,.2f}h output={e.output_bytes / 1e9:,.2f}GB")
+    if len(estimates) > 1:
+        print(f"total solves={sum(e.solves for e in estimates):,} "
+              f"runtime={sum(e.runtime_seconds for e in estimates) / 3600:,.2f}h "
+              f"output={sum(e.output_bytes for e in estimates) / 1e9:,.2f}GB")
+
+
+def history_path(config_dir: str) -> str:
+    return f"{config_dir}/{HISTORY_FILE_NAME}"
+
+
+class CostHistory:
+    """The cost history at `path`: the solve count, runtime and output volume of past work packages."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+        # Histories created before statuses were recorded.
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(runs)")}
+        if "status" not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE runs ADD COLUMN status TEXT")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_submission(self, work_package_id: str, estimate: Estimate):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO runs (work_package_id, work_package_name, solves, raw_results, submitted_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (work_package_id, estimate.work_package_name, estimate.solves, estimate.raw_results, time.time()),
+            )
+
+    def record_output(self, work_package_id: str, output_bytes: int):
+        """Record the measured output volume of a work package, e.g. from the size of its exported results."""
+        with self.connection:
+            self.connection.execute("UPDATE runs SET output_bytes = ? WHERE work_package_id = ?", (output_bytes, work_package_id))
+
+    def unfinished(self) -> List[str]:
+        """The recorded work packages that hadn't finished, and weren't deleted, when they were last checked."""
+        statuses = tuple(FINAL_STATUSES | {DELETED})
+        return [row[0] for row in self.connection.execute(
+            f"SELECT work_package_id FROM runs WHERE status IS NULL OR status NOT IN ({', '.join('?' * len(statuses))})",
+            statuses,
+        )]
+
+    async def refresh(self, eas_client: EasClient, max_in_flight: int = 8):
+        """
+        Fill in the status of recorded work packages that hadn't finished when they were last checked, and the runtime
+        of those that have since completed. Work packages that have finished or been deleted aren't queried again.
+        """
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def fetch(work_package_id: str) -> Optional[Dict]:
+            async with semaphore:
+                try:
+                    result = await eas_client.query(
+                        Query.get_work_package_by_id(work_package_id),
+                        HcWorkPackageFields.status,
+                        HcWorkPackageFields.is_deleted,
+                        HcWorkPackageFields.created_at,
+                        HcWorkPackageFields.completed_at,
+                    )
+                    return {"work_package": result["data"]["getWorkPackageById"]}
+                except Exception as e:
+                    logger.warning(f"Failed to get runtime of work package {work_package_id}: {e}")
+                    return None
+
+        unfinished = self.unfinished()
+        results = await asyncio.gather(*(fetch(work_package_id) for work_package_id in unfinished))
+        with self.connection:
+            for work_package_id, result in zip(unfinished, results):
+                if result is None:
+                    continue
+                work_package = result["work_package"]
+                if work_package is None or work_package["isDeleted"]:
+                    self.connection.execute("UPDATE runs SET status = ? WHERE work_package_id = ?", (DELETED, work_package_id))
+                    continue
+
+                runtime = None
+                if work_package["status"] == WorkPackageState.COMPLETED.value and work_package["completedAt"]:
+                    runtime = _parse_time(work_package["completedAt"]) - _parse_time(work_package["createdAt"])
+                self.connection.execute(
+                    "UPDATE runs SET status = ?, runtime_seconds = COALESCE(?, runtime_seconds) WHERE work_package_id = ?",
+                    (work_package["status"], runtime, work_package_id),
+                )
+
+    def rates(self) -> Rates:
+        """Per-solve rates fitted to the completed runs in the history, falling back to the defaults where there are none."""
+        defaults = Rates()
+        [(solves, seconds)] = self.connection.execute(
+            "SELECT SUM(solves), SUM(runtime_seconds) FROM runs WHERE runtime_seconds IS NOT NULL AND solves > 0"
+        )
+        output = dict(
+            (bool(raw), (solves_, bytes_))
+            for raw, solves_, bytes_ in self.connection.execute(
+                "SELECT raw_results, SUM(solves), SUM(output_bytes) FROM runs "
+                "WHERE output_bytes IS NOT NULL AND solves > 0 GROUP BY raw_results"
+            )
+        )
+        return Rates(
+            seconds_per_solve=seconds / solves if solves else defaults.seconds_per_solve,
+            bytes_per_solve=output[False][1] / output[False][0] if False in output else defaults.bytes_per_solve,
+            raw_bytes_per_solve=output[True][1] / output[True][0] if True in output else defaults.raw_bytes_per_solve,
+        )
+
+
+def _parse_time(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+async def estimate_plan(eas_client: EasClient, config_dir: str, planned: Iterable[Tuple[str, WorkPackageInput]]) -> List[Estimate]:
+    """
+    Estimate each planned `(work_package_name, work_package)` with rates fitted to the cost history in `config_dir`.
+    `planned` can be a generator that builds each work package as it is needed, so only one is held at a time.
+    """
+    with CostHistory(history_path(config_dir)) as history:
+        await history.refresh(eas_client)
+        rates = history.rates()
+    return [estimate(work_package, name, rates) for name, work_package in planned]
+
+
+def record_submissions(config_dir: str, estimates: List[Estimate], submitted: Dict[str, str]):
+    """Record the estimates of the work packages that were submitted, given as a map of work package name to ID."""
+    with CostHistory(history_path(config_dir)) as history:
+        for e in estimates:
+            if submitted.get(e.work_package_name) is not None:
+                history.record_submission(submitted[e.work_package_name], e)
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import sys
+
+from clients import ClientManager
+from cost_estimate import CostHistory, history_path
+from results_export import RESULT_TABLES, ResultTable, enabled_tables, export_results, exported_bytes, \
+    fetch_work_package, print_export_summary
+from utils import get_config, get_config_dir, get_option, read_auth_config
+
+"""
+Export the results of a finished work package to Parquet files partitioned by table, feeder, year and scenario:
+
+    ./export_results.py ./config --id=<work package ID> [--output=<directory>]
+
+Exports the enhanced metrics and, when the work package was configured to write them, the enhanced metrics profiles and
+the raw voltage exception and overload results. Results are read from the results database configured as
+`results_database` in auth_config.json. See results_export.py for the file layout.
+"""
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    work_package_id = get_option(argv, "--id") or input("Work package ID to export: ")
+
+    # Settings for the export can be set under results_export in config.json:
+    #   output_dir: where to write the files, by default results/<work package ID> in the config directory.
+    #   tables: result table names in the results database, keyed by export name, to override those in RESULT_TABLES.
+    #   page_size: rows fetched and written at a time for each partition.
+    #   max_in_flight: number of partitions exported at once, and the size of the database connection pool.
+    #   record_output_volume: whether to record the size of the exported files as the work package's output volume in
+    #     the cost history, so output volume estimates (see cost_estimate.py) are fitted to real runs. Only complete
+    #     exports are recorded. Defaults to true.
+    export_config = config.get("results_export", {})
+    output_dir = get_option(argv, "--output") \
+        or os.path.join(export_config.get("output_dir", os.path.join(config_dir, "results")), work_package_id)
+    tables = {name: ResultTable(export_config.get("tables", {}).get(name, table.table), table.enabled_by)
+              for name, table in RESULT_TABLES.items()}
+
+    async with ClientManager(config_dir) as clients:
+        work_package = await fetch_work_package(clients.eas_client, work_package_id)
+
+    entries = await export_results(
+        read_auth_config(config_dir)["results_database"],
+        work_package,
+        output_dir,
+        enabled_tables(work_package, tables),
+        page_size=export_config.get("page_size", 50_000),
+        max_in_flight=export_config.get("max_in_flight", 4),
+    )
+    print_export_summary(entries)
+
+    # Taken from the files just written rather than measured in the results database, which would scan the results again.
+    if export_config.get("record_output_volume", True) and not any(entry["status"] == "FAILED" for entry in entries):
+        output_bytes = exported_bytes(entries)
+        with CostHistory(history_path(config_dir)) as history:
+            history.record_output(work_package_id, output_bytes)
+        print(f"Results of {work_package['name']} take up {output_bytes / 1e9:,.2f}GB exported")
+    print(f"Results of {work_package['name']} written to {output_dir}")
+    return 1 if any(entry["status"] == "FAILED" for entry in entries) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv)))
@@ -0,0 +1,135 @@
+"""
+Per-feeder size metrics from EWB, used to balance the runtime of work package shards.
+
+A feeder's runtime grows with the size of its model, so each feeder is weighted by its energy consumer and conductor
+counts, including the LV feeders it energises. Sizes are fetched feeder by feeder with NetworkConsumerClient and cached in
+the config directory, so only feeders that are new or whose size is older than the TTL are fetched again. A feeder whose
+size can't be fetched keeps its stale cached size, or is otherwise given the median size of the others, so one bad
+feeder only makes the balance a little worse rather than stopping the submission.
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from clients import ClientManager
+from utils import logger
+
+CACHE_FILE_NAME = "feeder_sizes_cache.json"
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Relative cost of an energy consumer and a conductor. Load flow time is dominated by the number of loads, with the
+# number of lines mostly adding to model build time.
+CONSUMER_WEIGHT = 1.0
+CONDUCTOR_WEIGHT = 0.2
+
+
+class FeederSize(NamedTuple):
+    mrid: str
+    energy_consumers: int
+    conductors: int
+
+    @property
+    def weight(self) -> float:
+        # Every feeder has some fixed cost (model build, result processing), so empty feeders still count for something.
+        return 1.0 + CONSUMER_WEIGHT * self.energy_consumers + CONDUCTOR_WEIGHT * self.conductors
+
+
+def cache_path(config_dir: str) -> str:
+    return f"{config_dir}/{CACHE_FILE_NAME}"
+
+
+def read_cache(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path) as file:
+            return json.load(file)["feeders"]
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_cache(path: str, cached: Dict[str, Dict]):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump({"feeders": cached}, file, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+
+async def fetch_feeder_size(clients: ClientManager, feeder: str) -> FeederSize:
+    # Imported here as sharding uses pack_feeders without needing EWB at all.
+    from zepben.ewb import Conductor, EnergyConsumer, IncludedEnergizedContainers
+
+    # Only the equipment itself is needed, not the references fetched by get_equipment_container.
+    result = (await clients.network_consumer_client().get_equipment_for_container(
+        feeder,
+        include_energized_containers=IncludedEnergizedContainers.LV_FEEDERS,
+    )).throw_on_error().value
+    objects = result.objects.values()
+    return FeederSize(
+        mrid=feeder,
+        energy_consumers=sum(isinstance(o, EnergyConsumer) for o in objects),
+        conductors=sum(isinstance(o, Conductor) for o in objects),
+    )
+
+
+async def load_feeder_sizes(
+    clients: ClientManager,
+    feeders: Iterable[str],
+    ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    max_in_flight: int = 4,
+) -> Dict[str, FeederSize]:
+    """The size of each feeder, from the cache where it is fresh enough and otherwise fetched from EWB."""
+    feeders = list(feeders)
+    path = cache_path(clients.config_dir)
+    cached = read_cache(path)
+    now = time.time()
+    stale = [f for f in feeders if f not in cached or now - cached[f]["fetched_at"] > ttl_seconds]
+
+    if stale:
+        logger.info(f"Fetching sizes of {len(stale)} feeders from EWB")
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def fetch(feeder: str) -> Optional[FeederSize]:
+            async with semaphore:
+                try:
+                    return await fetch_feeder_size(clients, feeder)
+                except Exception as e:
+                    logger.warning(f"Failed to fetch the size of feeder {feeder}, estimating it: {e}")
+                    return None
+
+        fetched = [size for size in await asyncio.gather(*(fetch(f) for f in stale)) if size is not None]
+        for size in fetched:
+            cached[size.mrid] = {"energy_consumers": size.energy_consumers, "conductors": size.conductors, "fetched_at": now}
+        if fetched:
+            write_cache(path, cached)
+
+    sizes = {f: FeederSize(f, cached[f]["energy_consumers"], cached[f]["conductors"]) for f in feeders if f in cached}
+    missing = [f for f in feeders if f not in sizes]
+    if missing:
+        known = sorted(sizes.values(), key=lambda size: size.weight)
+        median = known[len(known) // 2] if known else FeederSize("", 0, 0)
+        sizes.update({f: median._replace(mrid=f) for f in missing})
+    return {f: sizes[f] for f in feeders}
+
+
+def pack_feeders(weights: Dict[str, float], bins: int, max_per_bin: int = None) -> List[List[str]]:
+    """
+    Pack feeders into `bins` groups of roughly equal total weight with the longest-processing-time heuristic: feeders are
+    taken heaviest first and each goes to the lightest group that still has room for it. Groups hold at most
+    `max_per_bin` feeders if set.
+    """
+    max_per_bin = max_per_bin or len(weights)
+    if bins * max_per_bin < len(weights):
+        raise ValueError(f"{len(weights)} feeders don't fit in {bins} groups of at most {max_per_bin}")
+
+    groups = [[] for _ in range(bins)]
+    heap = [(0.0, i) for i in range(bins)]
+    for feeder in sorted(weights, key=lambda f: (-weights[f], f)):
+        load, i = heapq.heappop(heap)
+        groups[i].append(feeder)
+        # Full groups are left off the heap so nothing more is added to them.
+        if len(groups[i]) < max_per_bin:
+            heapq.heappush(heap, (load + weights[feeder], i))
+    return [sorted(group) for group in groups if group]
@@ -1,32 +1,42 @@
 import asyncio
 import sys
-import pprint
 
-from utils import get_client, get_config_dir
-from zepben.eas import Query
+from clients import ClientManager
+from tap_settings import TapSettingsStore, export_tap_settings, fetch_calibration_sets, store_path
+from utils import get_config, get_config_dir
 
 """
-Get the transformer tap settings generated by a calibration run.
+Export the transformer tap settings generated by calibration runs to the local tap settings store (tap_settings.sqlite
+in the config directory), and print a summary of the calibration sets it holds.
 
-Use the name you provided in run_calibration.py
+Use the names you provided in run_calibration.py, or set `tap_settings_calibration_sets` in config.json to a list of
+calibration names. By default every calibration set in EAS is exported. Tap settings are fetched for the feeders in
+config.json, skipping the feeders already fetched for each calibration set.
 """
 
-CALIBRATION_NAME = "<CALIBRATION NAME>"  # Name the calibration run to fetch calibration sets for
+CALIBRATION_NAMES = []  # Names of the calibration runs to fetch tap settings for, overrides config.json if not empty
 
 
-async def print_loop(argv):
+async def main(argv):
     config_dir = get_config_dir(argv)
-    eas_client = get_client(config_dir)
+    config = get_config(config_dir)
 
-    print("Press Ctrl+C to exit")
-    try:
-        result = await eas_client.query(Query.get_transformer_tap_settings(CALIBRATION_NAME))
-        pprint.pprint(result)
-    except Exception as e:
-        print(e)
+    async with ClientManager(config_dir) as clients:
+        calibration_sets = CALIBRATION_NAMES or config.get("tap_settings_calibration_sets") \
+            or await fetch_calibration_sets(clients.eas_client)
 
-    await eas_client.close()
+        with TapSettingsStore(store_path(config_dir)) as store:
+            await export_tap_settings(
+                clients.eas_client,
+                store,
+                calibration_sets,
+                config["feeders"],
+                max_in_flight=config.get("max_in_flight_queries", 8),
+            )
+
+            for name, summary in sorted(store.calibration_sets().items()):
+                print(f'{name}: {summary["transformers"]} transformers on {summary["feeders"]} feeders')
 
 
 if __name__ == "__main__":
-    asyncio.run(print_loop(sys.argv))
+    asyncio.run(main(sys.argv))
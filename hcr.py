@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+A single entry point for the runner scripts:
+
+    ./hcr.py submit forecast ./config [--resume] [--estimate-only] [--over-budget]
+    ./hcr.py submit override|intrinsic-search|default-load|span-level ./config
+    ./hcr.py submit intrinsic ./config [--resume]
+    ./hcr.py submit parameter-sweep ./config [--resume]
+    ./hcr.py calibrate ./config
+    ./hcr.py sweep ./config [--resume]
+    ./hcr.py monitor ./config [--work-packages=<IDs>] [--calibrations=<IDs>] [--manifest=<path>]
+    ./hcr.py cancel ./config --id <work package ID>
+    ./hcr.py fetch-taps ./config
+    ./hcr.py export ./config --id <work package ID> [--output <directory>]
+    ./hcr.py queue add ./config --kind <kind> [--priority urgent|normal|bulk] [--study <directory>] [--job <label>]
+    ./hcr.py queue list ./config [--job <label>]
+    ./hcr.py queue run ./config [--until-empty]
+
+Each subcommand runs the main function of the matching script with the same arguments the script takes. A script is only
+imported once its subcommand has been chosen, so `--help` and argument errors return immediately, and only the
+commands that talk to EWB load the EWB SDK.
+
+Pass --timings before the subcommand to log how long the import and the run took, e.g. to keep an eye on cold start when
+running in a shell loop or from cron. benchmarks/run_benchmarks.py tracks cold start for each subcommand.
+"""
+
+import time
+
+# Taken before anything else is imported, so --timings includes it.
+START = time.perf_counter()
+
+import argparse
+import asyncio
+import importlib
+import sys
+from typing import Dict, NamedTuple, Tuple
+
+
+class Command(NamedTuple):
+    module: str
+    function: str
+    help: str
+    flags: Tuple[str, ...] = ()
+
+
+COMMANDS: Dict[Tuple[str, ...], Command] = {
+    ("submit", "forecast"): Command(
+        "run_forecast_work_package", "main", "Submit forecast work packages for the feeders, years and scenarios in config.json.",
+        ("--resume", "--estimate-only", "--over-budget"),
+    ),
+    ("submit", "override"): Command(
+        "run_feeder_override_work_package", "main", "Submit fixed time work packages with load overrides.",
+    ),
+    ("submit", "intrinsic"): Command(
+        "run_intrinsic_work_package", "main", "Submit an intrinsic hosting capacity work package, or a fan-out of them.",
+        ("--resume",),
+    ),
+    ("submit", "intrinsic-search"): Command(
+        "run_intrinsic_search", "main", "Submit the next round of the coarse-to-fine intrinsic search.", ("--resume",),
+    ),
+    ("submit", "default-load"): Command(
+        "run_default_load_work_package", "main", "Submit a work package with default load and generation profiles.",
+    ),
+    ("submit", "span-level"): Command(
+        "run_span_level_threshold_work_package", "main", "Submit a work package with span level thresholds.",
+    ),
+    ("submit", "parameter-sweep"): Command(
+        "run_parameter_sweep", "main", "Submit a forecast work package per point of a model parameter sweep.", ("--resume",),
+    ),
+    ("calibrate",): Command("run_calibration", "main", "Run a calibration."),
+    ("sweep",): Command(
+        "run_calibration_sweep", "main", "Run a calibration for each configured time period.", ("--resume",),
+    ),
+    ("monitor",): Command(
+        "monitor_progress", "print_loop", "Monitor all active work packages, or the given jobs until they finish.",
+    ),
+    ("cancel",): Command("cancel_work_package", "main", "Cancel a work package."),
+    ("fetch-taps",): Command(
+        "get_calibration_transformer_settings", "main", "Export calibrated transformer tap settings to the local store.",
+    ),
+    ("export",): Command("export_results", "main", "Export the results of a finished work package to Parquet."),
+    ("queue", "add"): Command("queue_jobs", "main", "Plan a job from config.json and add it to the job queue."),
+    ("queue", "list"): Command("queue_jobs", "list_jobs", "List the entries of the job queue."),
+    ("queue", "run"): Command(
+        "run_job_queue", "main", "Release queued jobs to EAS, keeping the number of active work packages under a limit.",
+        ("--until-empty",),
+    ),
+}
+
+# Help for the groups of subcommands.
+GROUPS = {("submit",): "Submit a work package.", ("queue",): "Queue jobs and run the job queue."}
+
+# Options that take a value, passed on to the script as --option=value.
+OPTIONS = {
+    ("monitor",): {
+        "--work-packages": "Comma separated work package IDs to follow until they finish.",
+        "--calibrations": "Comma separated calibration run IDs to follow until they finish.",
+        "--manifest": "Sharding manifest whose work packages to follow until they finish.",
+    },
+    ("cancel",): {"--id": "ID of the work package to cancel. Prompted for if not given."},
+    ("export",): {
+        "--id": "ID of the work package to export. Prompted for if not given.",
+        "--output": "Directory to write the Parquet files to. Defaults to results/<ID> in the config directory.",
+    },
+    ("queue", "add"): {
+        "--kind": "Kind of job: forecast, override, intrinsic or calibration.",
+        "--priority": "Priority class: urgent, normal (the default) or bulk.",
+        "--study": "Directory with the config.json to plan the job from. Defaults to the config directory.",
+        "--job": "Label for the job. Defaults to the work_package_name in config.json.",
+    },
+    ("queue", "list"): {"--job": "Only list the entries of this job."},
+    ("submit", "intrinsic-search"): {"--headroom": "Headroom CSV of the last round. Prompted for if needed and not given."},
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="hcr", description="Run hosting capacity work packages and calibrations.")
+    parser.add_argument("--timings", action="store_true", help="Log the import and run time of the command")
+    subparsers = {(): parser.add_subparsers(dest="command", required=True)}
+
+    for path, command in COMMANDS.items():
+        for depth in range(1, len(path)):
+            if path[:depth] not in subparsers:
+                help_text = GROUPS.get(path[:depth])
+                group = subparsers[path[:depth - 1]].add_parser(path[depth - 1], help=help_text, description=help_text)
+                subparsers[path[:depth]] = group.add_subparsers(dest=f"command_{depth}", required=True)
+
+        leaf = subparsers[path[:-1]].add_parser(path[-1], help=command.help, description=command.help)
+        leaf.add_argument("config_dir", nargs="?", default=".", help="Directory with config.json and auth_config.json")
+        for flag in command.flags:
+            leaf.add_argument(flag, action="store_true")
+        for option, help_text in OPTIONS.get(path, {}).items():
+            leaf.add_argument(option, help=help_text)
+        leaf.set_defaults(path=path)
+    return parser
+
+
+def script_argv(args: argparse.Namespace) -> list:
+    """The argv the script would have been run with."""
+    command = COMMANDS[args.path]
+    argv = [f"{command.module}.py", args.config_dir]
+    argv += [flag for flag in command.flags if getattr(args, flag.lstrip("-").replace("-", "_"))]
+    for option in OPTIONS.get(args.path, {}):
+        value = getattr(args, option.lstrip("-").replace("-", "_"))
+        if value is not None:
+            argv.append(f"{option}={value}")
+    return argv
+
+
+def main(argv) -> int:
+    args = build_parser().parse_args(argv[1:])
+    command = COMMANDS[args.path]
+
+    parsed = time.perf_counter()
+    run = getattr(importlib.import_module(command.module), command.function)
+    started = time.perf_counter()
+    result = asyncio.run(run(script_argv(args)))
+
+    if args.timings:
+        print(f"hcr {' '.join(args.path)}: startup {parsed - START:.3f}s, import {started - parsed:.3f}s, "
+              f"run {time.perf_counter() - started:.3f}s", file=sys.stderr)
+    return result if isinstance(result, int) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,120 @@
+"""
+Local on-disk cache of the feeder hierarchy (feeder mRIDs and names, their energising substations and zones), so scripts
+that only need to know which feeders exist don't have to fetch the network hierarchy from EWB on every run.
+
+The cache is a columnar JSON file in the config directory. It is refreshed from EWB when it is older than the configured
+TTL, or when a refresh is forced.
+"""
+
+import json
+import os
+import time
+from typing import List, NamedTuple, Optional
+
+from clients import ClientManager
+from utils import get_ewb_channel, logger
+
+CACHE_FILE_NAME = "feeder_hierarchy_cache.json"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+class FeederRecord(NamedTuple):
+    mrid: str
+    name: Optional[str]
+    substation: Optional[str]
+    substation_name: Optional[str]
+    sub_geographical_region: Optional[str]
+    geographical_region: Optional[str]
+
+
+def cache_path(config_dir: str) -> str:
+    return f"{config_dir}/{CACHE_FILE_NAME}"
+
+
+def read_cache(path: str, ttl_seconds: float) -> Optional[List[FeederRecord]]:
+    """Read the cached feeder records, or None if there is no cache or it is older than `ttl_seconds`."""
+    try:
+        with open(path) as file:
+            cache = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if time.time() - cache["fetched_at"] > ttl_seconds:
+        return None
+
+    columns = cache["columns"]
+    return [FeederRecord(*row) for row in zip(*(columns[field] for field in FeederRecord._fields))]
+
+
+def write_cache(path: str, records: List[FeederRecord]):
+    cache = {
+        "fetched_at": time.time(),
+        "columns": {field: [getattr(r, field) for r in records] for field in FeederRecord._fields},
+    }
+    # Write to a temporary file first so a crash part way through never leaves a truncated cache behind.
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(cache, file, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+
+async def fetch_feeder_records(config_dir: str, clients: Optional[ClientManager] = None) -> List[FeederRecord]:
+    """
+    Fetch the feeder hierarchy from EWB, skipping the parts of the hierarchy that aren't cached. Uses the shared channel
+    from `clients` if provided, otherwise opens and closes a channel of its own.
+    """
+    from zepben.ewb import NetworkConsumerClient
+
+    channel = get_ewb_channel(config_dir) if clients is None else None
+    try:
+        client = clients.network_consumer_client() if clients is not None else NetworkConsumerClient(channel)
+        hierarchy = (await client.get_network_hierarchy(
+            include_circuits=False,
+            include_loops=False,
+            include_lv_substations=False,
+            include_lv_feeders=False,
+        )).throw_on_error().value
+    finally:
+        if channel is not None:
+            await channel.close()
+
+    records = []
+    for feeder in hierarchy.feeders.values():
+        substation = feeder.normal_energizing_substation
+        sub_geographical_region = substation.sub_geographical_region if substation else None
+        geographical_region = sub_geographical_region.geographical_region if sub_geographical_region else None
+        records.append(FeederRecord(
+            mrid=feeder.mrid,
+            name=feeder.name,
+            substation=substation.mrid if substation else None,
+            substation_name=substation.name if substation else None,
+            sub_geographical_region=sub_geographical_region.name if sub_geographical_region else None,
+            geographical_region=geographical_region.name if geographical_region else None,
+        ))
+    return sorted(records, key=lambda r: r.mrid)
+
+
+async def load_feeder_records(
+    config_dir: str,
+    ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    force_refresh: bool = False,
+    clients: Optional[ClientManager] = None,
+) -> List[FeederRecord]:
+    """
+    Return the feeder hierarchy from the local cache, fetching it from EWB only if the cache is missing, older than
+    `ttl_seconds`, or `force_refresh` is set.
+    """
+    path = cache_path(config_dir)
+    if not force_refresh:
+        records = read_cache(path, ttl_seconds)
+        if records is not None:
+            return records
+
+    previous = {r.mrid for r in read_cache(path, float("inf")) or []}
+    records = await fetch_feeder_records(config_dir, clients)
+    write_cache(path, records)
+
+    current = {r.mrid for r in records}
+    logger.info(f"Refreshed feeder hierarchy cache: {len(records)} feeders "
+                f"({len(current - previous)} added, {len(previous - current)} removed)")
+    return records
@@ -0,0 +1,373 @@
+"""
+Latency and throughput instrumentation for every EAS and EWB call made through utils.get_client and
+utils.get_ewb_channel (and so ClientManager).
+
+Enable it with an `instrumentation` section in **config.json**:
+
+    "instrumentation": {
+        "output": "metrics.prom",   # relative to the config directory. .prom for Prometheus text, .jsonl for JSON lines
+        "cprofile": false,          # also profile the client process, written to <output>.cprofile
+        "tracemalloc": false        # also trace allocations, with the top allocation sites written to <output>.tracemalloc.txt
+    }
+
+For each operation (the GraphQL field names of an EAS call, or the RPC method of an EWB call) the calls, errors by class,
+retries, request and response bytes and a latency histogram are recorded. EAS latency is also split into phases so it's
+clear where the time goes:
+
+- build: building the GraphQL document and serialising the input variables,
+- serialise: encoding the request body,
+- wait: sending the request until the response is read - the network and the server,
+- decode: parsing the response.
+
+The metrics are written when the process exits. The Prometheus text file is replaced on each run, so it suits a textfile
+collector; JSON lines are appended, one line per operation per run.
+"""
+
+import atexit
+import bisect
+import cProfile
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import grpc.aio
+    from zepben.eas.client.eas_client import EasClient
+
+logger = logging.getLogger()
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+# The EAS call in progress in the current task, which the execute and get_data wrappers add their phase timings to.
+_current_eas_call: ContextVar[Optional[Dict]] = ContextVar("_current_eas_call", default=None)
+
+
+class OperationStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors: Dict[str, int] = {}
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.phase_seconds: Dict[str, float] = {}
+
+    def to_json(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "latency_seconds_sum": self.latency_sum,
+            "latency_buckets": {_le(le): count for le, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+            "phase_seconds": self.phase_seconds,
+        }
+
+
+class Metrics:
+    """Call metrics keyed by `(service, operation)`. Safe to update from several threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations: Dict[Tuple[str, str], OperationStats] = {}
+
+    def _stats(self, service: str, operation: str) -> OperationStats:
+        key = (service, operation)
+        if key not in self.operations:
+            self.operations[key] = OperationStats()
+        return self.operations[key]
+
+    def observe(
+        self,
+        service: str,
+        operation: str,
+        seconds: float,
+        request_bytes: int = 0,
+        response_bytes: int = 0,
+        error: Optional[BaseException] = None,
+        phases: Optional[Dict[str, float]] = None,
+    ):
+        with self.lock:
+            stats = self._stats(service, operation)
+            stats.calls += 1
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            stats.latency_sum += seconds
+            stats.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if error is not None:
+                error_class = classify_error(error)
+                stats.errors[error_class] = stats.errors.get(error_class, 0) + 1
+            for phase, phase_seconds in (phases or {}).items():
+                stats.phase_seconds[phase] = stats.phase_seconds.get(phase, 0.0) + phase_seconds
+
+    def retry(self, service: str, operation: str):
+        """Count a retry of an operation. Call this from retry loops, before the repeated attempt."""
+        with self.lock:
+            self._stats(service, operation).retries += 1
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP hcr_client_{name} {help_text}")
+            lines.append(f"# TYPE hcr_client_{name} {kind}")
+            lines.extend(f"hcr_client_{sample_name}{_labels(labels)} {value}" for sample_name, labels, value in samples)
+
+        with self.lock:
+            operations = [({"service": service, "operation": operation}, s)
+                          for (service, operation), s in sorted(self.operations.items())]
+            metric("requests_total", "counter", "Calls made.",
+                   [("requests_total", op, s.calls) for op, s in operations])
+            metric("errors_total", "counter", "Calls that failed, by error class.",
+                   [("errors_total", {**op, "error": e}, n) for op, s in operations for e, n in sorted(s.errors.items())])
+            metric("retries_total", "counter", "Calls retried.",
+                   [("retries_total", op, s.retries) for op, s in operations])
+            metric("request_bytes_total", "counter", "Request payload bytes sent.",
+                   [("request_bytes_total", op, s.request_bytes) for op, s in operations])
+            metric("response_bytes_total", "counter", "Response payload bytes received.",
+                   [("response_bytes_total", op, s.response_bytes) for op, s in operations])
+            metric("phase_seconds_total", "counter", "Time spent in each phase of EAS calls.",
+                   [("phase_seconds_total", {**op, "phase": p}, t) for op, s in operations for p, t in sorted(s.phase_seconds.items())])
+
+            samples = []
+            for op, s in operations:
+                cumulative = 0
+                for le, count in zip(LATENCY_BUCKETS, s.latency_buckets):
+                    cumulative += count
+                    samples.append(("latency_seconds_bucket", {**op, "le": _le(le)}, cumulative))
+                samples.append(("latency_seconds_sum", op, s.latency_sum))
+                samples.append(("latency_seconds_count", op, s.calls))
+            metric("latency_seconds", "histogram", "Call latency.", samples)
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        now = time.time()
+        with self.lock:
+            return "".join(
+                json.dumps({"time": now, "pid": os.getpid(), "service": service, "operation": operation, **s.to_json()}) + "\n"
+                for (service, operation), s in sorted(self.operations.items())
+            )
+
+    def write(self, path: str):
+        if path.endswith(".jsonl"):
+            with open(path, "a") as file:
+                file.write(self.to_jsonl())
+        else:
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w") as file:
+                file.write(self.to_prometheus())
+            os.replace(temp_path, path)
+
+
+# The metrics for this process, which instrumented clients record to unless given their own.
+METRICS = Metrics()
+
+
+def _le(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def classify_error(error: BaseException) -> str:
+    # Only check against the SDK's error types if they're already loaded - an error can't be one of them otherwise, and
+    # utils imports this module before anything needs either SDK.
+    eas_lib = sys.modules.get("zepben.eas.lib")
+    if eas_lib is not None and isinstance(error, eas_lib.GraphQLClientHttpError):
+        return f"{type(error).__name__}({error.status_code})"
+    grpc = sys.modules.get("grpc")
+    if grpc is not None and isinstance(error, grpc.aio.AioRpcError):
+        return f"{type(error).__name__}({error.code().name})"
+    return type(error).__name__
+
+
+def instrument_eas_client(eas_client: "EasClient", metrics: Metrics = METRICS) -> "EasClient":
+    """Record every query, mutation and custom operation made with `eas_client` to `metrics`."""
+    execute_custom_operation = eas_client.execute_custom_operation
+    execute = eas_client.execute
+    get_data = eas_client.get_data
+
+    # query and mutation both go through execute_custom_operation, which calls execute then get_data. Wrapping them on
+    # the instance means the SDK's own calls pick the wrappers up.
+    async def instrumented_execute_custom_operation(*fields, operation_type, operation_name=None):
+        call = {"operation": operation_name or "-".join(f._field_name for f in fields), "phases": {}}
+        token = _current_eas_call.set(call)
+        start = time.perf_counter()
+        error = None
+        try:
+            return await execute_custom_operation(*fields, operation_type=operation_type, operation_name=operation_name)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _current_eas_call.reset(token)
+            seconds = time.perf_counter() - start
+            phases = call["phases"]
+            if "execute" in phases:
+                phases["build"] = seconds - phases.pop("execute") - phases.get("decode", 0.0)
+            metrics.observe("eas", call["operation"], seconds, call.get("request_bytes", 0), call.get("response_bytes", 0),
+                            error, phases)
+
+    async def instrumented_execute(query, operation_name=None, variables=None, **kwargs):
+        start = time.perf_counter()
+        response = await execute(query, operation_name=operation_name, variables=variables, **kwargs)
+        call = _current_eas_call.get()
+        if call is not None:
+            execute_seconds = time.perf_counter() - start
+            # httpx's elapsed runs from sending the request to reading the response, so the rest of execute is spent
+            # encoding the body.
+            wait = response.elapsed.total_seconds()
+            call["phases"].update(execute=execute_seconds, serialise=max(0.0, execute_seconds - wait), wait=wait)
+            call["request_bytes"] = len(response.request.content)
+            call["response_bytes"] = response.num_bytes_downloaded
+        return response
+
+    def instrumented_get_data(response):
+        start = time.perf_counter()
+        try:
+            return get_data(response)
+        finally:
+            call = _current_eas_call.get()
+            if call is not None:
+                call["phases"]["decode"] = time.perf_counter() - start
+
+    eas_client.execute_custom_operation = instrumented_execute_custom_operation
+    eas_client.execute = instrumented_execute
+    eas_client.get_data = instrumented_get_data
+    return eas_client
+
+
+class InstrumentedChannel:
+    """
+    A grpc.aio.Channel that records every call made over it to `metrics`, keyed by RPC method. The time spent waiting for
+    each response is recorded separately from the time the caller spends processing the responses of a streaming call.
+    """
+
+    def __init__(self, channel: "grpc.aio.Channel", metrics: Metrics = METRICS):
+        self._channel = channel
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    async def __aenter__(self):
+        await self._channel.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._channel.__aexit__(*exc)
+
+    def unary_unary(self, method, *args, **kwargs):
+        return _InstrumentedMultiCallable(self._channel.unary_unary(method, *args, **kwargs), method, self._metrics, stream=False)
+
+    def unary_stream(self, method, *args, **kwargs):
+        return _InstrumentedMultiCallable(self._channel.unary_stream(method, *args, **kwargs), method, self._metrics, stream=True)
+
+    def stream_unary(self, method, *args, **kwargs):
+        return _InstrumentedMultiCallable(self._channel.stream_unary(method, *args, **kwargs), method, self._metrics, stream=False)
+
+    def stream_stream(self, method, *args, **kwargs):
+        return _InstrumentedMultiCallable(self._channel.stream_stream(method, *args, **kwargs), method, self._metrics, stream=True)
+
+
+class _InstrumentedMultiCallable:
+
+    def __init__(self, multi_callable, method: str, metrics: Metrics, stream: bool):
+        self.multi_callable = multi_callable
+        # e.g. /zepben.protobuf.nc.NetworkConsumer/getNetworkHierarchy
+        self.operation = method.rsplit("/", 1)[-1]
+        self.metrics = metrics
+        self.stream = stream
+
+    def __call__(self, request, *args, **kwargs):
+        call = {"request_bytes": 0, "response_bytes": 0, "wait": 0.0, "start": time.perf_counter()}
+        if hasattr(request, "ByteSize"):
+            call["request_bytes"] = request.ByteSize()
+        else:
+            request = self._count_requests(request, call)
+        responses = self.multi_callable(request, *args, **kwargs)
+        return self._iterate(responses, call) if self.stream else self._await(responses, call)
+
+    @staticmethod
+    async def _count_requests(requests, call: Dict):
+        if hasattr(requests, "__aiter__"):
+            async for request in requests:
+                call["request_bytes"] += request.ByteSize()
+                yield request
+        else:
+            for request in requests:
+                call["request_bytes"] += request.ByteSize()
+                yield request
+
+    def _observe(self, call: Dict, error: Optional[BaseException]):
+        seconds = time.perf_counter() - call["start"]
+        phases = {"wait": call["wait"], "process": max(0.0, seconds - call["wait"])} if self.stream else None
+        self.metrics.observe("ewb", self.operation, seconds, call["request_bytes"], call["response_bytes"], error, phases)
+
+    async def _await(self, responses, call: Dict):
+        try:
+            response = await responses
+        except Exception as e:
+            self._observe(call, e)
+            raise
+        call["response_bytes"] += response.ByteSize()
+        self._observe(call, None)
+        return response
+
+    async def _iterate(self, responses, call: Dict):
+        iterator = responses.__aiter__()
+        error = None
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    response = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    call["wait"] += time.perf_counter() - start
+                call["response_bytes"] += response.ByteSize()
+                yield response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._observe(call, error)
+
+
+def start(output_path: str, cprofile: bool = False, trace_allocations: bool = False, metrics: Metrics = METRICS):
+    """Write `metrics` to `output_path` when the process exits, optionally profiling and tracing allocations until then."""
+    profiler = None
+    if cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if trace_allocations:
+        tracemalloc.start()
+
+    def write():
+        metrics.write(output_path)
+        logger.info(f"Wrote client metrics to {output_path}")
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{output_path}.cprofile")
+        if trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            with open(f"{output_path}.tracemalloc.txt", "w") as file:
+                file.write(f"peak={tracemalloc.get_traced_memory()[1]} bytes\n")
+                file.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:50])
+            tracemalloc.stop()
+
+    atexit.register(write)
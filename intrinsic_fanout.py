@@ -0,0 +1,98 @@
+"""
+Fan an intrinsic hosting capacity study out over scenarios, years, initial state selector modes and injection methods,
+so export and import headroom for a whole planning horizon come from one batch of work packages.
+
+An intrinsic work package runs a single scenario and year with one selector mode and one injection method, so each
+combination is its own run. The base scenario is the as-built network, which doesn't change with the year, so it is run
+for the first year only. Every run is recorded in one index - a CSV with the work package of each scenario, year,
+selector mode and injection method - to find and compare their results by.
+"""
+
+import csv
+import itertools
+from typing import Dict, List, Optional
+
+from zepben.eas import IntrinsicInitialStateSelectorMode, IntrinsicInjectionResourceMethod
+
+BASE_SCENARIO = "base"
+DEFAULT_MAX_RUNS = 500
+
+# The per-customer baseline of the FIXED_LOAD selector mode, set with fixed_load in intrinsic_fanout. The watts are
+# required, the vars default to none.
+FIXED_LOAD_REQUIRED = ("per_customer_load_watts", "per_customer_gen_watts")
+FIXED_LOAD_FIELDS = FIXED_LOAD_REQUIRED + ("per_customer_load_var", "per_customer_gen_var")
+
+INDEX_COLUMNS = ["run", "work_package_name", "work_package_id", "scenario", "year", "selector_mode", "injection_method"]
+
+
+def plan_runs(
+    feeders: List[str],
+    scenarios: List[str],
+    years: List[int],
+    selector_modes: List[str],
+    injection_methods: List[str],
+    max_runs: int = DEFAULT_MAX_RUNS,
+    fixed_load: Optional[Dict] = None,
+) -> List[Dict]:
+    """
+    One run per scenario, year, selector mode and injection method, keyed on "shard" for submit_shards. Modes and
+    methods are given by name, and checked before anything is submitted, as is the `fixed_load` baseline when the
+    FIXED_LOAD mode is used.
+    """
+    for mode in selector_modes:
+        if mode not in IntrinsicInitialStateSelectorMode.__members__:
+            raise ValueError(f"Unknown selector mode {mode}, expected one of "
+                             f"{list(IntrinsicInitialStateSelectorMode.__members__)}")
+    if IntrinsicInitialStateSelectorMode.FIXED_LOAD.name in selector_modes:
+        check_fixed_load(fixed_load)
+    for method in injection_methods:
+        if method not in IntrinsicInjectionResourceMethod.__members__:
+            raise ValueError(f"Unknown injection method {method}, expected one of "
+                             f"{list(IntrinsicInjectionResourceMethod.__members__)}")
+
+    years = sorted(years)
+    scenario_years = [(scenario, year) for scenario in scenarios
+                      for year in (years[:1] if scenario == BASE_SCENARIO else years)]
+    combinations = itertools.product(scenario_years, selector_modes, injection_methods)
+    runs = [
+        {"shard": i, "feeders": feeders, "scenario": scenario, "year": year, "selector_mode": mode,
+         "injection_method": method}
+        for i, ((scenario, year), mode, method) in enumerate(combinations)
+    ]
+    if len(runs) > max_runs:
+        raise ValueError(f"The fan-out has {len(runs)} runs, more than max_runs ({max_runs})")
+    return runs
+
+
+def check_fixed_load(fixed_load: Optional[Dict]):
+    if not fixed_load:
+        raise ValueError(f"The FIXED_LOAD selector mode needs a fixed_load in intrinsic_fanout with "
+                         f"{' and '.join(FIXED_LOAD_REQUIRED)}")
+    unknown = [name for name in fixed_load if name not in FIXED_LOAD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fixed_load settings {unknown}, expected some of {list(FIXED_LOAD_FIELDS)}")
+    missing = [name for name in FIXED_LOAD_REQUIRED if fixed_load.get(name) is None]
+    if missing:
+        raise ValueError(f"The FIXED_LOAD selector mode needs {' and '.join(missing)} in fixed_load")
+
+
+def index_path(config_dir: str, work_package_name: str) -> str:
+    return f"{config_dir}/{work_package_name}.intrinsic_index.csv"
+
+
+def write_index(path: str, entries: List[Dict]):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(INDEX_COLUMNS)
+        for entry in entries:
+            writer.writerow([entry["shard"], entry["work_package_name"], entry["work_package_id"] or "",
+                             entry["scenario"], entry["year"], entry["selector_mode"], entry["injection_method"]])
+
+
+def print_fanout_summary(entries: List[Dict]):
+    submitted = sum(entry["work_package_id"] is not None for entry in entries)
+    print(f"{submitted} of {len(entries)} intrinsic runs submitted")
+    for entry in entries:
+        status = entry["work_package_id"] if entry["work_package_id"] is not None else f"FAILED ({'; '.join(entry['errors'])})"
+        print(f'{entry["work_package_name"]} {entry["scenario"]}/{entry["year"]} {entry["selector_mode"]} '
+              f'{entry["injection_method"]} work_package_id={status}')
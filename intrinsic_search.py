@@ -0,0 +1,147 @@
+"""
+Coarse-to-fine search for intrinsic hosting capacity.
+
+A single intrinsic run with a fine step needs (headroom / step) search steps per feeder to reach its bound. Instead, a
+coarse pass brackets each feeder's bound to within one coarse step, then a fine pass for each feeder starts at the
+bottom of its bracket and searches only that one coarse step. Feeders whose coarse pass hit the search ceiling
+(headroom == step * max_steps) get another coarse pass starting from the ceiling instead.
+
+Passes after the first start from a uniform per-customer baseline equal to the headroom already found, using the
+FIXED_LOAD initial state. That is only equivalent to continuing the original search from a ZERO_LOAD initial state, so
+refinement requires the coarse pass to use ZERO_LOAD.
+
+EAS does not return intrinsic results over its API, so the headroom found by each pass is read back from a CSV exported
+from the results database, with `feeder` and `headroom_kw_per_customer` columns. Headroom in the CSV is relative to the
+baseline the pass was run with - the search state keeps track of each feeder's baseline.
+"""
+
+import csv
+import json
+import math
+from collections import defaultdict
+from typing import Dict, List
+
+from zepben.eas import IntrinsicInitialLoadStateConfigInput, IntrinsicInitialStateSelectorMode, \
+    IntrinsicInjectionResourceConfigInput, IntrinsicInjectionResourceMethod
+
+from utils import logger
+
+SEARCHING = "searching"
+DONE = "done"
+
+
+def new_search_state(feeders: List[str], coarse_step_kw: float, fine_step_kw: float, max_steps: int) -> Dict:
+    if fine_step_kw >= coarse_step_kw:
+        raise ValueError(f"Fine step ({fine_step_kw}kW) must be smaller than the coarse step ({coarse_step_kw}kW)")
+
+    return {
+        "coarse_step_kw": coarse_step_kw,
+        "fine_step_kw": fine_step_kw,
+        "max_steps": max_steps,
+        "round": 0,
+        "feeders": {
+            feeder: {"status": SEARCHING, "baseline_kw": 0.0, "step_kw": coarse_step_kw, "max_steps": max_steps, "headroom_kw": None}
+            for feeder in sorted(feeders)
+        },
+        "passes": [],
+    }
+
+
+def plan_passes(state: Dict) -> List[Dict]:
+    """Group the feeders still being searched into one pass per distinct baseline, step and step count."""
+    groups = defaultdict(list)
+    for feeder, search in state["feeders"].items():
+        if search["status"] == SEARCHING:
+            groups[(search["baseline_kw"], search["step_kw"], search["max_steps"])].append(feeder)
+
+    return [
+        {"shard": i, "feeders": feeders, "baseline_kw": baseline_kw, "step_kw": step_kw, "max_steps": max_steps}
+        for i, ((baseline_kw, step_kw, max_steps), feeders) in enumerate(sorted(groups.items()))
+    ]
+
+
+def apply_headroom(state: Dict, headroom: Dict[str, float]):
+    """
+    Update the search state with the headroom each feeder reached in its last pass, relative to that pass' baseline:
+
+    - feeders that hit the ceiling of their pass continue from the ceiling with the same step,
+    - feeders bracketed by a coarse step are refined from the bottom of the bracket with the fine step,
+    - feeders bracketed by the fine step are done.
+    """
+    fine_step_kw = state["fine_step_kw"]
+    for feeder, search in state["feeders"].items():
+        if search["status"] != SEARCHING:
+            continue
+        if feeder not in headroom:
+            logger.warning(f"No headroom reported for feeder {feeder}, it will be searched again with the same settings")
+            continue
+
+        reached_kw = search["baseline_kw"] + headroom[feeder]
+        ceiling_kw = search["step_kw"] * search["max_steps"]
+        if headroom[feeder] >= ceiling_kw - 1e-9:
+            search["baseline_kw"] = reached_kw
+        elif search["step_kw"] > fine_step_kw:
+            search["baseline_kw"] = reached_kw
+            search["max_steps"] = math.ceil(search["step_kw"] / fine_step_kw)
+            search["step_kw"] = fine_step_kw
+        else:
+            search["status"] = DONE
+            search["headroom_kw"] = reached_kw
+
+
+def total_steps(state: Dict) -> int:
+    """Upper bound on the search steps submitted so far, across all passes."""
+    return sum(len(p["feeders"]) * p["max_steps"] for passes in state["passes"] for p in passes)
+
+
+def baseline_initial_state(
+    config_initial_state: IntrinsicInitialLoadStateConfigInput,
+    baseline_kw: float,
+    injection_resource: IntrinsicInjectionResourceConfigInput,
+) -> IntrinsicInitialLoadStateConfigInput:
+    """The initial state for a pass starting `baseline_kw` per customer above the configured ZERO_LOAD initial state."""
+    if baseline_kw == 0:
+        return config_initial_state
+    if config_initial_state.selector_mode != IntrinsicInitialStateSelectorMode.ZERO_LOAD:
+        raise ValueError("Refining an intrinsic search requires the ZERO_LOAD initial state, "
+                         f"got {config_initial_state.selector_mode}")
+
+    watts = baseline_kw * 1000
+    power_factor = injection_resource.power_factor or 1.0
+    var = watts * math.tan(math.acos(power_factor))
+    exporting = injection_resource.method in (None, IntrinsicInjectionResourceMethod.EXPORT_GENERATION)
+    return IntrinsicInitialLoadStateConfigInput(
+        selector_mode=IntrinsicInitialStateSelectorMode.FIXED_LOAD,
+        start_time=config_initial_state.start_time,
+        per_customer_gen_watts=watts if exporting else 0.0,
+        per_customer_gen_var=var if exporting else 0.0,
+        per_customer_load_watts=0.0 if exporting else watts,
+        per_customer_load_var=0.0 if exporting else var,
+    )
+
+
+def read_headroom_csv(path: str) -> Dict[str, float]:
+    with open(path, newline="") as file:
+        return {row["feeder"]: float(row["headroom_kw_per_customer"]) for row in csv.DictReader(file)}
+
+
+def write_headroom_csv(path: str, state: Dict):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["feeder", "headroom_kw_per_customer", "precision_kw"])
+        for feeder, search in state["feeders"].items():
+            writer.writerow([feeder, search["headroom_kw"], search["step_kw"]])
+
+
+def state_path(config_dir: str, work_package_name: str) -> str:
+    return f"{config_dir}/{work_package_name}.intrinsic_search.json"
+
+
+def read_state(path: str) -> Dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_state(path: str, state: Dict):
+    with open(path, "w") as file:
+        json.dump(state, file, indent=2)
@@ -0,0 +1,246 @@
+"""
+Track any number of work packages and calibration runs until they finish, over a single EAS client.
+
+Each tick sends one GraphQL request covering everything still being tracked:
+
+- getActiveWorkPackages, for the progress of the tracked work packages that are running,
+- an aliased getWorkPackageById for each tracked work package that wasn't active on the previous tick, to find out how it
+  finished (or that it hasn't started yet) - those that drop off the active list are looked up straight away, and
+- an aliased getCalibrationRun for each tracked calibration run.
+
+IDs are deduplicated, jobs are dropped from the request once they reach a terminal state, and JobMonitor.run returns when
+nothing is left to track - so the cost of a tick grows with the number of unfinished jobs, not with the number of
+requests. Very large sets of jobs are split over several requests of at most `max_fields_per_request` fields, sent
+concurrently.
+"""
+
+import asyncio
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from zepben.eas import HcCalibrationFields, HcWorkPackageFields, Query, WorkflowStatus, WorkPackageState
+from zepben.eas.client.eas_client import EasClient
+
+from ledger import FINAL_STATUSES
+from progress import AdaptivePoller, ProgressTracker, extract_progress
+from utils import logger
+
+WORK_PACKAGE = "work_package"
+CALIBRATION = "calibration"
+
+DELETED = "DELETED"
+NOT_FOUND = "NOT_FOUND"
+LOOKUP_FAILED = "LOOKUP_FAILED"
+
+WORK_PACKAGE_TERMINAL_STATUSES = FINAL_STATUSES | {DELETED, NOT_FOUND, LOOKUP_FAILED}
+CALIBRATION_TERMINAL_STATUSES = {WorkflowStatus.COMPLETED.value, WorkflowStatus.FAILED.value, NOT_FOUND, LOOKUP_FAILED}
+
+_ACTIVE_KEY = "getActiveWorkPackages"
+
+
+def _error_key(error) -> Optional[str]:
+    # Errors come back as GraphQLClientGraphQLError objects from the SDK, or as dicts in a returned payload.
+    path = error.get("path") if isinstance(error, dict) else getattr(error, "path", None)
+    return str(path[0]) if path else None
+
+
+def _error_message(error) -> str:
+    return error.get("message", str(error)) if isinstance(error, dict) else getattr(error, "message", str(error))
+
+
+def _work_package_field(job: Dict):
+    return Query.get_work_package_by_id(job["id"]).fields(HcWorkPackageFields.status, HcWorkPackageFields.is_deleted)
+
+
+def _calibration_field(job: Dict):
+    return Query.get_calibration_run(id=job["id"]).fields(HcCalibrationFields.status, HcCalibrationFields.completed_at)
+
+
+class JobMonitor:
+    """
+    The work packages and calibration runs being monitored, and their last known state.
+
+    Each job is a dict with its `kind` (WORK_PACKAGE or CALIBRATION), `id`, `status`, `progress` (percent, work packages
+    only), `completed_at` (calibrations only), `finished` and `errors`. A job whose lookup fails `max_lookup_errors` ticks
+    in a row is given up on with status LOOKUP_FAILED, and one EAS doesn't know of is finished with status NOT_FOUND.
+    """
+
+    def __init__(
+        self,
+        eas_client: EasClient,
+        max_fields_per_request: int = 100,
+        max_lookup_errors: int = 3,
+        history_length: int = 20,
+    ):
+        self.eas_client = eas_client
+        self.max_fields_per_request = max_fields_per_request
+        self.max_lookup_errors = max_lookup_errors
+        self.jobs: Dict[Tuple[str, str], Dict] = {}
+        self.tracker = ProgressTracker(history_length=history_length)
+        self._active_ids = set()
+
+    def track_work_packages(self, work_package_ids: Iterable[str]) -> List[Dict]:
+        return self._track(WORK_PACKAGE, work_package_ids)
+
+    def track_calibrations(self, run_ids: Iterable[str]) -> List[Dict]:
+        return self._track(CALIBRATION, run_ids)
+
+    def _track(self, kind: str, ids: Iterable[str]) -> List[Dict]:
+        jobs = []
+        for job_id in ids:
+            key = (kind, str(job_id))
+            if key not in self.jobs:
+                self.jobs[key] = {"kind": kind, "id": str(job_id), "status": None, "progress": None, "completed_at": None,
+                                  "finished": False, "errors": []}
+            jobs.append(self.jobs[key])
+        return jobs
+
+    @property
+    def unfinished(self) -> List[Dict]:
+        return [job for job in self.jobs.values() if not job["finished"]]
+
+    def _fields(self) -> List[Tuple[Optional[Dict], object]]:
+        """The fields to request this tick, each with the job it looks up (None for the active work packages)."""
+        fields = []
+        work_packages = [job for job in self.unfinished if job["kind"] == WORK_PACKAGE]
+        if work_packages:
+            fields.append((None, Query.get_active_work_packages()))
+        fields += [(job, _work_package_field(job)) for job in work_packages if job["id"] not in self._active_ids]
+        fields += [(job, _calibration_field(job)) for job in self.unfinished if job["kind"] == CALIBRATION]
+        return fields
+
+    async def _execute(self, fields: List[Tuple[str, object]]) -> Optional[Tuple[Dict, Dict[str, str]]]:
+        """The data and the error message per response key of one request, or None if the request failed outright."""
+        from graphql import OperationType
+        from zepben.eas.lib.exceptions import GraphQLClientGraphQLMultiError
+
+        try:
+            result = await self.eas_client.execute_custom_operation(
+                *(field.alias(key) if key != _ACTIVE_KEY else field for key, field in fields),
+                operation_type=OperationType.QUERY,
+                operation_name="monitorJobs",
+            )
+            errors = result.get("errors") or []
+        except GraphQLClientGraphQLMultiError as e:
+            # Errors are per field, so the rest of the response is still usable.
+            result, errors = e.data or {}, e.errors
+        except Exception as e:
+            logger.warning(f"Failed to get the status of {len(fields)} jobs: {e}")
+            return None
+
+        data = result.get("data") or {}
+        messages = {}
+        for error in errors:
+            messages.setdefault(_error_key(error), _error_message(error))
+        if None in messages and not data:
+            logger.warning(f"Failed to get the status of {len(fields)} jobs: {messages[None]}")
+            return None
+        return data, messages
+
+    async def tick(self) -> Dict[Tuple[str, str], Dict[str, Tuple]]:
+        """
+        Poll EAS once for every unfinished job and return what changed, keyed by (kind, id). Each change maps a field name
+        to an `(old, new)` tuple.
+
+        Work packages that were active on the previous tick are only looked up by ID once they leave the active list,
+        which costs a second request on ticks where that happens.
+        """
+        before = {(job["kind"], job["id"]): (job["status"], job["progress"]) for job in self.jobs.values()}
+        previously_active = self._active_ids
+        await self._poll(self._fields())
+        left = [job for job in self.unfinished if job["kind"] == WORK_PACKAGE
+                and job["id"] in previously_active and job["id"] not in self._active_ids]
+        await self._poll([(job, _work_package_field(job)) for job in left])
+
+        changes = {}
+        for key, job in self.jobs.items():
+            old_status, old_progress = before.get(key, (None, None))
+            changed = {}
+            if job["status"] != old_status:
+                changed["status"] = (old_status, job["status"])
+            if job["progress"] != old_progress:
+                changed["progress"] = (old_progress, job["progress"])
+            if changed:
+                changes[key] = changed
+        return changes
+
+    async def _poll(self, fields: List[Tuple[Optional[Dict], object]]):
+        keyed = [(job, _ACTIVE_KEY if job is None else f"{job['kind']}_{i}", field) for i, (job, field) in enumerate(fields)]
+        chunks = [keyed[i:i + self.max_fields_per_request] for i in range(0, len(keyed), self.max_fields_per_request)]
+        responses = await asyncio.gather(*(self._execute([(key, field) for _, key, field in chunk]) for chunk in chunks))
+
+        for chunk, response in zip(chunks, responses):
+            if response is None:
+                continue
+            data, errors = response
+            for job, key, _ in chunk:
+                if job is None:
+                    if data.get(_ACTIVE_KEY) is not None:
+                        self._update_active(extract_progress({"data": {_ACTIVE_KEY: data[_ACTIVE_KEY]}}))
+                elif key in errors:
+                    self._lookup_failed(job, errors[key])
+                elif key in data:
+                    self._update(job, data[key])
+
+    def _update_active(self, states: Dict[str, Dict]):
+        tracked = {job["id"]: job for job in self.unfinished if job["kind"] == WORK_PACKAGE}
+        states = {work_package_id: state for work_package_id, state in states.items() if work_package_id in tracked}
+        self.tracker.update(states)
+        self._active_ids = set(states)
+        for work_package_id, state in states.items():
+            job = tracked[work_package_id]
+            if "progressPercent" in state:
+                job["status"] = WorkPackageState.RUNNING.value
+                job["progress"] = state["progressPercent"]
+            elif job["status"] is None:
+                job["status"] = WorkPackageState.SETUP.value
+
+    def _update(self, job: Dict, value: Optional[Dict]):
+        job["errors"] = []
+        if value is None:
+            job["status"] = NOT_FOUND
+        elif job["kind"] == WORK_PACKAGE:
+            job["status"] = DELETED if value["isDeleted"] else value["status"]
+            if job["status"] == WorkPackageState.COMPLETED.value:
+                job["progress"] = 100
+        else:
+            job["status"], job["completed_at"] = value["status"], value["completedAt"]
+        self._finish_if_terminal(job)
+
+    def _lookup_failed(self, job: Dict, message: str):
+        job["errors"].append(message)
+        if len(job["errors"]) >= self.max_lookup_errors:
+            logger.warning(f"Giving up on {job['kind']} {job['id']}: {'; '.join(job['errors'])}")
+            job["status"] = LOOKUP_FAILED
+            self._finish_if_terminal(job)
+
+    def _finish_if_terminal(self, job: Dict):
+        terminal = WORK_PACKAGE_TERMINAL_STATUSES if job["kind"] == WORK_PACKAGE else CALIBRATION_TERMINAL_STATUSES
+        job["finished"] = job["status"] in terminal
+
+    async def run(self, poller: Optional[AdaptivePoller] = None) -> List[Dict]:
+        """
+        Poll until every tracked job has finished, logging what changed each tick, and return the final state of every job.
+        Polling backs off while nothing changes and speeds up when a work package is close to completion.
+        """
+        poller = poller or AdaptivePoller()
+        while self.unfinished:
+            changes = await self.tick()
+            print_job_changes(changes)
+            if not self.unfinished:
+                break
+            await asyncio.sleep(poller.next_interval(bool(changes), self.tracker.near_completion(poller.interval)))
+        return list(self.jobs.values())
+
+
+def print_job_changes(changes: Dict[Tuple[str, str], Dict[str, Tuple]]):
+    for (kind, job_id), changed in changes.items():
+        logger.info(f"{kind} {job_id}: " + ", ".join(f"{field} {old} -> {new}" for field, (old, new) in changed.items()))
+
+
+def print_jobs_table(jobs: List[Dict]):
+    headers = ["kind", "id", "status", "progress", "completed_at"]
+    rows = [[str(j[h]) if j[h] is not None else "" for h in headers] for j in jobs]
+    widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
@@ -0,0 +1,358 @@
+"""
+A durable queue of work packages and calibrations, submitted to EAS by a long-running scheduler that keeps at most a
+fixed number of work packages active on the instance at once.
+
+Jobs are expanded into their work packages (or calibrations) when they are queued, and each is stored as its input JSON
+in job_queue.sqlite in the config directory, so the queue survives restarts and the scheduler never needs the config the
+job was planned from. Each job has a priority class - urgent, normal or bulk - and queued entries are released in
+priority order and then in the order they were queued, so an urgent connection enquiry goes ahead of a bulk planning
+study that is still waiting.
+
+Every tick the scheduler asks EAS for its active work packages (pending and in progress, whoever submitted them) and
+only releases work packages while fewer than `max_active_work_packages` are active. Work packages it submitted less
+than `submission_grace_seconds` ago are counted as active even when EAS doesn't list them yet, so a slow server isn't
+flooded. `reserved_urgent_slots` slots are kept free for urgent jobs: normal and bulk work packages are only released
+while more than that many slots are free. If the active work packages can't be fetched, or come back without the
+pending and in progress lists, nothing is released that tick.
+
+Calibrations don't show up as active work packages, so they are limited separately to `max_active_calibrations` of the
+queue's own calibration runs. Submitted work packages and calibrations are followed with a JobMonitor until they finish,
+and their final status is recorded in the queue.
+
+Work packages are submitted through the submission ledger (see ledger.py) when it is enabled. The ledger only records a
+work package once EAS has answered, so work packages that were being submitted when the scheduler stopped are looked up
+in EAS by name on restart: one EAS already has is followed rather than submitted again, one it doesn't have is queued
+again, and one that can't be looked up is left until the next tick. Calibrations that were being submitted are queued
+again.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from zepben.eas import HcGeneratorConfigInput, IntrinsicWorkPackageInput, Mutation, Query, WorkPackageInput
+from zepben.eas.client.eas_client import EasClient
+
+from job_monitor import CALIBRATION, WORK_PACKAGE, JobMonitor
+from ledger import Ledger, submit_work_package
+from progress import active_work_package_ids
+from resilience import find_submitted_work_package
+from utils import logger
+
+STORE_FILE_NAME = "job_queue.sqlite"
+
+FORECAST = "forecast"
+OVERRIDE = "override"
+INTRINSIC = "intrinsic"
+CALIBRATE = "calibration"
+KINDS = (FORECAST, OVERRIDE, INTRINSIC, CALIBRATE)
+
+URGENT = "urgent"
+NORMAL = "normal"
+BULK = "bulk"
+# Lower is released first.
+PRIORITIES = {URGENT: 0, NORMAL: 1, BULK: 2}
+
+QUEUED = "QUEUED"
+SUBMITTING = "SUBMITTING"
+SUBMITTED = "SUBMITTED"
+SUBMIT_FAILED = "SUBMIT_FAILED"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    input TEXT NOT NULL,
+    status TEXT NOT NULL,
+    submitted_id TEXT,
+    error TEXT,
+    queued_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_by_status ON entries (status, priority, id);
+"""
+
+_COLUMNS = ["id", "job", "kind", "priority", "name", "status", "submitted_id", "error", "queued_at", "updated_at"]
+
+
+def store_path(config_dir: str) -> str:
+    return f"{config_dir}/{STORE_FILE_NAME}"
+
+
+def queue_settings(config: Dict) -> Dict:
+    """The `job_queue` section of config.json, with defaults for anything not set."""
+    settings = config.get("job_queue", {})
+    return {
+        "max_active_work_packages": settings.get("max_active_work_packages", 8),
+        "reserved_urgent_slots": settings.get("reserved_urgent_slots", 1),
+        "max_active_calibrations": settings.get("max_active_calibrations", 2),
+        "poll_seconds": settings.get("poll_seconds", 30.0),
+        "submission_grace_seconds": settings.get("submission_grace_seconds", 120.0),
+    }
+
+
+def work_package_entry(name: str, work_package) -> Tuple[str, Dict]:
+    return name, work_package.model_dump(mode="json", by_alias=True, exclude_none=True)
+
+
+def calibration_entry(
+    calibration_name: str,
+    calibration_time_local: datetime,
+    feeders: List[str],
+    generator_config: HcGeneratorConfigInput,
+) -> Tuple[str, Dict]:
+    return calibration_name, {
+        "calibration_time_local": calibration_time_local.isoformat(),
+        "feeders": feeders,
+        "generator_config": generator_config.model_dump(mode="json", by_alias=True, exclude_none=True),
+    }
+
+
+class JobQueue:
+    """The job queue at `path`, created if it doesn't exist."""
+
+    def __init__(self, path: str):
+        # The scheduler and queue_jobs.py may have the queue open at the same time, so wait out each other's writes.
+        self.connection = sqlite3.connect(path, timeout=30.0)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def enqueue(self, job: str, kind: str, priority: str, entries: List[Tuple[str, Dict]]) -> int:
+        """Queue the `(name, input)` entries of a job, returning how many were queued."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind {kind}, expected one of {list(KINDS)}")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority}, expected one of {list(PRIORITIES)}")
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO entries (job, kind, priority, name, input, status, queued_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((job, kind, PRIORITIES[priority], name, json.dumps(value), QUEUED, now, now) for name, value in entries),
+            )
+        return len(entries)
+
+    def _select(self, where: str, params: tuple = ()) -> List[Dict]:
+        cursor = self.connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM entries {where}", params)
+        return [dict(zip(_COLUMNS, row)) for row in cursor]
+
+    def next_queued(self, calibrations: bool) -> Optional[Dict]:
+        """The next calibration or work package to release, with its input, or None if there are none queued."""
+        kind_filter = "kind = ?" if calibrations else "kind != ?"
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(_COLUMNS)}, input FROM entries WHERE status = ? AND {kind_filter} "
+            "ORDER BY priority, id LIMIT 1",
+            (QUEUED, CALIBRATE),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(_COLUMNS, row))
+        entry["input"] = json.loads(row[-1])
+        return entry
+
+    def submitted(self) -> List[Dict]:
+        """Entries submitted and not yet known to have finished."""
+        return self._select("WHERE status = ? ORDER BY id", (SUBMITTED,))
+
+    def entries(self, job: Optional[str] = None) -> List[Dict]:
+        if job is None:
+            return self._select("ORDER BY priority, id")
+        return self._select("WHERE job = ? ORDER BY priority, id", (job,))
+
+    def queued_count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM entries WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def update(self, entry_id: int, status: str, submitted_id: Optional[str] = None, error: Optional[str] = None):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE entries SET status = ?, submitted_id = COALESCE(?, submitted_id), error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (status, submitted_id, error, time.time(), entry_id),
+            )
+
+    def interrupted(self) -> List[Dict]:
+        """Entries that were being submitted when the scheduler last stopped, with when their submission started."""
+        return self._select("WHERE status = ? ORDER BY id", (SUBMITTING,))
+
+
+async def _submit(eas_client: EasClient, entry: Dict, ledger: Optional[Ledger]) -> Dict:
+    if entry["kind"] == CALIBRATE:
+        value = entry["input"]
+        return await eas_client.mutation(Mutation.run_calibration(
+            calibration_name=entry["name"],
+            calibration_time_local=datetime.fromisoformat(value["calibration_time_local"]),
+            feeders=value["feeders"],
+            generator_config=HcGeneratorConfigInput.model_validate(value["generator_config"]),
+        ))
+    if entry["kind"] == INTRINSIC:
+        work_package, mutation = IntrinsicWorkPackageInput.model_validate(entry["input"]), Mutation.run_intrinsic_work_package
+    else:
+        work_package, mutation = WorkPackageInput.model_validate(entry["input"]), Mutation.run_work_package
+    return await submit_work_package(eas_client, work_package, entry["name"], mutation, ledger)
+
+
+class Scheduler:
+    """
+    Releases queued entries to EAS as slots free up (see the module docstring). Call `tick` once per poll, or `run` to
+    poll until stopped.
+    """
+
+    def __init__(self, eas_client: EasClient, queue: JobQueue, settings: Dict, ledger: Optional[Ledger] = None):
+        self.eas_client = eas_client
+        self.queue = queue
+        self.settings = settings
+        self.ledger = ledger
+        self.monitor = JobMonitor(eas_client)
+        # Work package ID -> when it was submitted, for those EAS hasn't listed as active yet.
+        self.recent: Dict[str, float] = {}
+        # (kind, submitted ID) -> queue entry ID, for the entries being followed to completion.
+        self.following: Dict[Tuple[str, str], int] = {}
+
+        for entry in queue.submitted():
+            self._follow(entry, entry["submitted_id"])
+
+    def _follow(self, entry: Dict, submitted_id: str):
+        kind = CALIBRATION if entry["kind"] == CALIBRATE else WORK_PACKAGE
+        if kind == CALIBRATION:
+            self.monitor.track_calibrations([submitted_id])
+        else:
+            self.monitor.track_work_packages([submitted_id])
+        self.following[(kind, str(submitted_id))] = entry["id"]
+
+    async def _resolve_interrupted(self):
+        """
+        Settle the entries that were being submitted when the scheduler stopped, so none is submitted twice: work
+        packages EAS already has are followed, and everything else is queued again.
+        """
+        for entry in self.queue.interrupted():
+            if entry["kind"] != CALIBRATE:
+                try:
+                    submitted_id = await find_submitted_work_package(self.eas_client, entry["name"], entry["updated_at"])
+                except Exception as e:
+                    logger.warning(f"Failed to look up {entry['name']} ({entry['job']}), which was being submitted when "
+                                   f"the scheduler stopped, trying again next tick: {e}")
+                    continue
+                if submitted_id is not None:
+                    self.queue.update(entry["id"], SUBMITTED, submitted_id=submitted_id)
+                    self._follow(entry, submitted_id)
+                    logger.info(f"{entry['kind']} {entry['name']} ({entry['job']}) was released as {submitted_id} "
+                                f"before the scheduler stopped")
+                    continue
+            self.queue.update(entry["id"], QUEUED)
+            logger.info(f"Queued {entry['kind']} {entry['name']} ({entry['job']}) again, it was being submitted when "
+                        f"the scheduler stopped")
+
+    async def active_work_packages(self) -> Optional[int]:
+        """The number of work packages active on EAS, including ones just submitted, or None if it couldn't be found."""
+        try:
+            result = await self.eas_client.query(Query.get_active_work_packages())
+            active = active_work_package_ids(result)
+        except Exception as e:
+            logger.warning(f"Failed to get the active work packages, not releasing anything: {e}")
+            return None
+        if active is None:
+            logger.warning(f"Unexpected active work packages response, not releasing anything: {result}")
+            return None
+
+        now = time.time()
+        self.recent = {work_package_id: submitted_at for work_package_id, submitted_at in self.recent.items()
+                       if work_package_id not in active and now - submitted_at < self.settings["submission_grace_seconds"]}
+        return len(active) + len(self.recent)
+
+    async def _release(self, entry: Dict) -> Optional[str]:
+        """Submit a queued entry, returning its work package or calibration run ID, or None if it failed to submit."""
+        self.queue.update(entry["id"], SUBMITTING)
+        try:
+            result = await _submit(self.eas_client, entry, self.ledger)
+            if "data" in result:
+                submitted_id = str(next(iter(result["data"].values())))
+                self.queue.update(entry["id"], SUBMITTED, submitted_id=submitted_id)
+                self._follow(entry, submitted_id)
+                logger.info(f"Released {entry['kind']} {entry['name']} ({entry['job']}) as {submitted_id}")
+                return submitted_id
+            error = "; ".join(err["message"] for err in result["errors"])
+        except Exception as e:
+            error = str(e)
+        self.queue.update(entry["id"], SUBMIT_FAILED, error=error)
+        logger.error(f"{entry['kind']} {entry['name']} ({entry['job']}) failed to submit: {error}")
+        return None
+
+    async def _release_work_packages(self):
+        active = await self.active_work_packages()
+        if active is None:
+            return
+        free = self.settings["max_active_work_packages"] - active
+        while free > 0:
+            entry = self.queue.next_queued(calibrations=False)
+            if entry is None or (entry["priority"] != PRIORITIES[URGENT] and free <= self.settings["reserved_urgent_slots"]):
+                return
+            submitted_id = await self._release(entry)
+            if submitted_id is not None:
+                self.recent[submitted_id] = time.time()
+                free -= 1
+
+    async def _release_calibrations(self):
+        running = sum(not job["finished"] for (kind, _), job in self.monitor.jobs.items() if kind == CALIBRATION)
+        for _ in range(self.settings["max_active_calibrations"] - running):
+            entry = self.queue.next_queued(calibrations=True)
+            if entry is None:
+                return
+            await self._release(entry)
+
+    async def _update_statuses(self):
+        if not self.monitor.unfinished:
+            return
+        await self.monitor.tick()
+        for key, entry_id in list(self.following.items()):
+            job = self.monitor.jobs[key]
+            if job["finished"]:
+                self.queue.update(entry_id, job["status"])
+                del self.following[key]
+
+    async def tick(self):
+        await self._resolve_interrupted()
+        await self._update_statuses()
+        await self._release_calibrations()
+        await self._release_work_packages()
+
+    @property
+    def idle(self) -> bool:
+        """Whether nothing is queued and everything released has finished."""
+        return not self.queue.queued_count() and not self.following and not self.queue.interrupted()
+
+    async def run(self, until_idle: bool = False):
+        """Tick every `poll_seconds` until stopped, or with `until_idle` until the scheduler is idle."""
+        while True:
+            await self.tick()
+            if until_idle and self.idle:
+                return
+            await asyncio.sleep(self.settings["poll_seconds"])
+
+
+def print_queue_table(entries: List[Dict]):
+    priorities = {value: name for name, value in PRIORITIES.items()}
+    headers = ["id", "job", "kind", "priority", "name", "status", "submitted_id"]
+    rows = [[priorities[e[h]] if h == "priority" else str(e[h]) if e[h] is not None else "" for h in headers]
+            for e in entries]
+    widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+    for e in entries:
+        if e["error"]:
+            print(f'{e["name"]}: {e["error"]}')
@@ -0,0 +1,153 @@
+"""
+Write-ahead journal for batch submissions, so a batch that crashes part way through (network drop, laptop sleep, token
+expiry) can be resumed without starting again or submitting anything twice.
+
+The journal is a JSON lines file alongside config.json. The whole plan - every unit of the batch, such as a feeder shard,
+an intrinsic search pass or a calibration period - is written before anything is submitted. Each unit is then recorded
+just before it is submitted, and again once EAS acknowledges it with an ID (or rejects it). Every record is flushed to
+disk before the batch moves on.
+
+Resuming replays the journal and returns only the units that were never acknowledged. A unit recorded as submitting but
+never acknowledged may or may not have reached EAS before the crash, so it is in doubt. The ledger can't settle that, as
+it only records a work package once EAS has answered. Batches of work packages (see submit_journalled_shards) instead
+look each in-doubt unit up in EAS by its work package name: one found is acknowledged with that work package rather than
+submitted again, and one that can't be looked up is left in doubt for the next resume. Calibration sweeps have no such
+lookup, so their in-doubt periods are submitted again.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+from utils import logger
+
+PLANNED = "planned"
+SUBMITTING = "submitting"
+ACKNOWLEDGED = "acknowledged"
+FAILED = "failed"
+
+
+def journal_path(config_dir: str, name: str, kind: str) -> str:
+    return f"{config_dir}/{name}.{kind}.journal.jsonl"
+
+
+def replay(path: str) -> List[Dict]:
+    """The records in the journal at `path`, ignoring a final record cut short by a crash."""
+    records = []
+    try:
+        with open(path) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Ignoring incomplete record at the end of {path}")
+                    break
+    except FileNotFoundError:
+        pass
+    return records
+
+
+class Journal:
+    """
+    The journal of one batch at `path`, keyed on the `key` field of each unit. Unless `resume` is set, any existing
+    journal at `path` is replaced.
+    """
+
+    def __init__(self, path: str, key: str = "shard", resume: bool = False):
+        self.path = path
+        self.key = key
+        self.units: List[Dict] = []
+        self.states: Dict[str, str] = {}
+        self.entries: Dict[str, Dict] = {}
+        # When each unit was last recorded as submitting, to look for its work package from.
+        self.submitted_at: Dict[str, float] = {}
+
+        if resume:
+            for record in replay(path):
+                self._apply(record)
+            if not self.units:
+                logger.warning(f"Nothing to resume in {path}, starting a new batch")
+        elif os.path.exists(path):
+            unfinished = [k for k, state in replay_states(path, key).items() if state != ACKNOWLEDGED]
+            if unfinished:
+                logger.warning(f"Replacing {path}, which has {len(unfinished)} units that were never acknowledged - "
+                               f"use --resume to finish that batch instead")
+            os.remove(path)
+
+        self.file = open(path, "a")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _unit_key(self, unit: Dict) -> str:
+        return str(unit[self.key])
+
+    def _apply(self, record: Dict):
+        if record["event"] == PLANNED:
+            self.units = record["units"]
+            self.states = {self._unit_key(unit): PLANNED for unit in self.units}
+        else:
+            self.states[record["unit"]] = record["event"]
+            if "entry" in record:
+                self.entries[record["unit"]] = record["entry"]
+            if "at" in record:
+                self.submitted_at[record["unit"]] = record["at"]
+
+    def _write(self, record: Dict):
+        self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._apply(record)
+
+    def plan(self, units: List[Dict]) -> List[Dict]:
+        """
+        Record the plan for the batch, or when resuming, return the plan already in the journal so the batch carries on
+        with exactly the units it started with.
+        """
+        if self.units:
+            if [self._unit_key(u) for u in units] != [self._unit_key(u) for u in self.units]:
+                logger.warning(f"The batch planned now differs from the one in {self.path}, resuming the journalled plan")
+            return self.units
+
+        self._write({"event": PLANNED, "units": units})
+        return self.units
+
+    def pending(self) -> List[Dict]:
+        """The planned units that haven't been acknowledged, in plan order, including those in doubt."""
+        return [unit for unit in self.units if self.states[self._unit_key(unit)] != ACKNOWLEDGED]
+
+    def in_doubt(self) -> List[Tuple[Dict, float]]:
+        """The units recorded as submitting but never acknowledged or rejected, each with when it was submitted."""
+        return [(unit, self.submitted_at.get(self._unit_key(unit), 0.0)) for unit in self.units
+                if self.states[self._unit_key(unit)] == SUBMITTING]
+
+    def acknowledged(self) -> List[Dict]:
+        """The entries recorded for acknowledged units, in plan order."""
+        return [self.entries[k] for k in map(self._unit_key, self.units) if self.states[k] == ACKNOWLEDGED]
+
+    def submitting(self, unit: Dict):
+        self._write({"event": SUBMITTING, "unit": self._unit_key(unit), "at": time.time()})
+
+    def acknowledge(self, entry: Dict):
+        self._write({"event": ACKNOWLEDGED, "unit": self._unit_key(entry), "entry": entry})
+
+    def fail(self, entry: Dict):
+        self._write({"event": FAILED, "unit": self._unit_key(entry), "entry": entry})
+
+
+def replay_states(path: str, key: str = "shard") -> Dict[str, str]:
+    """The last recorded state of every planned unit in the journal at `path`."""
+    states = {}
+    for record in replay(path):
+        if record["event"] == PLANNED:
+            states = {str(unit[key]): PLANNED for unit in record["units"]}
+        else:
+            states[record["unit"]] = record["event"]
+    return states
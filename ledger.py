@@ -0,0 +1,174 @@
+"""
+Content-addressed ledger of submitted work packages, so an identical work package is never run (and paid for) twice.
+
+Each work package input is reduced to a canonical JSON form - keys sorted, unset fields dropped and feeder, year and
+scenario lists sorted - and hashed. The ledger is a SQLite file in the config directory keyed by that hash, recording the
+work package ID, name, submission time and last known status. Before submitting, the hash is looked up: if an identical
+work package has already completed or is still running, its ID is reused instead of submitting it again. Work packages
+that failed, were cancelled or timed out are submitted again.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Callable, Dict, Optional
+
+from pydantic import BaseModel
+from zepben.eas import HcWorkPackageFields, Mutation, Query, WorkPackageState
+from zepben.eas.client.eas_client import EasClient
+
+from utils import logger
+
+LEDGER_FILE_NAME = "submission_ledger.sqlite"
+SUBMITTED = "SUBMITTED"
+RESUBMIT_STATUSES = {WorkPackageState.FAILED.value, WorkPackageState.CANCELLED.value, WorkPackageState.TIMEDOUT.value}
+FINAL_STATUSES = RESUBMIT_STATUSES | {WorkPackageState.COMPLETED.value}
+
+# Lists whose order has no meaning to EAS, sorted so they hash the same whichever order they were configured in.
+UNORDERED_KEYS = {"feeders", "years", "scenarios"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    input_hash TEXT PRIMARY KEY,
+    input_type TEXT NOT NULL,
+    work_package_id TEXT NOT NULL,
+    work_package_name TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_by_id ON submissions (work_package_id);
+"""
+
+
+def _canonical(value, key=None):
+    if isinstance(value, dict):
+        return {k: _canonical(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        values = [_canonical(v) for v in value]
+        if key in UNORDERED_KEYS and all(isinstance(v, (str, int, float)) for v in values):
+            return sorted(values)
+        return values
+    return value
+
+
+def canonical_json(work_package: BaseModel) -> str:
+    """The canonical JSON form of a work package input, identical for inputs that would run the same work."""
+    dumped = work_package.model_dump(mode="json", by_alias=True, exclude_none=True)
+    return json.dumps(_canonical(dumped), sort_keys=True, separators=(",", ":"))
+
+
+def work_package_hash(work_package: BaseModel) -> str:
+    # The input type is hashed too, so e.g. an intrinsic and a forecast work package can never collide.
+    digest = hashlib.sha256(type(work_package).__name__.encode())
+    digest.update(canonical_json(work_package).encode())
+    return digest.hexdigest()
+
+
+def ledger_path(config_dir: str) -> str:
+    return f"{config_dir}/{LEDGER_FILE_NAME}"
+
+
+def open_ledger(config_dir: str, config: Dict) -> Optional["Ledger"]:
+    """The ledger for `config_dir`, or None if use_submission_ledger is set to false in config.json."""
+    return Ledger(ledger_path(config_dir)) if config.get("use_submission_ledger", True) else None
+
+
+class Ledger:
+    """The submission ledger at `path`, created if it doesn't exist."""
+
+    def __init__(self, path: str):
+        # Shards are submitted concurrently from one event loop thread, so one connection is shared by all of them.
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, input_hash: str) -> Optional[Dict]:
+        cursor = self.connection.execute("SELECT * FROM submissions WHERE input_hash = ?", (input_hash,))
+        row = cursor.fetchone()
+        return None if row is None else dict(zip((c[0] for c in cursor.description), row))
+
+    def record(self, input_hash: str, input_type: str, work_package_id: str, work_package_name: str):
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (input_hash, input_type, work_package_id, work_package_name, now, SUBMITTED, now),
+            )
+
+    def update_status(self, work_package_id: str, status: str):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE submissions SET status = ?, updated_at = ? WHERE work_package_id = ?",
+                (status, time.time(), work_package_id),
+            )
+
+
+async def refresh_status(eas_client: EasClient, ledger: Ledger, entry: Dict) -> Optional[str]:
+    """
+    Update the ledger with the current status of a recorded work package, or return None if EAS no longer knows of it.
+    Statuses that are already final are not queried again.
+    """
+    if entry["status"] in FINAL_STATUSES:
+        return entry["status"]
+
+    result = await eas_client.query(
+        Query.get_work_package_by_id(entry["work_package_id"]),
+        HcWorkPackageFields.status,
+        HcWorkPackageFields.is_deleted,
+    )
+    if "data" not in result:
+        raise RuntimeError("\n".join(err["message"] for err in result["errors"]))
+
+    work_package = result["data"]["getWorkPackageById"]
+    if work_package is None or work_package["isDeleted"]:
+        return None
+    ledger.update_status(entry["work_package_id"], work_package["status"])
+    return work_package["status"]
+
+
+async def submit_work_package(
+    eas_client: EasClient,
+    work_package: BaseModel,
+    work_package_name: str,
+    mutation: Callable = Mutation.run_work_package,
+    ledger: Optional[Ledger] = None,
+) -> Dict:
+    """
+    Submit a work package, unless `ledger` records an identical one that completed or is still running, in which case
+    that work package's ID is returned instead. The result has the same shape as the mutation's, so it can be passed to
+    print_run.
+    """
+    field = mutation(work_package, work_package_name=work_package_name)
+    if ledger is None:
+        return await eas_client.mutation(field)
+
+    input_hash = work_package_hash(work_package)
+    entry = ledger.lookup(input_hash)
+    if entry is not None:
+        try:
+            status = await refresh_status(eas_client, ledger, entry)
+        except Exception as e:
+            logger.warning(f"Failed to get status of work package {entry['work_package_id']}, assuming it is still "
+                           f"{entry['status']}: {e}")
+            status = entry["status"]
+
+        if status is not None and status not in RESUBMIT_STATUSES:
+            logger.info(f"{work_package_name} is identical to {entry['work_package_name']} ({status}), reusing work "
+                        f"package {entry['work_package_id']}")
+            return {"data": {field._field_name: entry["work_package_id"]}}
+        logger.info(f"Identical work package {entry['work_package_id']} is {status or 'gone'}, submitting again")
+
+    result = await eas_client.mutation(field)
+    if "data" in result:
+        ledger.record(input_hash, type(work_package).__name__, next(iter(result["data"].values())), work_package_name)
+    return result
@@ -0,0 +1,173 @@
+"""
+Pre-flight checks that override load IDs and feeders exist in the network model, before anything is submitted.
+
+EAS silently ignores an override whose load ID isn't in the feeder, so a typo costs a full run on an unmodified model.
+The valid load IDs of each feeder - the mRIDs of its energy consumers and the mRIDs and names of their usage points
+(connection points), including those on the LV feeders it energises - are fetched from EWB, at most `max_in_flight`
+feeders at a time, and kept in load_id_index.sqlite in the config directory. Feeders indexed within the TTL aren't
+fetched again, so repeat checks of the same feeders only read the index.
+
+Feeders are checked against the cached feeder hierarchy (see hierarchy_cache.py) before their networks are fetched, so an
+unknown feeder is reported without a fetch.
+"""
+
+import asyncio
+import sqlite3
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from zepben.eas import FeederConfigInput
+
+from clients import ClientManager
+from hierarchy_cache import load_feeder_records
+from utils import logger
+
+STORE_FILE_NAME = "load_id_index.sqlite"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+# How many unknown IDs to list per feeder when reporting.
+MAX_REPORTED = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeders (
+    feeder TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS load_ids (
+    feeder TEXT NOT NULL,
+    load_id TEXT NOT NULL,
+    PRIMARY KEY (feeder, load_id)
+) WITHOUT ROWID;
+"""
+
+
+def store_path(config_dir: str) -> str:
+    return f"{config_dir}/{STORE_FILE_NAME}"
+
+
+class LoadIdIndex:
+    """The valid load IDs of each indexed feeder at `path`, created if it doesn't exist."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fresh_feeders(self, ttl_seconds: float) -> Set[str]:
+        """The feeders indexed within the last `ttl_seconds`."""
+        return {row[0] for row in self.connection.execute(
+            "SELECT feeder FROM feeders WHERE fetched_at >= ?", (time.time() - ttl_seconds,)
+        )}
+
+    def load_ids(self, feeder: str) -> Set[str]:
+        return {row[0] for row in self.connection.execute("SELECT load_id FROM load_ids WHERE feeder = ?", (feeder,))}
+
+    def write(self, feeder: str, load_ids: Iterable[str]):
+        with self.connection:
+            self.connection.execute("DELETE FROM load_ids WHERE feeder = ?", (feeder,))
+            self.connection.executemany("INSERT OR IGNORE INTO load_ids VALUES (?, ?)", ((feeder, i) for i in load_ids))
+            self.connection.execute("INSERT OR REPLACE INTO feeders VALUES (?, ?)", (feeder, time.time()))
+
+
+async def fetch_load_ids(clients: ClientManager, feeder: str) -> Set[str]:
+    from zepben.ewb import EnergyConsumer, Feeder, IncludedEnergizedContainers, UsagePoint
+
+    client = clients.network_consumer_client()
+    # The whole container rather than just its equipment, as usage points are only fetched as references.
+    (await client.get_equipment_container(
+        feeder,
+        expected_class=Feeder,
+        include_energized_containers=IncludedEnergizedContainers.LV_FEEDERS,
+    )).throw_on_error()
+    load_ids = {consumer.mrid for consumer in client.service.objects(EnergyConsumer)}
+    for usage_point in client.service.objects(UsagePoint):
+        load_ids.add(usage_point.mrid)
+        if usage_point.name:
+            load_ids.add(usage_point.name)
+    return load_ids
+
+
+class PreflightReport(NamedTuple):
+    # Feeders that aren't in the network hierarchy.
+    unknown_feeders: List[str]
+    # Load IDs that aren't in their feeder's network, by feeder.
+    unknown_load_ids: Dict[str, List[str]]
+    # Feeders whose network couldn't be fetched, so their load IDs weren't checked.
+    unchecked_feeders: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not (self.unknown_feeders or self.unknown_load_ids or self.unchecked_feeders)
+
+    def describe(self) -> str:
+        lines = []
+        if self.unknown_feeders:
+            lines.append(f"{len(self.unknown_feeders)} feeders aren't in the network: {self.unknown_feeders[:MAX_REPORTED]}")
+        for feeder, load_ids in self.unknown_load_ids.items():
+            lines.append(f"{len(load_ids)} load IDs aren't in feeder {feeder}: {load_ids[:MAX_REPORTED]}")
+        if self.unchecked_feeders:
+            lines.append(f"Couldn't fetch {len(self.unchecked_feeders)} feeders to check their load IDs: "
+                         f"{self.unchecked_feeders[:MAX_REPORTED]}")
+        return "\n".join(lines)
+
+
+async def check_load_ids(
+    clients: ClientManager,
+    index: LoadIdIndex,
+    load_ids: Dict[str, Iterable[str]],
+    ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    max_in_flight: int = 4,
+) -> PreflightReport:
+    """Check every feeder in `load_ids` and each of its load IDs against the network model, fetching stale feeders."""
+    known = {record.mrid for record in await load_feeder_records(clients.config_dir, clients=clients)}
+    unknown_feeders = sorted(feeder for feeder in load_ids if feeder not in known)
+    feeders = [feeder for feeder in load_ids if feeder in known]
+
+    fresh = index.fresh_feeders(ttl_seconds)
+    stale = [feeder for feeder in feeders if feeder not in fresh]
+    failed = []
+    if stale:
+        logger.info(f"Indexing the load IDs of {len(stale)} feeders from EWB")
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def fetch(feeder: str) -> Optional[Set[str]]:
+            async with semaphore:
+                try:
+                    return await fetch_load_ids(clients, feeder)
+                except Exception as e:
+                    logger.warning(f"Failed to fetch feeder {feeder}: {e}")
+                    return None
+
+        for feeder, fetched in zip(stale, await asyncio.gather(*(fetch(f) for f in stale))):
+            if fetched is None:
+                failed.append(feeder)
+            else:
+                index.write(feeder, fetched)
+
+    unknown_load_ids = {}
+    for feeder in feeders:
+        if feeder in failed:
+            continue
+        valid = index.load_ids(feeder)
+        missing = sorted({str(load_id) for load_id in load_ids[feeder]} - valid)
+        if missing:
+            unknown_load_ids[feeder] = missing
+    return PreflightReport(unknown_feeders, unknown_load_ids, failed)
+
+
+def feeder_config_load_ids(feeder_configs: Iterable[FeederConfigInput]) -> Dict[str, Set[str]]:
+    """The overridden load IDs of each feeder in `feeder_configs`. Feeders without overrides are still checked."""
+    load_ids: Dict[str, Set[str]] = {}
+    for feeder_config in feeder_configs:
+        feeder_load_ids = load_ids.setdefault(feeder_config.feeder, set())
+        if feeder_config.fixed_time is not None:
+            feeder_load_ids.update(override.load_id for override in feeder_config.fixed_time.overrides or [])
+    return load_ids
@@ -1,31 +1,26 @@
 import asyncio
 import sys
-import pprint
 
-from utils import get_client, get_config_dir
-from zepben.eas import Query
+from clients import ClientManager
+from job_monitor import JobMonitor, print_jobs_table
+from utils import get_config_dir, get_option
 
 """
-Get the status of a calibration run.
+Monitor the status of one or more calibration runs until they have all completed or failed.
 
-Use the ID returned from the server in run_calibration.py
+Use the IDs returned from the server in run_calibration.py, passed as --id=<run ID>[,<run ID>...] or entered when
+prompted. Every run is polled in a single request per tick, and only status changes are logged.
 """
 
-CALIBRATION_ID = "<CALIBRATION ID>"  # ID of run to track
-
 
 async def print_loop(argv):
     config_dir = get_config_dir(argv)
-    eas_client = get_client(config_dir)
-
-    print("Press Ctrl+C to exit")
-    while True:
-        try:
-            result = await eas_client.query(Query.get_calibration_run(id=CALIBRATION_ID))
-            pprint.pprint(result)
-        except Exception as e:
-            print(e)
-        await asyncio.sleep(5)
+    run_ids = get_option(argv, "--id") or input("Calibration run IDs to monitor (comma separated): ")
+
+    async with ClientManager(config_dir) as clients:
+        monitor = JobMonitor(clients.eas_client)
+        monitor.track_calibrations(run_id.strip() for run_id in run_ids.split(",") if run_id.strip())
+        print_jobs_table(await monitor.run())
 
 
 if __name__ == "__main__":
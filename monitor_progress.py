@@ -1,25 +1,77 @@
 import asyncio
 import sys
 
-from utils import get_config_dir, get_client, print_progress
+from clients import ClientManager
+from job_monitor import JobMonitor, print_jobs_table
+from progress import AdaptivePoller, ProgressTracker, extract_progress
+from sharding import read_manifest
+from utils import get_config_dir, get_client, get_option, print_progress, print_progress_changes
 from zepben.eas import Query
 
+"""
+Monitor the progress of all active work packages, logging only what changed for each work package since the last poll.
+
+Polling backs off while nothing changes, up to MAX_POLL_SECONDS, and speeds up to MIN_POLL_SECONDS when a work package is
+close to completion.
+
+To follow particular jobs instead, pass any of --work-packages=<ID>[,<ID>...], --calibrations=<run ID>[,<run ID>...] and
+--manifest=<path to a sharding manifest>. These are all tracked together by one JobMonitor, polling every job in a single
+request per tick, and the monitor exits with a summary table once they have all finished.
+"""
+
+BASE_POLL_SECONDS = 5.0
+MIN_POLL_SECONDS = 1.0
+MAX_POLL_SECONDS = 60.0
+HISTORY_LENGTH = 20  # Number of progress samples kept per work package, used to estimate time to completion.
+
 exit_flag = False
 
 
+def _ids(argv, option):
+    return [i.strip() for i in get_option(argv, option, "").split(",") if i.strip()]
+
+
+async def monitor_jobs(config_dir, work_package_ids, calibration_ids):
+    async with ClientManager(config_dir) as clients:
+        monitor = JobMonitor(clients.eas_client, history_length=HISTORY_LENGTH)
+        monitor.track_work_packages(work_package_ids)
+        monitor.track_calibrations(calibration_ids)
+        jobs = await monitor.run(
+            AdaptivePoller(base_interval=BASE_POLL_SECONDS, min_interval=MIN_POLL_SECONDS, max_interval=MAX_POLL_SECONDS)
+        )
+    print_jobs_table(jobs)
+
+
 async def print_loop(argv):
     config_dir = get_config_dir(argv)
+    work_package_ids, calibration_ids = _ids(argv, "--work-packages"), _ids(argv, "--calibrations")
+    manifest = get_option(argv, "--manifest")
+    if manifest:
+        work_package_ids += [e["work_package_id"] for e in read_manifest(manifest)["shards"] if e["work_package_id"]]
+    if work_package_ids or calibration_ids:
+        await monitor_jobs(config_dir, work_package_ids, calibration_ids)
+        return
+
     eas_client = get_client(config_dir)
+    tracker = ProgressTracker(history_length=HISTORY_LENGTH)
+    poller = AdaptivePoller(base_interval=BASE_POLL_SECONDS, min_interval=MIN_POLL_SECONDS, max_interval=MAX_POLL_SECONDS)
 
+    print("Press Ctrl + C to stop monitor...")
     while not exit_flag:
+        changed = False
         try:
-            result = await  eas_client.query(Query.get_active_work_packages())
-            print("Press Ctrl + C to stop monitor...")
-            print_progress(result)
+            result = await eas_client.query(Query.get_active_work_packages())
+            if "data" in result:
+                changes = tracker.update(extract_progress(result))
+                print_progress_changes(changes)
+                changed = bool(changes)
+            else:
+                print_progress(result)
         except Exception as e:
             print(e)
-        await asyncio.sleep(5)
+        await asyncio.sleep(poller.next_interval(changed, tracker.near_completion(poller.interval)))
     await eas_client.close()
 
 
-asyncio.run(print_loop(sys.argv))
+if __name__ == "__main__":
+    asyncio.run(print_loop(sys.argv))
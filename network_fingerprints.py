@@ -0,0 +1,333 @@
+"""
+Network model change detection, so a study can be rerun incrementally: only the feeder/year/scenario combinations whose
+network model or config changed since their last successful run are submitted.
+
+A feeder's fingerprint is a hash of its Feeder object from the network hierarchy and of every object NetworkConsumerClient
+fetches for it - equipment, terminals, connectivity nodes and the LV feeders it energises - with all their properties and
+their references to other objects by mRID. Fingerprints are stored in network_fingerprints.sqlite in the config directory
+along with the EWB metadata (data source versions) they were taken at. While the metadata is unchanged the stored
+fingerprints are reused, so an unchanged network costs a single metadata call.
+
+Each submitted combination is recorded with the fingerprint and config hash it was run with and the ID of its work
+package. The config hash is per feeder, as it covers the calibration set the feeder takes its tap settings from. Once
+EAS reports that work package as completed, the combination isn't submitted again until its fingerprint or the config
+changes.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+import weakref
+from datetime import datetime
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+from zepben.eas import HcWorkPackageFields, Query, WorkPackageState
+from zepben.eas.client.eas_client import EasClient
+
+from clients import ClientManager
+from ledger import FINAL_STATUSES, canonical_json
+from utils import logger
+
+STORE_FILE_NAME = "network_fingerprints.sqlite"
+SUBMITTED = "SUBMITTED"
+DELETED = "DELETED"
+
+# Runs in these states count as done for their fingerprint and config - completed, or still on their way there.
+SETTLED_STATUSES = (WorkPackageState.COMPLETED.value, SUBMITTED, WorkPackageState.SETUP.value, WorkPackageState.PRRP.value,
+                    WorkPackageState.RUNNING.value)
+
+SETTLED_CHUNK_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    feeder TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    metadata_hash TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    feeder TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    scenario TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    work_package_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (feeder, year, scenario, work_package_id)
+);
+CREATE INDEX IF NOT EXISTS runs_by_work_package ON runs (work_package_id);
+"""
+
+
+def store_path(config_dir: str) -> str:
+    return f"{config_dir}/{STORE_FILE_NAME}"
+
+
+class FingerprintStore:
+    """The feeder fingerprints and incremental run history at `path`, created if it doesn't exist."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fingerprints(self, metadata_hash: str) -> Dict[str, str]:
+        """The stored fingerprints that were taken at `metadata_hash`."""
+        return dict(self.connection.execute(
+            "SELECT feeder, fingerprint FROM fingerprints WHERE metadata_hash = ?", (metadata_hash,)
+        ))
+
+    def write_fingerprints(self, fingerprints: Dict[str, str], metadata_hash: str):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                ((feeder, fingerprint, metadata_hash, now) for feeder, fingerprint in fingerprints.items()),
+            )
+
+    def record_runs(
+        self,
+        combinations: Iterable[Tuple[str, int, str]],
+        fingerprints: Dict[str, str],
+        config_hashes: Dict[str, str],
+        work_package_id: str,
+    ):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((feeder, year, scenario, fingerprints[feeder], config_hashes[feeder], work_package_id, SUBMITTED, now)
+                 for feeder, year, scenario in combinations),
+            )
+
+    def unfinished_work_packages(self) -> List[str]:
+        placeholders = ", ".join("?" * len(FINAL_STATUSES | {DELETED}))
+        return [row[0] for row in self.connection.execute(
+            f"SELECT DISTINCT work_package_id FROM runs WHERE status NOT IN ({placeholders})",
+            tuple(FINAL_STATUSES | {DELETED}),
+        )]
+
+    def update_status(self, work_package_id: str, status: str):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE runs SET status = ?, updated_at = ? WHERE work_package_id = ?", (status, time.time(), work_package_id)
+            )
+
+    def settled(self, feeders: Iterable[str]) -> Set[Tuple[str, int, str, str, str]]:
+        """
+        The (feeder, year, scenario, fingerprint, config hash) of every combination of `feeders` completed or still
+        running.
+        """
+        feeders = list(feeders)
+        placeholders = ", ".join("?" * len(SETTLED_STATUSES))
+        settled = set()
+        # Looked up in chunks to stay under SQLite's limit on query parameters.
+        for i in range(0, len(feeders), SETTLED_CHUNK_SIZE):
+            chunk = feeders[i:i + SETTLED_CHUNK_SIZE]
+            settled.update(self.connection.execute(
+                f"SELECT feeder, year, scenario, fingerprint, config_hash FROM runs "
+                f"WHERE feeder IN ({', '.join('?' * len(chunk))}) AND status IN ({placeholders})",
+                (*chunk, *SETTLED_STATUSES),
+            ))
+        return settled
+
+
+def _encode(value, depth: int = 0):
+    # References to other objects are reduced to their mRID, so each object hashes on its own content and topology.
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "mrid") and depth > 0:
+        return f"@{value.mrid}"
+    if isinstance(value, dict):
+        return sorted((str(k), _encode(v, depth + 1)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sorted((_encode(v, depth + 1) for v in value), key=json.dumps)
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, depth + 1) for v in value]
+    if depth < 3:
+        # Value objects such as position points and phase details, which have no mRID of their own.
+        return [type(value).__name__, {name: _encode(v, depth + 1) for name, v in _attributes(value)}]
+    return str(value)
+
+
+def _attributes(obj) -> List[Tuple[str, object]]:
+    # The EWB model classes use __slots__ (as sets, so sorted here), while some value objects use a __dict__.
+    names = set(getattr(obj, "__dict__", {}))
+    for cls in type(obj).__mro__:
+        slots = getattr(cls, "__slots__", ())
+        names.update([slots] if isinstance(slots, str) else slots)
+    missing = object()
+    attributes = []
+    for name in sorted(names):
+        value = getattr(obj, name, missing) if not name.startswith("__") else missing
+        # Some references, such as a terminal's connectivity node, are held as weak references.
+        if isinstance(value, weakref.ref):
+            value = value()
+        if value is not missing and not callable(value):
+            attributes.append((name, value))
+    return attributes
+
+
+def object_digest(obj) -> str:
+    return json.dumps(_encode(obj), sort_keys=True, separators=(",", ":"), default=str)
+
+
+def fingerprint_objects(objects: Iterable) -> str:
+    digest = hashlib.sha256()
+    for line in sorted(object_digest(o) for o in objects):
+        digest.update(line.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+async def fetch_metadata_hash(clients: ClientManager) -> str:
+    """A hash of the versions and timestamps of EWB's data sources, which change whenever the network model is updated."""
+    service_info = (await clients.network_consumer_client().get_metadata()).throw_on_error().value
+    sources = sorted((s.source, s.version, str(s.timestamp)) for s in service_info.data_sources)
+    return hashlib.sha256(json.dumps([service_info.version, sources]).encode()).hexdigest()
+
+
+async def fetch_fingerprint(clients: ClientManager, feeder: str, hierarchy_feeder=None) -> str:
+    from zepben.ewb import IncludedEnergizedContainers
+
+    client = clients.network_consumer_client()
+    (await client.get_equipment_for_container(
+        feeder,
+        include_energized_containers=IncludedEnergizedContainers.LV_FEEDERS,
+    )).throw_on_error()
+    # Everything fetched for the feeder ends up in the client's service, including the terminals and connectivity nodes
+    # that aren't returned as equipment.
+    objects = list(client.service.objects())
+    if hierarchy_feeder is not None:
+        objects.append(hierarchy_feeder)
+    return fingerprint_objects(objects)
+
+
+async def load_fingerprints(
+    clients: ClientManager,
+    store: FingerprintStore,
+    feeders: Iterable[str],
+    max_in_flight: int = 4,
+) -> Dict[str, str]:
+    """
+    The fingerprint of each feeder, reused from the store if the EWB metadata hasn't changed since it was taken and
+    otherwise fetched from EWB. Feeders that can't be fetched are left out, so they are always treated as changed.
+    """
+    feeders = list(feeders)
+    metadata_hash = await fetch_metadata_hash(clients)
+    fingerprints = store.fingerprints(metadata_hash)
+    stale = [f for f in feeders if f not in fingerprints]
+    if not stale:
+        return {f: fingerprints[f] for f in feeders}
+
+    logger.info(f"Fingerprinting {len(stale)} feeders from EWB")
+    hierarchy = (await clients.network_consumer_client().get_network_hierarchy(
+        include_circuits=False,
+        include_loops=False,
+        include_lv_substations=False,
+        include_lv_feeders=False,
+    )).throw_on_error().value
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(feeder: str) -> Tuple[str, Optional[str]]:
+        async with semaphore:
+            try:
+                return feeder, await fetch_fingerprint(clients, feeder, hierarchy.feeders.get(feeder))
+            except Exception as e:
+                logger.warning(f"Failed to fingerprint feeder {feeder}, it will be submitted: {e}")
+                return feeder, None
+
+    fetched = {feeder: fingerprint for feeder, fingerprint in await asyncio.gather(*(fetch(f) for f in stale))
+               if fingerprint is not None}
+    store.write_fingerprints(fetched, metadata_hash)
+    fingerprints.update(fetched)
+    return {f: fingerprints[f] for f in feeders if f in fingerprints}
+
+
+def hash_config(work_package: BaseModel) -> str:
+    """
+    A hash of everything in a work package other than its feeders, years and scenarios, so any change to the config
+    (time period, model or result settings) marks every combination as changed. Build `work_package` with empty
+    feeder, year and scenario lists.
+    """
+    return hashlib.sha256(canonical_json(work_package).encode()).hexdigest()
+
+
+async def refresh_statuses(eas_client: EasClient, store: FingerprintStore, max_in_flight: int = 8):
+    """
+    Update the status of every recorded work package that hadn't finished when it was last checked, with at most
+    `max_in_flight` lookups outstanding at once.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(work_package_id: str) -> Optional[str]:
+        async with semaphore:
+            try:
+                result = await eas_client.query(
+                    Query.get_work_package_by_id(work_package_id),
+                    HcWorkPackageFields.status,
+                    HcWorkPackageFields.is_deleted,
+                )
+                work_package = result["data"]["getWorkPackageById"]
+            except Exception as e:
+                logger.warning(f"Failed to get status of work package {work_package_id}: {e}")
+                return None
+        return DELETED if work_package is None or work_package["isDeleted"] else work_package["status"]
+
+    unfinished = store.unfinished_work_packages()
+    for work_package_id, status in zip(unfinished, await asyncio.gather(*(fetch(w) for w in unfinished))):
+        if status is not None:
+            store.update_status(work_package_id, status)
+
+
+def changed_combinations(
+    store: FingerprintStore,
+    fingerprints: Dict[str, str],
+    config_hashes: Dict[str, str],
+    feeders: List[str],
+    years: List[int],
+    scenarios: List[str],
+) -> List[Tuple[str, int, str]]:
+    """
+    The feeder/year/scenario combinations not yet completed (or running) with their current fingerprint and their
+    feeder's config hash in `config_hashes`.
+    """
+    settled = store.settled(feeders)
+    return [
+        (feeder, year, scenario)
+        for feeder in feeders for year in years for scenario in scenarios
+        if feeder not in fingerprints
+        or (feeder, year, scenario, fingerprints[feeder], config_hashes[feeder]) not in settled
+    ]
+
+
+def record_submitted_shards(
+    store: FingerprintStore,
+    entries: List[Dict],
+    fingerprints: Dict[str, str],
+    config_hashes: Dict[str, str],
+):
+    """Record the combinations of every submitted shard in a manifest, against the work package it was submitted as."""
+    for entry in entries:
+        if entry["work_package_id"] is None:
+            continue
+        combinations = [(feeder, year, scenario) for feeder in entry["feeders"] if feeder in fingerprints
+                        for year in entry["years"] for scenario in entry["scenarios"]]
+        store.record_runs(combinations, fingerprints, config_hashes, entry["work_package_id"])
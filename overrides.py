@@ -0,0 +1,193 @@
+"""
+Stream fixed time load overrides from a CSV or Parquet file into bounded batches of FeederConfigInput.
+
+The file has one row per feeder, load and override step, with the columns:
+
+    feeder, load_id, step, load_watts, load_var, gen_watts, gen_var
+
+`step` is the 0-based position of the row in the load's override lists, and any of the value columns may be left empty
+to not override that quantity. Rows must be grouped by feeder (i.e. all rows for a feeder are contiguous), so only one
+feeder's overrides are held in memory at a time.
+
+Every overridden list in a feeder must have the same number of entries, with each entry solved as a separate timestep.
+Feeders with more override values than fit in one work package are split by step, so each part still overrides every
+load on the feeder but for a subset of the timesteps.
+"""
+
+import csv
+import math
+from typing import Dict, Iterator, List, Set, Tuple
+
+import numpy as np
+from zepben.eas import FeederConfigInput, FixedTimeInput, FixedTimeLoadOverrideInput
+
+VALUE_COLUMNS = {
+    "load_watts": "loadWattsOverride",
+    "load_var": "loadVarOverride",
+    "gen_watts": "genWattsOverride",
+    "gen_var": "genVarOverride",
+}
+
+DEFAULT_MAX_VALUES_PER_WORK_PACKAGE = 500_000
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None or value == "" else float(value)
+
+
+def _read_csv_rows(path: str) -> Iterator[Tuple]:
+    with open(path, newline="") as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield (row["feeder"], row["load_id"], int(row["step"]), *(_to_float(row.get(c)) for c in VALUE_COLUMNS))
+
+
+def _read_parquet_rows(path: str, batch_size: int = 65536) -> Iterator[Tuple]:
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    value_columns = [c for c in VALUE_COLUMNS if c in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=["feeder", "load_id", "step", *value_columns]):
+        columns = batch.to_pydict()
+        values = [[_to_float(v) for v in columns[c]] if c in columns else [math.nan] * batch.num_rows for c in VALUE_COLUMNS]
+        yield from zip(columns["feeder"], columns["load_id"], columns["step"], *values)
+
+
+def read_override_rows(path: str) -> Iterator[Tuple]:
+    """Stream `(feeder, load_id, step, load_watts, load_var, gen_watts, gen_var)` rows from a CSV or Parquet file."""
+    if path.endswith(".parquet"):
+        return _read_parquet_rows(path)
+    return _read_csv_rows(path)
+
+
+def group_by_feeder(rows: Iterator[Tuple]) -> Iterator[Tuple[str, List[Tuple]]]:
+    """Group contiguous rows by feeder, raising if a feeder's rows are split across the file."""
+    seen = set()
+    feeder, group = None, []
+    for row in rows:
+        if row[0] != feeder:
+            if group:
+                yield feeder, group
+            if row[0] in seen:
+                raise ValueError(f"Overrides for feeder {row[0]} are not contiguous - sort the file by feeder")
+            feeder, group = row[0], []
+            seen.add(feeder)
+        group.append(row)
+    if group:
+        yield feeder, group
+
+
+class FeederOverrides:
+    """
+    The validated overrides for one feeder, held as one (loads x steps) matrix per overridden quantity. A matrix row is
+    all NaN where that load doesn't override the quantity.
+    """
+
+    def __init__(self, feeder: str, rows: List[Tuple]):
+        self.feeder = feeder
+        columns = list(zip(*rows))
+        load_ids, inverse, counts = np.unique(np.asarray(columns[1], dtype=str), return_inverse=True, return_counts=True)
+        steps = np.asarray(columns[2], dtype=np.int64)
+
+        n_steps = int(counts[0])
+        mismatched = counts != n_steps
+        if mismatched.any():
+            lengths = {str(load_id): int(count) for load_id, count in zip(load_ids[mismatched][:10], counts[mismatched][:10])}
+            raise ValueError(f"Feeder {feeder}: every override list must have the same length, but {load_ids[0]} has "
+                             f"{n_steps} entries and {lengths}")
+
+        order = np.lexsort((steps, inverse))
+        if (steps[order].reshape(-1, n_steps) != np.arange(n_steps)).any():
+            raise ValueError(f"Feeder {feeder}: override steps must run from 0 to {n_steps - 1} for every load")
+
+        self.load_ids = load_ids
+        self.n_steps = n_steps
+        self.values: Dict[str, np.ndarray] = {}
+        for i, column in enumerate(VALUE_COLUMNS, start=3):
+            matrix = np.asarray(columns[i], dtype=np.float64)[order].reshape(-1, n_steps)
+            missing = np.isnan(matrix)
+            partial = missing.any(axis=1) & ~missing.all(axis=1)
+            if partial.any():
+                raise ValueError(f"Feeder {feeder}: {column} is only overridden for some steps of loads "
+                                 f"{load_ids[partial][:10].tolist()}")
+            if not missing.all():
+                self.values[column] = matrix
+
+    @property
+    def values_per_step(self) -> int:
+        return sum(int((~np.isnan(matrix[:, 0])).sum()) for matrix in self.values.values())
+
+    def step_chunks(self, max_values: int) -> List[Tuple[int, int]]:
+        """Split the steps into contiguous ranges that each hold at most `max_values` override values."""
+        values_per_step = max(1, self.values_per_step)
+        steps_per_chunk = max_values // values_per_step
+        if steps_per_chunk < 1:
+            raise ValueError(f"Feeder {self.feeder} overrides {values_per_step} values per step, more than the "
+                             f"{max_values} allowed in one work package")
+        return [(start, min(start + steps_per_chunk, self.n_steps)) for start in range(0, self.n_steps, steps_per_chunk)]
+
+    def to_feeder_config(self, years, scenarios, load_time, start: int = 0, end: int = None) -> FeederConfigInput:
+        end = self.n_steps if end is None else end
+        overrides = []
+        for row, load_id in enumerate(self.load_ids):
+            fields = {}
+            for column, matrix in self.values.items():
+                values = matrix[row, start:end]
+                fields[VALUE_COLUMNS[column]] = None if np.isnan(values[0]) else values.tolist()
+            overrides.append(FixedTimeLoadOverrideInput(loadId=str(load_id), **fields))
+
+        return FeederConfigInput(
+            feeder=self.feeder,
+            years=years,
+            scenarios=scenarios,
+            fixedTime=FixedTimeInput(loadTime=load_time, overrides=overrides),
+        )
+
+
+def validate_override_file(path: str, max_values: int = DEFAULT_MAX_VALUES_PER_WORK_PACKAGE) -> Dict[str, int]:
+    """
+    Check every feeder's overrides in `path` without building any feeder configs, so a bad row is found before anything
+    is submitted. Returns counts of the feeders, loads and feeder parts in the file.
+    """
+    counts = {"feeders": 0, "loads": 0, "feeder_parts": 0}
+    for feeder, rows in group_by_feeder(read_override_rows(path)):
+        feeder_overrides = FeederOverrides(feeder, rows)
+        counts["feeders"] += 1
+        counts["loads"] += len(feeder_overrides.load_ids)
+        counts["feeder_parts"] += len(feeder_overrides.step_chunks(max_values))
+    return counts
+
+
+def override_load_ids(path: str) -> Dict[str, Set[str]]:
+    """The overridden load IDs of each feeder in `path`, for checking against the network before submission."""
+    load_ids: Dict[str, Set[str]] = {}
+    for row in read_override_rows(path):
+        load_ids.setdefault(row[0], set()).add(str(row[1]))
+    return load_ids
+
+
+def iter_feeder_config_batches(
+    path: str,
+    years: List[int],
+    scenarios: List[str],
+    load_time,
+    max_values: int = DEFAULT_MAX_VALUES_PER_WORK_PACKAGE,
+) -> Iterator[List[FeederConfigInput]]:
+    """
+    Lazily build the feeder configs for the overrides in `path`, yielding them in batches of at most `max_values`
+    override values, one batch per work package. A feeder only appears once per batch.
+    """
+    batch, batch_values = [], 0
+    for feeder, rows in group_by_feeder(read_override_rows(path)):
+        feeder_overrides = FeederOverrides(feeder, rows)
+        values_per_step = feeder_overrides.values_per_step
+        for start, end in feeder_overrides.step_chunks(max_values):
+            chunk_values = values_per_step * (end - start)
+            if batch and (batch_values + chunk_values > max_values or batch[-1].feeder == feeder):
+                yield batch
+                batch, batch_values = [], 0
+            batch.append(feeder_overrides.to_feeder_config(years, scenarios, load_time, start, end))
+            batch_values += chunk_values
+
+    if batch:
+        yield batch
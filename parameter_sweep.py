@@ -0,0 +1,158 @@
+"""
+Parameter sweeps over HcModelConfigInput, for sensitivity studies: each point of the sweep is run as its own work
+package, identical to a base work package except for the swept model parameters.
+
+Parameters are given by their HcModelConfigInput name, each as a list of `values` or a range of `min` and `max`:
+
+    "parameters": {
+        "maxLoadTxRatio": {"min": 1.5, "max": 4.0, "steps": 6},
+        "closedLoopVRegSetPoint": {"values": [0.98, 0.9925, 1.0]},
+        "seed": {"min": 1, "max": 1000, "integer": true}
+    }
+
+A grid sweep runs every combination of the parameters' values, with `steps` evenly spaced values across each range. A
+Latin hypercube sweep runs `points` points, with each range split into `points` equal strata and each stratum sampled
+exactly once, so every parameter's range is covered evenly however few points there are. Parameters given as values are
+sampled evenly across their values.
+
+The base work package is built once, and each point only copies and replaces its model config - everything else
+(forecast, solve and result processor config) is shared between the points rather than rebuilt for each.
+"""
+
+import csv
+import itertools
+from typing import Dict, List
+
+import numpy as np
+from pydantic import BaseModel
+from zepben.eas import HcModelConfigInput
+
+GRID = "grid"
+LATIN_HYPERCUBE = "latin_hypercube"
+
+DEFAULT_MAX_POINTS = 1000
+
+# The HcModelConfigInput field for each of its GraphQL names, which are the names sweeps are configured with.
+_MODEL_FIELDS = {field.alias or name: name for name, field in HcModelConfigInput.model_fields.items()}
+
+
+def _check_parameters(parameters: Dict[str, Dict]):
+    if not parameters:
+        raise ValueError("A parameter sweep needs at least one parameter")
+    for name, spec in parameters.items():
+        if name not in _MODEL_FIELDS:
+            raise ValueError(f"{name} isn't an HcModelConfigInput parameter")
+        if "values" in spec:
+            if not spec["values"]:
+                raise ValueError(f"{name} has no values")
+        elif "min" not in spec or "max" not in spec or spec["min"] > spec["max"]:
+            raise ValueError(f"{name} needs either values or a min and max with min <= max")
+
+
+def _cast(spec: Dict, value):
+    if spec.get("integer"):
+        return int(round(value))
+    return float(value)
+
+
+def _grid_values(name: str, spec: Dict) -> List:
+    if "values" in spec:
+        return list(spec["values"])
+    if "steps" not in spec:
+        raise ValueError(f"{name} needs steps for a grid sweep")
+    values = [_cast(spec, v) for v in np.linspace(spec["min"], spec["max"], spec["steps"])]
+    # Integer ranges with more steps than integers would otherwise repeat values.
+    return list(dict.fromkeys(values))
+
+
+def expand_grid(parameters: Dict[str, Dict]) -> List[Dict]:
+    """Every combination of the parameters' values, varying the last parameter fastest."""
+    _check_parameters(parameters)
+    values = [_grid_values(name, spec) for name, spec in parameters.items()]
+    return [dict(zip(parameters, point)) for point in itertools.product(*values)]
+
+
+def latin_hypercube(parameters: Dict[str, Dict], points: int, seed: int = 0) -> List[Dict]:
+    """`points` points sampled from the parameters by Latin hypercube sampling, reproducible for a given `seed`."""
+    _check_parameters(parameters)
+    if points < 1:
+        raise ValueError(f"A Latin hypercube sweep needs at least one point, got {points}")
+
+    rng = np.random.default_rng(seed)
+    # One row per point and one column per parameter, each column holding one sample from each of the `points` strata of
+    # [0, 1), in a random order.
+    strata = np.stack([rng.permutation(points) for _ in parameters], axis=1)
+    samples = (strata + rng.random(strata.shape)) / points
+
+    columns = []
+    for (name, spec), column in zip(parameters.items(), samples.T):
+        if "values" in spec:
+            columns.append([spec["values"][int(u * len(spec["values"]))] for u in column])
+        else:
+            columns.append([_cast(spec, spec["min"] + u * (spec["max"] - spec["min"])) for u in column])
+    return [dict(zip(parameters, point)) for point in zip(*columns)]
+
+
+def plan_points(sweep_config: Dict) -> List[Dict]:
+    """The points of the sweep in `sweep_config` (the `parameter_sweep` section of config.json), one dict per point."""
+    method = sweep_config.get("method", GRID)
+    if method == GRID:
+        points = expand_grid(sweep_config["parameters"])
+    elif method == LATIN_HYPERCUBE:
+        points = latin_hypercube(sweep_config["parameters"], sweep_config["points"], sweep_config.get("seed", 0))
+    else:
+        raise ValueError(f"Unknown sweep method {method}, expected {GRID} or {LATIN_HYPERCUBE}")
+
+    max_points = sweep_config.get("max_points", DEFAULT_MAX_POINTS)
+    if len(points) > max_points:
+        raise ValueError(f"The sweep has {len(points)} points, more than max_points ({max_points})")
+    # Checked up front so a bad value fails the sweep before anything is submitted, not part way through.
+    for point in points:
+        HcModelConfigInput.model_validate(point)
+    return points
+
+
+def point_label(point: Dict) -> str:
+    return ",".join(f"{name}={value:g}" if isinstance(value, float) else f"{name}={value}"
+                    for name, value in point.items())
+
+
+def apply_point(base: BaseModel, point: Dict) -> BaseModel:
+    """
+    A copy of the `base` work package with the parameters of `point` set in its model config. Only the work package,
+    its generator config and its model config are copied; everything else is shared with `base`.
+    """
+    generator_config = base.generator_config
+    model = generator_config.model.model_copy(update={_MODEL_FIELDS[name]: value for name, value in point.items()})
+    return base.model_copy(update={"generator_config": generator_config.model_copy(update={"model": model})})
+
+
+def plan_sweep_shards(points: List[Dict], feeders: List[str], years: List[int], scenarios: List[str]) -> List[Dict]:
+    """One shard per point, for submit_shards, each carrying its point number, parameters and label."""
+    return [
+        {"shard": i, "point": i, "feeders": feeders, "years": years, "scenarios": scenarios, "parameters": point,
+         "label": point_label(point)}
+        for i, point in enumerate(points)
+    ]
+
+
+def write_sweep_index(path: str, entries: List[Dict]):
+    """
+    Write a CSV with the work package of each point, and a column per parameter, to compare the results by. A point
+    whose feeders take their tap settings from more than one calibration set has a row per work package.
+    """
+    names = list(entries[0]["parameters"]) if entries else []
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["point", "work_package_name", "work_package_id", "tap_settings", *names])
+        for entry in entries:
+            writer.writerow([entry["point"], entry["work_package_name"], entry["work_package_id"] or "",
+                             entry.get("tap_settings") or "", *(entry["parameters"][name] for name in names)])
+
+
+def print_sweep_summary(entries: List[Dict]):
+    submitted = sum(entry["work_package_id"] is not None for entry in entries)
+    print(f"{submitted} of {len(entries)} sweep points submitted")
+    for entry in entries:
+        status = entry["work_package_id"] if entry["work_package_id"] is not None else f"FAILED ({'; '.join(entry['errors'])})"
+        print(f'{entry["work_package_name"]} [{entry["label"]}] work_package_id={status}')
@@ -0,0 +1,106 @@
+"""
+Compile default load/generation profiles for HcModelConfigInput.
+
+A profile can be given inline as a list of values, or as a path to a CSV or .npy file. Profiles are validated against
+the lengths HCM accepts, resampled between 15, 30 and 60 minute intervals to match loadIntervalLengthHours, and
+optionally expanded from a daily to a yearly profile. Compiled profiles are cached as .npy files keyed by a hash of
+their content, so large yearly profiles are only parsed and resampled once.
+"""
+
+import hashlib
+import os
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+# Number of entries in a daily profile for each supported interval length (in hours). Yearly profiles have 365 times as
+# many entries.
+DAILY_LENGTHS = {0.25: 96, 0.5: 48, 1.0: 24}
+DAYS_PER_YEAR = 365
+
+CACHE_DIR_NAME = ".profile_cache"
+
+
+def profile_interval(length: int) -> Tuple[float, bool]:
+    """Return the interval length in hours for a profile of `length` entries, and whether it is a yearly profile."""
+    for interval_hours, daily_length in DAILY_LENGTHS.items():
+        if length == daily_length:
+            return interval_hours, False
+        if length == daily_length * DAYS_PER_YEAR:
+            return interval_hours, True
+
+    valid = sorted([*DAILY_LENGTHS.values(), *(n * DAYS_PER_YEAR for n in DAILY_LENGTHS.values())])
+    raise ValueError(f"Profile has {length} entries, expected one of {valid}")
+
+
+def resample(profile: np.ndarray, from_hours: float, to_hours: float) -> np.ndarray:
+    """
+    Resample a profile between interval lengths. Coarser intervals take the mean of the finer intervals they cover, and
+    finer intervals repeat the value of the coarser interval they fall in.
+    """
+    if from_hours == to_hours:
+        return profile
+    if to_hours > from_hours:
+        return profile.reshape(-1, int(round(to_hours / from_hours))).mean(axis=1)
+    return np.repeat(profile, int(round(from_hours / to_hours)))
+
+
+def compile_profile(values, interval_hours: float, yearly: bool = False) -> np.ndarray:
+    """
+    Validate `values` and convert it to a profile at `interval_hours`. Daily profiles are expanded to yearly ones if
+    `yearly` is set, yearly profiles are always kept yearly.
+    """
+    if interval_hours not in DAILY_LENGTHS:
+        raise ValueError(f"Unsupported load interval length {interval_hours}h, expected one of {sorted(DAILY_LENGTHS)}")
+
+    profile = np.asarray(values, dtype=np.float64).ravel()
+    if not np.isfinite(profile).all():
+        raise ValueError("Profile contains missing or non-finite values")
+
+    source_hours, source_yearly = profile_interval(len(profile))
+    profile = resample(profile, source_hours, interval_hours)
+    if yearly and not source_yearly:
+        profile = np.tile(profile, DAYS_PER_YEAR)
+    return profile
+
+
+def load_profile_file(path: str) -> np.ndarray:
+    """Load a profile from a .npy file (memory mapped) or a single row/column CSV file."""
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return np.loadtxt(path, delimiter=",", ndmin=1)
+
+
+def resolve_profile(
+    config_dir: str,
+    profile: Union[None, str, List[float]],
+    interval_hours: float,
+    yearly: bool = False,
+) -> Optional[List[float]]:
+    """
+    Compile a profile from config, which may be None, an inline list of values, or a path (relative to the config
+    directory) to a CSV or .npy file. Returns the compiled profile as a list ready for HcModelConfigInput.
+    """
+    if profile is None:
+        return None
+
+    if isinstance(profile, str):
+        path = os.path.join(config_dir, profile)
+        with open(path, "rb") as file:
+            content = file.read()
+        source = lambda: load_profile_file(path)
+    else:
+        content = np.asarray(profile, dtype=np.float64).tobytes()
+        source = lambda: profile
+
+    key = hashlib.sha256(content + f"|{interval_hours}|{yearly}".encode()).hexdigest()
+    cache_path = os.path.join(config_dir, CACHE_DIR_NAME, f"{key}.npy")
+    if os.path.exists(cache_path):
+        return np.load(cache_path, mmap_mode="r").tolist()
+
+    compiled = compile_profile(source(), interval_hours, yearly)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.tmp.npy"
+    np.save(temp_path, compiled)
+    os.replace(temp_path, cache_path)
+    return compiled.tolist()
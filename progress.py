@@ -0,0 +1,122 @@
+"""
+Track work package progress between polls of Query.get_active_work_packages(), so a monitor can report only what changed
+and adjust how often it polls.
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+PENDING = "pending"
+IN_PROGRESS = "inProgress"
+
+
+def extract_progress(result) -> Dict[str, Dict[str, Any]]:
+    """
+    Flatten an active work packages payload into a map of work package ID to its progress fields.
+
+    Pending work packages only have an ID, so they are given a single `status` field.
+    """
+    payload = next(iter(result["data"].values())) or {}
+    states = {work_package_id: {"status": PENDING} for work_package_id in payload.get("pending") or []}
+    for progress in payload.get(IN_PROGRESS) or []:
+        states[progress["id"]] = {k: v for k, v in progress.items() if k != "id"}
+    return states
+
+
+def active_work_package_ids(result) -> Optional[Set[str]]:
+    """
+    The IDs of the work packages in an active work packages payload, or None if the payload isn't the expected dict of
+    pending and in progress work packages. Anything limiting submissions by the active count should treat None as
+    unknown rather than as nothing active.
+    """
+    payload = next(iter((result.get("data") or {}).values()), None)
+    if not isinstance(payload, dict) or (PENDING not in payload and IN_PROGRESS not in payload):
+        return None
+    return set(extract_progress(result))
+
+
+class ProgressTracker:
+    """
+    Remembers the last seen state of each active work package and a bounded history of its progress percentage.
+
+    Work packages that are no longer active are dropped, so memory use stays flat however long the monitor runs.
+    """
+
+    def __init__(self, history_length: int = 20):
+        self.history_length = history_length
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self.history: Dict[str, Deque[Tuple[float, float]]] = {}
+
+    def update(self, states: Dict[str, Dict[str, Any]], now: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Record a new set of states and return what changed, keyed by work package ID.
+
+        Each change maps a field name to an `(old, new)` tuple. Newly seen work packages have `old` set to None for every
+        field, and work packages that are no longer active map to an empty dict.
+        """
+        now = time.monotonic() if now is None else now
+        changes = {}
+        for work_package_id, state in states.items():
+            previous = self.states.get(work_package_id, {})
+            changed = {k: (previous.get(k), v) for k, v in state.items() if previous.get(k) != v}
+            if changed:
+                changes[work_package_id] = changed
+
+            percent = state.get("progressPercent")
+            if percent is not None:
+                history = self.history.setdefault(work_package_id, deque(maxlen=self.history_length))
+                if not history or history[-1][1] != percent:
+                    history.append((now, percent))
+
+        for work_package_id in self.states.keys() - states.keys():
+            changes[work_package_id] = {}
+            self.history.pop(work_package_id, None)
+
+        self.states = states
+        return changes
+
+    def seconds_remaining(self, work_package_id: str, now: Optional[float] = None) -> Optional[float]:
+        """Estimate the time until a work package completes from its progress history, or None if there is too little history."""
+        history = self.history.get(work_package_id)
+        if not history or len(history) < 2:
+            return None
+        (start_time, start_percent), (end_time, end_percent) = history[0], history[-1]
+        if end_percent <= start_percent:
+            return None
+        rate = (end_percent - start_percent) / (end_time - start_time)
+        now = time.monotonic() if now is None else now
+        return max(0.0, (100 - end_percent) / rate - (now - end_time))
+
+    def near_completion(self, within_seconds: float, threshold_percent: float = 95.0) -> bool:
+        """True if any work package is expected to finish within `within_seconds`, or has passed `threshold_percent`."""
+        for work_package_id, state in self.states.items():
+            if (state.get("progressPercent") or 0) >= threshold_percent:
+                return True
+            remaining = self.seconds_remaining(work_package_id)
+            if remaining is not None and remaining <= within_seconds:
+                return True
+        return False
+
+
+class AdaptivePoller:
+    """
+    Work out how long to wait before the next poll: back off exponentially while nothing changes, drop back to the base
+    interval when something does, and poll at the minimum interval when a work package is close to finishing.
+    """
+
+    def __init__(self, base_interval: float = 5.0, min_interval: float = 1.0, max_interval: float = 60.0, backoff: float = 2.0):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = base_interval
+
+    def next_interval(self, changed: bool, near_completion: bool = False) -> float:
+        if near_completion:
+            self.interval = self.min_interval
+        elif changed:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.max_interval, max(self.base_interval, self.interval * self.backoff))
+        return self.interval
@@ -0,0 +1,146 @@
+"""
+Add a job to the job queue run by run_job_queue.py, or list what is queued (see job_queue.py):
+
+    python queue_jobs.py ./config --kind=forecast|override|intrinsic|calibration [--priority=urgent|normal|bulk]
+        [--study=<directory>] [--job=<label>]
+    python queue_jobs.py ./config --list [--job=<label>]
+
+The job is planned from the config.json in --study (default the config directory) exactly as its runner script would
+plan it, and each of its work packages or calibrations is queued:
+
+- forecast: the feeder x year x scenario matrix, split into shards of shard_size and by tap settings as
+  run_forecast_work_package.py does,
+- override: a work package per batch of the overrides_file, checked against the network first as
+  run_feeder_override_work_package.py does,
+- intrinsic: the intrinsic_fanout runs, or the single intrinsic work package, of run_intrinsic_work_package.py,
+- calibration: a calibration per calibration_times or calibration_time_range period (as run_calibration_sweep.py), of
+  the feeders without cached tap settings.
+
+Jobs are labelled with the study's work_package_name unless --job is given, and queued as normal priority unless
+--priority is given. Queue connection enquiries as urgent and large planning studies as bulk.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+from zepben.eas import FeederConfigsInput
+
+from calibration_sweep import calibration_times, period_calibration_name
+from job_queue import CALIBRATE, FORECAST, INTRINSIC, KINDS, NORMAL, OVERRIDE, JobQueue, calibration_entry, \
+    print_queue_table, store_path, work_package_entry
+from overrides import DEFAULT_MAX_VALUES_PER_WORK_PACKAGE, iter_feeder_config_batches, override_load_ids, \
+    validate_override_file
+from run_calibration import build_generator_config
+from run_feeder_override_work_package import build_work_package as build_override_work_package, check_against_network
+from run_forecast_work_package import build_shard_work_package, plan_forecast_shards
+from run_intrinsic_work_package import build_initial_state_selector, build_injection_resource, build_search, \
+    build_work_package as build_intrinsic_work_package, plan_fanout
+from sharding import shard_work_package_name
+from tap_settings import feeders_needing_calibration, latest_tap_settings, split_shards_by_tap_settings
+from utils import get_config, get_config_dir, get_option, has_flag
+
+
+async def plan_forecast(study_dir, config):
+    tap_settings = latest_tap_settings(study_dir, config, config["feeders"])
+    whole = {"shard": 0, "feeders": config["feeders"], "years": config["forecast_years"], "scenarios": config["scenarios"]}
+    if not config.get("shard_size") and len(set(tap_settings.values())) <= 1:
+        whole["tap_settings"] = next(iter(tap_settings.values()), None)
+        return [work_package_entry(config["work_package_name"], build_shard_work_package(config, whole))]
+
+    shards = await plan_forecast_shards(study_dir, config) if config.get("shard_size") else [whole]
+    return [
+        work_package_entry(shard_work_package_name(config["work_package_name"], shard), build_shard_work_package(config, shard))
+        for shard in split_shards_by_tap_settings(shards, tap_settings)
+    ]
+
+
+async def plan_overrides(study_dir, config):
+    if not config.get("overrides_file"):
+        raise ValueError("Override jobs are planned from the overrides_file in config.json, and none is set")
+    path = os.path.join(study_dir, config["overrides_file"])
+    max_values = config.get("max_override_values_per_work_package", DEFAULT_MAX_VALUES_PER_WORK_PACKAGE)
+    validate_override_file(path, max_values)
+    if not await check_against_network(study_dir, config, override_load_ids(path)):
+        return []
+
+    batches = iter_feeder_config_batches(
+        path,
+        years=config["forecast_years"],
+        scenarios=config["scenarios"],
+        load_time=datetime.fromisoformat(config["load_time"]["start1"]),
+        max_values=max_values,
+    )
+    return [
+        work_package_entry(f'{config["work_package_name"]}-part-{i:04d}',
+                           build_override_work_package(FeederConfigsInput(configs=feeder_configs)))
+        for i, feeder_configs in enumerate(batches)
+    ]
+
+
+def plan_intrinsic(config):
+    if config.get("intrinsic_fanout"):
+        runs, build = plan_fanout(config)
+        return [work_package_entry(shard_work_package_name(config["work_package_name"], run, "intrinsic"), build(run))
+                for run in runs]
+
+    return [work_package_entry(config["work_package_name"], build_intrinsic_work_package(
+        config["feeders"],
+        scenario="base",
+        year=config["forecast_years"][0],
+        initial_state_selector=build_initial_state_selector(config),
+        injection_resource=build_injection_resource(),
+        search=build_search(),
+    ))]
+
+
+def plan_calibrations(study_dir, config):
+    feeders = feeders_needing_calibration(study_dir, config, config["feeders"])
+    if not feeders:
+        print("Every feeder already has cached tap settings, nothing to calibrate")
+        return []
+    calibration_name = config.get("calibration_name", config["work_package_name"])
+    generator_config = build_generator_config()
+    return [calibration_entry(period_calibration_name(calibration_name, t), t, feeders, generator_config)
+            for t in calibration_times(config)]
+
+
+async def plan_job(study_dir, config, kind):
+    """The `(name, input)` entries to queue for a job of `kind` planned from `config`."""
+    if kind == FORECAST:
+        return await plan_forecast(study_dir, config)
+    if kind == OVERRIDE:
+        return await plan_overrides(study_dir, config)
+    if kind == INTRINSIC:
+        return plan_intrinsic(config)
+    if kind == CALIBRATE:
+        return plan_calibrations(study_dir, config)
+    raise ValueError(f"Unknown job kind {kind}, expected one of {list(KINDS)}")
+
+
+async def list_jobs(argv):
+    with JobQueue(store_path(get_config_dir(argv))) as queue:
+        print_queue_table(queue.entries(get_option(argv, "--job")))
+
+
+async def main(argv):
+    if has_flag(argv, "--list"):
+        await list_jobs(argv)
+        return
+
+    config_dir = get_config_dir(argv)
+    study_dir = get_option(argv, "--study", config_dir)
+    config = get_config(study_dir)
+    kind = get_option(argv, "--kind")
+    priority = get_option(argv, "--priority", NORMAL)
+    job = get_option(argv, "--job", config["work_package_name"])
+
+    entries = await plan_job(study_dir, config, kind)
+    with JobQueue(store_path(config_dir)) as queue:
+        queued = queue.enqueue(job, kind, priority, entries)
+    print(f"Queued {queued} {kind} entries for {job} as {priority}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
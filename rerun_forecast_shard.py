@@ -0,0 +1,44 @@
+"""
+Resubmit a single shard of a sharded forecast work package, using the manifest saved by run_forecast_work_package.py when
+shard_size is set in config.json. The manifest is updated with the new work package ID for the shard.
+"""
+
+import asyncio
+import sys
+
+from ledger import open_ledger
+from run_forecast_work_package import build_shard_work_package
+from sharding import manifest_path, read_manifest, submit_shards, write_manifest, print_manifest
+from utils import get_client, get_config, get_config_dir
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    eas_client = get_client(config_dir)
+
+    path = manifest_path(config_dir, config["work_package_name"])
+    manifest = read_manifest(path)
+    shard_index = int(input("Please enter index of shard to rerun: "))
+    shard = manifest["shards"][shard_index]
+    # A shard that failed is submitted again, but one that is still running or completed keeps its work package ID.
+    ledger = open_ledger(config_dir, config)
+
+    [entry] = await submit_shards(
+        eas_client,
+        [shard],
+        lambda s: build_shard_work_package(config, s),
+        manifest["work_package_name"],
+        ledger=ledger,
+    )
+    manifest["shards"][shard_index] = entry
+    write_manifest(path, manifest["work_package_name"], manifest["shards"])
+    print_manifest([entry])
+
+    await eas_client.close()
+    if ledger is not None:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
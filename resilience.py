@@ -0,0 +1,269 @@
+"""
+Retries with backoff, and circuit breaking, for EAS calls.
+
+make_resilient wraps an EasClient's execute_custom_operation, which its query and mutation methods go through, so that
+transient failures are retried after a jittered exponential backoff. What is retried depends on the operation:
+
+- Queries are idempotent, so every transient failure is retried: connection errors, timeouts, HTTP 429, 500, 502, 503
+  and 504, and GraphQL errors reporting a timeout or an unavailable or overloaded service.
+- Mutations are only retried when EAS can't have acted on them: the connection failed before the request was sent, or
+  EAS answered 429 or 503.
+- Work package submissions are guarded by an idempotency key, the work package name. When EAS may have acted on a
+  submission (it timed out, or EAS answered 500, 502 or 504), EAS is asked for work packages with that name created since
+  the first attempt. If there is one its ID is returned as the result, and otherwise the submission is retried.
+
+A Retry-After header on a 429 or 503 response is used in place of the computed backoff, so rate limiting is respected.
+
+Every call on the client shares a CircuitBreaker, which opens after `failure_threshold` transient failures in a row.
+While it is open, calls wait rather than fail. A batch driver is paused instead of failing its units or sending
+thousands of requests to an overloaded server. Once `reset_seconds` have passed a single probe call is let through: if
+it succeeds the breaker closes and the waiting calls carry on, otherwise it opens again for twice as long, up to
+`max_reset_seconds`. If the probe is cancelled, the next call is let through as the probe instead.
+
+Retries are counted in the client metrics (see instrumentation.py).
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional
+
+from instrumentation import METRICS, Metrics, classify_error
+
+if TYPE_CHECKING:
+    from zepben.eas.client.eas_client import EasClient
+
+logger = logging.getLogger()
+
+# EAS can't have acted on the request, so it's safe to send again.
+NOT_PROCESSED = "not_processed"
+# The request failed transiently, but EAS may have acted on it.
+UNKNOWN_OUTCOME = "unknown_outcome"
+
+QUERY = "query"
+MUTATION = "mutation"
+SUBMISSION = "submission"
+
+# Mutations that submit a work package, with their idempotency key argument.
+SUBMISSIONS = {"runWorkPackage": "workPackageName", "runIntrinsicWorkPackage": "workPackageName"}
+
+_TRANSIENT_MESSAGE = re.compile(r"timed? ?out|unavailable|overloaded|too many requests|try again|connection reset", re.I)
+
+# Allowance for the EAS clock being behind ours when matching a work package to a submission attempt.
+CLOCK_SKEW_SECONDS = 60.0
+
+
+class RetryPolicy(NamedTuple):
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        """The backoff before attempt `attempt + 1`, with full jitter so concurrent callers don't retry in lockstep."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def classify_failure(error: BaseException) -> Optional[str]:
+    """NOT_PROCESSED or UNKNOWN_OUTCOME for a transient failure, or None if retrying wouldn't help."""
+    import httpx
+    from zepben.eas.lib.exceptions import GraphQLClientGraphQLMultiError, GraphQLClientHttpError
+
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return NOT_PROCESSED
+    if isinstance(error, GraphQLClientHttpError):
+        if error.status_code in (429, 503):
+            return NOT_PROCESSED
+        return UNKNOWN_OUTCOME if error.status_code in (500, 502, 504) else None
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return UNKNOWN_OUTCOME
+    if isinstance(error, GraphQLClientGraphQLMultiError) and error.errors \
+            and all(_TRANSIENT_MESSAGE.search(str(e)) for e in error.errors):
+        return UNKNOWN_OUTCOME
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """The seconds to wait asked for by a Retry-After header on the error's response, if it has one."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Stops calls while the server is failing. Call `acquire` before each call and `record_success` or `record_failure`
+    after it. See the module docstring for how it opens and closes.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0, max_reset_seconds: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max_reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_seconds = reset_seconds
+        self.probing = False
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    async def acquire(self) -> bool:
+        """Return once a call may be made, waiting while the breaker is open, and whether the call is the probe."""
+        while self.opened_at is not None:
+            remaining = self.opened_at + self.open_seconds - time.monotonic()
+            if remaining <= 0 and not self.probing:
+                self.probing = True
+                logger.info("Circuit breaker half open, sending a probe request")
+                return True
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout=remaining if remaining > 0 else self.open_seconds)
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Circuit breaker closed")
+        self.failures = 0
+        self.opened_at = None
+        self.open_seconds = self.reset_seconds
+        self.probing = False
+        self._closed.set()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing:
+            self.probing = False
+            self.open_seconds = min(self.max_reset_seconds, self.open_seconds * 2)
+            self._open()
+        elif self.opened_at is None and self.failures >= self.failure_threshold:
+            self._open()
+
+    def abandon_probe(self):
+        """Give up the probe of a call that neither succeeded nor failed, e.g. was cancelled, so another call can probe."""
+        self.probing = False
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._closed.clear()
+        logger.warning(f"Circuit breaker open after {self.failures} failures in a row, pausing calls for "
+                       f"{self.open_seconds:g}s")
+
+
+def _operation_kind(fields, operation_type) -> str:
+    if operation_type.value == "query":
+        return QUERY
+    if len(fields) == 1 and fields[0]._field_name in SUBMISSIONS:
+        return SUBMISSION
+    return MUTATION
+
+
+def _idempotency_key(field) -> str:
+    return field._variables[SUBMISSIONS[field._field_name]]["value"]
+
+
+async def find_submitted_work_package(eas_client: "EasClient", work_package_name: str, since: float) -> Optional[str]:
+    """The ID of a work package named `work_package_name` created since `since` (a time.time()), if there is one."""
+    from zepben.eas import HcWorkPackageFields, HcWorkPackagePageFields, HcWorkPackagesFilterInput, Query
+
+    result = await eas_client.query(
+        Query.get_work_packages(filter_=HcWorkPackagesFilterInput(name=work_package_name), limit=100),
+        HcWorkPackagePageFields.work_packages().fields(
+            HcWorkPackageFields.id,
+            HcWorkPackageFields.name,
+            HcWorkPackageFields.created_at,
+        ),
+    )
+    for work_package in (result["data"]["getWorkPackages"] or {}).get("workPackages") or []:
+        # The filter matches partial names, so check for an exact match.
+        if work_package["name"] != work_package_name:
+            continue
+        created_at = datetime.fromisoformat(work_package["createdAt"].replace("Z", "+00:00"))
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if created_at.timestamp() >= since - CLOCK_SKEW_SECONDS:
+            return work_package["id"]
+    return None
+
+
+def make_resilient(
+    eas_client: "EasClient",
+    policy: RetryPolicy = RetryPolicy(),
+    breaker: Optional[CircuitBreaker] = None,
+    metrics: Metrics = METRICS,
+) -> "EasClient":
+    """Retry transient failures of every query and mutation made with `eas_client`, behind a shared circuit breaker."""
+    execute_custom_operation = eas_client.execute_custom_operation
+    breaker = breaker or CircuitBreaker()
+    eas_client.circuit_breaker = breaker
+
+    async def resilient_execute_custom_operation(*fields, operation_type, operation_name=None) -> Dict:
+        operation = operation_name or "-".join(f._field_name for f in fields)
+        kind = _operation_kind(fields, operation_type)
+        started = time.time()
+        attempt = 1
+        while True:
+            probe = await breaker.acquire()
+            try:
+                result = await execute_custom_operation(*fields, operation_type=operation_type, operation_name=operation_name)
+            except Exception as e:
+                failure = classify_failure(e)
+                if failure is None:
+                    # EAS answered, so it's up - this call just can't succeed.
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt >= policy.max_attempts or (kind == MUTATION and failure == UNKNOWN_OUTCOME):
+                    raise
+
+                if kind == SUBMISSION and failure == UNKNOWN_OUTCOME:
+                    field = fields[0]
+                    try:
+                        work_package_id = await find_submitted_work_package(eas_client, _idempotency_key(field), started)
+                    except Exception as lookup_error:
+                        logger.error(f"Failed to check whether {_idempotency_key(field)} was submitted, not retrying: "
+                                     f"{lookup_error}")
+                        raise e
+                    if work_package_id is not None:
+                        logger.info(f"{_idempotency_key(field)} was submitted as {work_package_id} before {operation} "
+                                    f"failed ({classify_error(e)})")
+                        return {"data": {field._alias or field._field_name: work_package_id}}
+
+                delay = retry_after(e)
+                if delay is None:
+                    delay = policy.delay(attempt)
+                logger.warning(f"{operation} failed ({classify_error(e)}), retrying in {delay:.1f}s "
+                               f"(attempt {attempt + 1} of {policy.max_attempts})")
+                metrics.retry("eas", operation)
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException:
+                # Cancelled mid-call. Without this a cancelled probe would leave the breaker half open for good, with
+                # every later call waiting on a probe that will never finish. Other calls leave the probe running.
+                if probe:
+                    breaker.abandon_probe()
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+    eas_client.execute_custom_operation = resilient_execute_custom_operation
+    return eas_client
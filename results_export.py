@@ -0,0 +1,287 @@
+"""
+Export the results of a finished work package to Parquet, one file per result table, feeder, year and scenario:
+
+    <output>/<table>/feeder=<feeder>/year=<year>/scenario=<scenario>/part-0.parquet
+
+The directories follow the hive partitioning convention, so pyarrow.dataset, DuckDB or Spark can read each table's
+directory as a single dataset.
+
+EAS doesn't serve results over its GraphQL API - the hosting capacity service writes them to its results database - so
+they are read from that database (`results_database` in auth_config.json). EAS is only asked for the work package, to
+check it has finished and to get its feeders, years and scenarios and which optional results it was configured to write.
+
+Each partition is read through a server-side cursor, `page_size` rows at a time, and every page is written to the
+partition's Parquet file as a row group as soon as it arrives, so at most `page_size` x `max_in_flight` rows are held in
+memory however large the result set is. Up to `max_in_flight` partitions are read concurrently over a connection pool.
+Partitions are written to a temporary file and renamed once complete, and partitions already exported are skipped, so
+an interrupted export can simply be rerun.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional
+
+from zepben.eas import HcWorkPackageFields, Query, WorkPackageState
+from zepben.eas.client.eas_client import EasClient
+
+from ledger import FINAL_STATUSES
+from utils import logger
+
+if TYPE_CHECKING:
+    import asyncpg
+    import pyarrow as pa
+
+DEFAULT_PAGE_SIZE = 50_000
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class ResultTable(NamedTuple):
+    table: str
+    # The work package config flag that has to be set for the table to be written, or None if it always is.
+    enabled_by: Optional[str] = None
+
+
+# Result tables in the results database, keyed by the name used for their export directory. Each has work_package_id,
+# feeder, year and scenario columns. The table names can be overridden with `results_export.tables` in config.json.
+RESULT_TABLES = {
+    "enhanced_metrics": ResultTable("enhanced_network_performance_metrics", "populateEnhancedMetrics"),
+    "enhanced_metrics_profile": ResultTable("enhanced_network_performance_metrics_profile", "populateEnhancedMetricsProfile"),
+    "voltage_exceptions_raw": ResultTable("voltage_exceptions_raw", "voltageExceptionsRaw"),
+    "overloads_raw": ResultTable("overloads_raw", "overloadsRaw"),
+}
+
+
+PARTITION_COLUMNS = ("feeder", "year", "scenario")
+
+
+class Partition(NamedTuple):
+    name: str
+    table: str
+    feeder: str
+    year: int
+    scenario: str
+
+
+async def fetch_work_package(eas_client: EasClient, work_package_id: str) -> Dict:
+    result = await eas_client.query(
+        Query.get_work_package_by_id(work_package_id),
+        HcWorkPackageFields.id,
+        HcWorkPackageFields.name,
+        HcWorkPackageFields.status,
+        HcWorkPackageFields.feeders,
+        HcWorkPackageFields.years,
+        HcWorkPackageFields.scenarios,
+        HcWorkPackageFields.config,
+    )
+    work_package = result["data"]["getWorkPackageById"]
+    if work_package is None:
+        raise ValueError(f"Work package {work_package_id} not found")
+    if work_package["status"] not in FINAL_STATUSES:
+        raise ValueError(f"Work package {work_package_id} is {work_package['status']} - wait for it to finish")
+    if work_package["status"] != WorkPackageState.COMPLETED.value:
+        logger.warning(f"Work package {work_package_id} is {work_package['status']}, its results may be incomplete")
+    return work_package
+
+
+def _config_flag(config, flag: str) -> Optional[bool]:
+    """The value of `flag` anywhere in a work package config, or None if it isn't set."""
+    if isinstance(config, dict):
+        if config.get(flag) is not None:
+            return bool(config[flag])
+        values = (_config_flag(value, flag) for value in config.values())
+        return next((value for value in values if value is not None), None)
+    if isinstance(config, list):
+        return next((value for value in (_config_flag(item, flag) for item in config) if value is not None), None)
+    return None
+
+
+def enabled_tables(work_package: Dict, tables: Dict[str, ResultTable] = RESULT_TABLES) -> Dict[str, ResultTable]:
+    """The result tables the work package was configured to write. Without a config, every table is exported."""
+    config = work_package.get("config")
+    if isinstance(config, str):
+        config = json.loads(config)
+    if not config:
+        return dict(tables)
+    return {name: table for name, table in tables.items()
+            if table.enabled_by is None or _config_flag(config, table.enabled_by)}
+
+
+def plan_partitions(work_package: Dict, tables: Dict[str, ResultTable]) -> List[Partition]:
+    return [
+        Partition(name, table.table, feeder, year, scenario)
+        for name, table in tables.items()
+        for feeder in work_package["feeders"] for year in work_package["years"] for scenario in work_package["scenarios"]
+    ]
+
+
+def partition_path(output_dir: str, partition: Partition) -> str:
+    return os.path.join(
+        output_dir, partition.name, f"feeder={partition.feeder}", f"year={partition.year}",
+        f"scenario={partition.scenario}", "part-0.parquet",
+    )
+
+
+# Postgres types by their asyncpg name, for the Arrow schema. Anything else (text, uuid, json, enums, ...) is exported as
+# a string.
+_ARROW_TYPES = {
+    "bool": "bool_", "int2": "int16", "int4": "int32", "int8": "int64", "float4": "float32", "float8": "float64",
+    "numeric": "float64", "date": "date32", "bytea": "binary",
+}
+
+
+def _arrow_type(type_name: str) -> "pa.DataType":
+    import pyarrow as pa
+
+    if type_name.startswith("_"):
+        return pa.list_(_arrow_type(type_name[1:]))
+    if type_name in ("timestamp", "timestamptz"):
+        return pa.timestamp("us", tz="UTC" if type_name == "timestamptz" else None)
+    return getattr(pa, _ARROW_TYPES[type_name])() if type_name in _ARROW_TYPES else pa.string()
+
+
+# Types asyncpg already returns as str.
+_STRING_TYPES = {"text", "varchar", "bpchar", "name", "json", "jsonb"}
+
+
+def _converter(type_name: str) -> Optional[Callable]:
+    """How to convert the values asyncpg returns for a column of `type_name`, or None if pyarrow takes them as they are."""
+    if type_name.startswith("_"):
+        convert = _converter(type_name[1:])
+        return (lambda value: None if value is None else [convert(v) for v in value]) if convert else None
+    if type_name == "numeric":
+        return lambda value: None if value is None else float(value)
+    if type_name in _ARROW_TYPES or type_name in _STRING_TYPES or type_name.startswith("timestamp"):
+        return None
+    # uuid, enums and everything else exported as a string.
+    return lambda value: value if value is None or isinstance(value, str) else str(value)
+
+
+def _record_batch(
+    rows: List,
+    schema: "pa.Schema",
+    indexes: List[int],
+    converters: List[Optional[Callable]],
+) -> "pa.RecordBatch":
+    import pyarrow as pa
+
+    columns = []
+    for i, field, convert in zip(indexes, schema, converters):
+        values = [row[i] for row in rows]
+        columns.append(pa.array(values if convert is None else [convert(v) for v in values], type=field.type))
+    return pa.record_batch(columns, schema=schema)
+
+
+async def export_partition(
+    pool: "asyncpg.Pool",
+    work_package_id: str,
+    partition: Partition,
+    path: str,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> int:
+    """Stream one partition from the results database into a Parquet file at `path`, returning the number of rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    async with pool.acquire() as connection:
+        table = ".".join(f'"{part}"' for part in partition.table.split("."))
+        statement = await connection.prepare(
+            f"SELECT * FROM {table} WHERE work_package_id = $1 AND feeder = $2 AND year = $3 AND scenario = $4"
+        )
+        # The partition columns are left out of the file, as they're already in its path.
+        indexes, attributes = zip(*((i, a) for i, a in enumerate(statement.get_attributes())
+                                    if a.name not in PARTITION_COLUMNS))
+        schema = pa.schema([(a.name, _arrow_type(a.type.name)) for a in attributes])
+        converters = [_converter(a.type.name) for a in attributes]
+        # An empty partition still gets a file (with no row groups), so it isn't queried again on a rerun.
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            # Server-side cursors only live inside a transaction.
+            async with connection.transaction(readonly=True):
+                cursor = await statement.cursor(work_package_id, partition.feeder, partition.year, partition.scenario)
+                while page := await cursor.fetch(page_size):
+                    # Compressing and writing the page off the event loop lets the other partitions keep fetching.
+                    await asyncio.to_thread(writer.write_batch, _record_batch(page, schema, indexes, converters))
+                    rows += len(page)
+    os.replace(tmp_path, path)
+    return rows
+
+
+async def _missing_tables(pool: "asyncpg.Pool", tables: Dict[str, ResultTable]) -> List[str]:
+    async with pool.acquire() as connection:
+        return [name for name, table in tables.items()
+                if await connection.fetchval("SELECT to_regclass($1)", table.table) is None]
+
+
+async def export_results(
+    database_config: Dict,
+    work_package: Dict,
+    output_dir: str,
+    tables: Dict[str, ResultTable],
+    page_size: int = DEFAULT_PAGE_SIZE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> List[Dict]:
+    """
+    Export every partition of `tables` for `work_package` to `output_dir`, skipping partitions already exported and
+    tables that aren't in the database. Returns the rows, path and status of each partition.
+    """
+    import asyncpg
+
+    pool = await asyncpg.create_pool(
+        host=database_config["host"],
+        port=database_config.get("port", 5432),
+        database=database_config["database"],
+        user=database_config["user"],
+        password=database_config.get("password"),
+        ssl=database_config.get("ssl"),
+        min_size=1,
+        max_size=max_in_flight,
+    )
+    try:
+        for name in await _missing_tables(pool, tables):
+            logger.warning(f"Skipping {name}: table {tables[name].table} isn't in the results database")
+            tables = {n: t for n, t in tables.items() if n != name}
+
+        async def export(partition: Partition) -> Dict:
+            path = partition_path(output_dir, partition)
+            entry = {**partition._asdict(), "path": path, "rows": None, "error": None}
+            if os.path.exists(path):
+                entry["status"] = "SKIPPED"
+                return entry
+            start = time.perf_counter()
+            try:
+                entry["rows"] = await export_partition(pool, work_package["id"], partition, path, page_size)
+                entry["status"] = "EXPORTED"
+                logger.info(f"{partition.name} {partition.feeder}/{partition.year}/{partition.scenario}: "
+                            f"{entry['rows']} rows in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                entry["status"], entry["error"] = "FAILED", str(e)
+                if os.path.exists(f"{path}.tmp"):
+                    os.remove(f"{path}.tmp")
+                logger.error(f"Failed to export {partition.name} {partition.feeder}/{partition.year}/{partition.scenario}: {e}")
+            return entry
+
+        # The pool holds at most max_in_flight connections, so at most that many partitions are read at once.
+        return await asyncio.gather(*(export(p) for p in plan_partitions(work_package, tables)))
+    finally:
+        await pool.close()
+
+
+def exported_bytes(entries: List[Dict]) -> int:
+    """The total size of the Parquet files of the exported and already exported partitions in `entries`."""
+    return sum(os.path.getsize(entry["path"]) for entry in entries
+               if entry["status"] != "FAILED" and os.path.exists(entry["path"]))
+
+
+def print_export_summary(entries: List[Dict]):
+    by_table: Dict[str, Dict[str, int]] = {}
+    for entry in entries:
+        summary = by_table.setdefault(entry["name"], {"EXPORTED": 0, "SKIPPED": 0, "FAILED": 0, "rows": 0})
+        summary[entry["status"]] += 1
+        summary["rows"] += entry["rows"] or 0
+    for name, summary in by_table.items():
+        print(f'{name}: {summary["EXPORTED"]} partitions exported ({summary["rows"]} rows), '
+              f'{summary["SKIPPED"]} already exported, {summary["FAILED"]} failed')
@@ -5,29 +5,77 @@ from datetime import datetime
 from zepben.eas import HcFeederScenarioAllocationStrategy, HcGeneratorConfigInput, \
     HcModelConfigInput, Mutation
 
-from utils import get_client, get_config_dir, fetch_feeders, print_run
+from clients import ClientManager
+from feeder_sizes import load_feeder_sizes
+from hierarchy_cache import load_feeder_records
+from tap_settings import feeders_needing_calibration
+from utils import get_client, get_config, get_config_dir, print_run
 
 """
 Perform a calibration run which will utilise PQV data to model the network, and output voltage deltas between the PQV actuals and the
 simulated network. Find more information on calibration at:
     https://zepben.github.io/evolve/docs/hosting-capacity-service/docs/next/how-to-guides/calibration#how-to-run
 
-Use the returned result with monitor_calibration_run.py to monitor
+Use the returned run ID with monitor_calibration_run.py --id=<run ID> to monitor
 """
 
 
+def build_generator_config() -> HcGeneratorConfigInput:
+    return HcGeneratorConfigInput(
+        # A customized GeneratorConfig can be passed to the calibration run.
+        model=HcModelConfigInput(
+            loadVMaxPu=1.2,
+            loadVMinPu=0.8,
+            pFactorBaseExports=-1,
+            pFactorBaseImports=1,
+            pFactorForecastPv=1,
+            fixSinglePhaseLoads=False,
+            maxSinglePhaseLoad=15000.0,
+            maxLoadServiceLineRatio=1.0,
+            maxLoadLvLineRatio=2.0,
+            maxLoadTxRatio=2.0,
+            maxGenTxRatio=4.0,
+            fixOverloadingConsumers=True,
+            fixUndersizedServiceLines=True,
+            feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
+            closedLoopVRegEnabled=False,
+            closedLoopVRegSetPoint=0.9925,
+            seed=123,
+        )
+    )
+
+
 async def main(argv):
     config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
     eas_client = get_client(config_dir)
     feeder_mrids = ["<FEEDER_MRID>"]
 
     # To do a calibration run with all feeders, populate ewb_server in your auth_config.json file and uncomment the below.
     # This will use the SDK to fetch the network hierarchy and retrieve all the feeder mRIDs.
+    # The hierarchy is cached in the config directory and only refetched from EWB once the cache is older than
+    # ttl_seconds (default one day) - pass force_refresh=True to refetch it regardless.
     # Note running all feeders will take significantly longer and has cost implications so should be performed with care.
     
-    # feeders = await fetch_feeders(config_dir)
+    # feeders = await load_feeder_records(config_dir)
     # feeder_mrids = [f.mrid for f in feeders[:10]]   # Take only first 10 feeders to avoid running too many.
 
+    # The first 10 feeders may happen to include some very large ones. To pick the 10 smallest feeders by size (see
+    # feeder_sizes.py) instead, uncomment the below as well.
+    # async with ClientManager(config_dir) as clients:
+    #     sizes = await load_feeder_sizes(clients, [f.mrid for f in feeders])
+    # feeder_mrids = sorted(sizes, key=lambda mrid: sizes[mrid].weight)[:10]
+
+    # Feeders whose transformer tap settings are already in the local tap settings store (exported with
+    # get_calibration_transformer_settings.py) aren't calibrated again, as the submitters reuse their settings. Set
+    # reuse_tap_settings to false in config.json to calibrate every feeder regardless, or tap_settings_max_age_days to
+    # recalibrate feeders whose settings are older than that.
+    feeder_mrids = feeders_needing_calibration(config_dir, config, feeder_mrids)
+    if not feeder_mrids:
+        print("Every feeder already has cached tap settings, nothing to calibrate")
+        await eas_client.close()
+        return
+
     # When providing a HcGeneratorConfigInput the following fields will be ignored or overridden during a calibration run:
     #   .model.calibration
     #   .model.meter_placement_config
@@ -44,28 +92,7 @@ async def main(argv):
                 calibration_time_local=datetime(2025, month=7, day=12, hour=4, minute=0),
                 # The time of the PQV data to model. Note this time must be present in EWBs load database.
                 feeders=feeder_mrids,  # The feeders to model
-                generator_config=HcGeneratorConfigInput(
-                    # A customized GeneratorConfig can be passed to the calibration run.
-                    model=HcModelConfigInput(
-                        loadVMaxPu=1.2,
-                        loadVMinPu=0.8,
-                        pFactorBaseExports=-1,
-                        pFactorBaseImports=1,
-                        pFactorForecastPv=1,
-                        fixSinglePhaseLoads=False,
-                        maxSinglePhaseLoad=15000.0,
-                        maxLoadServiceLineRatio=1.0,
-                        maxLoadLvLineRatio=2.0,
-                        maxLoadTxRatio=2.0,
-                        maxGenTxRatio=4.0,
-                        fixOverloadingConsumers=True,
-                        fixUndersizedServiceLines=True,
-                        feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
-                        closedLoopVRegEnabled=False,
-                        closedLoopVRegSetPoint=0.9925,
-                        seed=123,
-                    )
-                )
+                generator_config=build_generator_config(),
             )
         )
         print_run(result)
@@ -0,0 +1,51 @@
+"""
+Run a calibration for each of several time periods, e.g. to evaluate a set of tap positions across many periods.
+
+Configure the periods in config.json with either a list of local times:
+
+    "calibration_times": ["2025-07-12T04:00:00", "2025-07-13T04:00:00"]
+
+or a range, where end is inclusive:
+
+    "calibration_time_range": {"start": "2025-07-01T04:00:00", "end": "2025-07-31T04:00:00", "step_hours": 24}
+
+Each period is run as its own calibration named <calibration_name>-<time> for the configured feeders, with at most
+max_active_calibrations (default 4) running at once. Every run is tracked until it finishes, then a status table for all
+periods is printed.
+
+Each period is journalled before and after it is submitted. If the sweep is interrupted, run this script again with
+--resume: periods that were already submitted are tracked under their existing runs and only the rest are submitted.
+"""
+
+import asyncio
+import sys
+
+from calibration_sweep import calibration_times, run_calibration_sweep, print_sweep_table
+from journal import Journal, journal_path
+from run_calibration import build_generator_config
+from utils import get_client, get_config, get_config_dir, has_flag
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    eas_client = get_client(config_dir)
+    calibration_name = config.get("calibration_name", config["work_package_name"])
+
+    with Journal(journal_path(config_dir, calibration_name, "calibration_sweep"), key="period", resume=has_flag(argv, "--resume")) as journal:
+        periods = await run_calibration_sweep(
+            eas_client,
+            calibration_name=calibration_name,
+            times=calibration_times(config),
+            feeders=config["feeders"],
+            generator_config=build_generator_config(),
+            max_active=config.get("max_active_calibrations", 4),
+            journal=journal,
+        )
+    print_sweep_table(periods)
+
+    await eas_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
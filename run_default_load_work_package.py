@@ -8,9 +8,12 @@ import asyncio
 import sys
 from datetime import datetime
 
-from zepben.eas import Mutation, WorkPackageInput, ForecastConfigInput, TimePeriodInput, HcGeneratorConfigInput, \
+from zepben.eas import WorkPackageInput, ForecastConfigInput, TimePeriodInput, HcGeneratorConfigInput, \
     HcModelConfigInput, HcFeederScenarioAllocationStrategy, HcSolveConfigInput
 
+from profiles import resolve_profile
+from ledger import open_ledger, submit_work_package
+from tap_settings import plan_tap_settings_groups
 from utils import get_client, get_config, print_run, get_config_dir
 
 
@@ -18,6 +21,7 @@ async def main(argv):
     config_dir = get_config_dir(argv)
     config = get_config(config_dir)
     eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
 
     # Forecast Config example set up
     # This example is an extension of running a forecast work package. Default load profiles can also be applied to
@@ -32,59 +36,73 @@ async def main(argv):
         )
     )
 
-    # These profiles can be set up in configuration, or be hard coded as a list of values.
-    # The number of entries must match the expected number for the configured load_interval_length_hours (default 0.5).
-    # For load_interval_length_hours:
+    # These profiles can be set up in configuration as a list of values, or as a path (relative to the config directory)
+    # to a CSV or .npy file, or be hard coded as a list of values.
+    # HCM expects the number of entries to match the configured load_interval_length_hours (default 0.5):
     #     0.25: 96 entries for daily and 35040 for yearly
     #     0.5:  48 entries for daily and 17520 for yearly
     #     1.0:  24 entries for daily and 8760 for yearly
-    default_load_watts_profile = config["default_load_watts"]
-    default_gen_watts_profile = config["default_gen_watts"]
-    default_load_var_profile = config["default_load_var"]
-    default_gen_var_profile = config["default_gen_var"]
+    # Any of these lengths may be supplied - resolve_profile resamples the profile to load_interval_length_hours, and
+    # expands daily profiles to yearly ones if default_profiles_yearly is set in config.
+    # Compiled profiles are cached in the config directory so large yearly profiles are only parsed once.
+    load_interval_length_hours = 1.0
+    yearly = config.get("default_profiles_yearly", False)
+    default_load_watts_profile = resolve_profile(config_dir, config["default_load_watts"], load_interval_length_hours, yearly)
+    default_gen_watts_profile = resolve_profile(config_dir, config["default_gen_watts"], load_interval_length_hours, yearly)
+    default_load_var_profile = resolve_profile(config_dir, config["default_load_var"], load_interval_length_hours, yearly)
+    default_gen_var_profile = resolve_profile(config_dir, config["default_gen_var"], load_interval_length_hours, yearly)
 
-    try:
-        result = await eas_client.mutation(Mutation.run_work_package(
-            WorkPackageInput(
-                forecastConfig=forecast_config,
-                generatorConfig=HcGeneratorConfigInput(
-                    model=HcModelConfigInput(
-                        loadVMaxPu=1.2,
-                        loadVMinPu=0.8,
-                        # Override reactive power for base loads/generators using power factor instead of load profile VAr values.
-                        # Set to null to use reactive power from load profiles instead.
-                        pFactorBaseExports=-1,
-                        pFactorBaseImports=1,
-                        pFactorForecastPv=1,
-                        # fixSinglePhaseLoads defaults to true - set False here to disable the single-phase load fixer.
-                        fixSinglePhaseLoads=False,
-                        maxSinglePhaseLoad=15000.0,
-                        maxLoadServiceLineRatio=1.5,
-                        maxLoadLvLineRatio=2.0,
-                        maxLoadTxRatio=3.0,
-                        maxGenTxRatio=10.0,
-                        fixOverloadingConsumers=True,
-                        fixUndersizedServiceLines=True,
-                        feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
-                        # closedLoopVRegEnabled defaults to true. Set False to model regulators as-is from the network model.
-                        closedLoopVRegEnabled=False,
-                        seed=123,
-                        loadIntervalLengthHours=1.0,
-                        defaultLoadWatts=default_load_watts_profile,
-                        defaultGenWatts=default_gen_watts_profile,
-                        defaultLoadVar=default_load_var_profile,
-                        defaultGenVar=default_gen_var_profile,
-                    ),
-                    solve=HcSolveConfigInput(stepSizeMinutes=30),
-                )
-            ),
-            work_package_name=config["work_package_name"],
-        ))
-        print_run(result)
-    except Exception as e:
-        print(e)
+    # Feeders take their transformer tap settings from the latest calibration set exported for them with
+    # get_calibration_transformer_settings.py, with a work package per calibration set (see tap_settings.py). Set
+    # reuse_tap_settings to false in config.json to disable this.
+    for work_package_name, tap_settings, feeders in plan_tap_settings_groups(config_dir, config):
+        try:
+            result = await submit_work_package(
+                eas_client,
+                WorkPackageInput(
+                    forecastConfig=forecast_config.model_copy(update={"feeders": feeders}),
+                    generatorConfig=HcGeneratorConfigInput(
+                        model=HcModelConfigInput(
+                            loadVMaxPu=1.2,
+                            loadVMinPu=0.8,
+                            # Override reactive power for base loads/generators using power factor instead of load profile VAr values.
+                            # Set to null to use reactive power from load profiles instead.
+                            pFactorBaseExports=-1,
+                            pFactorBaseImports=1,
+                            pFactorForecastPv=1,
+                            # fixSinglePhaseLoads defaults to true - set False here to disable the single-phase load fixer.
+                            fixSinglePhaseLoads=False,
+                            maxSinglePhaseLoad=15000.0,
+                            maxLoadServiceLineRatio=1.5,
+                            maxLoadLvLineRatio=2.0,
+                            maxLoadTxRatio=3.0,
+                            maxGenTxRatio=10.0,
+                            fixOverloadingConsumers=True,
+                            fixUndersizedServiceLines=True,
+                            feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
+                            # closedLoopVRegEnabled defaults to true. Set False to model regulators as-is from the network model.
+                            closedLoopVRegEnabled=False,
+                            seed=123,
+                            transformerTapSettings=tap_settings,
+                            loadIntervalLengthHours=load_interval_length_hours,
+                            defaultLoadWatts=default_load_watts_profile,
+                            defaultGenWatts=default_gen_watts_profile,
+                            defaultLoadVar=default_load_var_profile,
+                            defaultGenVar=default_gen_var_profile,
+                        ),
+                        solve=HcSolveConfigInput(stepSizeMinutes=30),
+                    )
+                ),
+                work_package_name,
+                ledger=ledger,
+            )
+            print_run(result)
+        except Exception as e:
+            print(e)
 
     await eas_client.close()
+    if ledger is not None:
+        ledger.close()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
 import asyncio
+import os
 import sys
 from datetime import datetime
 
-from zepben.eas import Mutation, WorkPackageInput, HcGeneratorConfigInput, HcModelConfigInput, \
+from zepben.eas import WorkPackageInput, HcGeneratorConfigInput, HcModelConfigInput, \
     HcFeederScenarioAllocationStrategy, HcResultProcessorConfigInput, HcWriterConfigInput, HcWriterOutputConfigInput, \
     HcEnhancedMetricsConfigInput, HcStoredResultsConfigInput, HcMetricsResultsConfigInput, FeederConfigsInput, \
     FeederConfigInput, FixedTimeInput, FixedTimeLoadOverrideInput
 
+from clients import ClientManager
+from ledger import open_ledger, submit_work_package
+from load_id_index import LoadIdIndex, check_load_ids, feeder_config_load_ids, store_path
+from overrides import DEFAULT_MAX_VALUES_PER_WORK_PACKAGE, iter_feeder_config_batches, override_load_ids, \
+    validate_override_file
 from utils import get_client, get_config, print_run, get_config_dir
 
 """
@@ -17,11 +23,111 @@ Please contact Zepben to ensure you are creating an efficient and scalable solut
 """
 
 
-async def main(argv):
-    config_dir = get_config_dir(argv)
-    config = get_config(config_dir)
-    eas_client = get_client(config_dir)
+def build_work_package(feeder_configs: FeederConfigsInput) -> WorkPackageInput:
+    return WorkPackageInput(
+        feederConfigs=feeder_configs,
+        generatorConfig=HcGeneratorConfigInput(
+            model=HcModelConfigInput(
+                loadVMaxPu=1.2,
+                loadVMinPu=0.8,
+                pFactorBaseExports=-1,
+                pFactorBaseImports=1,
+                pFactorForecastPv=1,
+                fixSinglePhaseLoads=False,
+                maxSinglePhaseLoad=15000.0,
+                maxLoadServiceLineRatio=1.0,
+                maxLoadLvLineRatio=2.0,
+                maxLoadTxRatio=2.0,
+                maxGenTxRatio=4.0,
+                fixOverloadingConsumers=True,
+                fixUndersizedServiceLines=True,
+                feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
+                closedLoopVRegEnabled=False,
+                closedLoopVRegSetPoint=0.9925,
+                seed=123,
+            )
+        ),
+        resultProcessorConfig=HcResultProcessorConfigInput(
+            writerConfig=HcWriterConfigInput(
+
+                outputWriterConfig=HcWriterOutputConfigInput(
+                    enhancedMetricsConfig=HcEnhancedMetricsConfigInput(
+                        populateEnhancedMetrics=True,
+                        populateEnhancedMetricsProfile=True,
+                        calculateEmergForLoadThermal=True,
+                        calculateNormalForLoadThermal=True,
+                        calculateCO2=True,
+                        populateConstraints=False,
+                        populateWeeklyReports=False,
+                        populateDurationCurves=False,
+                        calculateEmergForGenThermal=True,
+                        calculateNormalForGenThermal=True,
+                    ))),
+            storedResults=HcStoredResultsConfigInput(
+                voltageExceptionsRaw=False,
+                overloadsRaw=False,
+                energyMetersRaw=False,
+                energyMeterVoltagesRaw=False
+            ),
+            metrics=HcMetricsResultsConfigInput(calculatePerformanceMetrics=True)
+        ),
+        qualityAssuranceProcessing=False
+    )
+
+
+async def check_against_network(config_dir, config, load_ids) -> bool:
+    # EAS ignores overrides for load IDs that aren't in the feeder, so check every feeder and load ID against the network
+    # model in EWB first. Set validate_load_ids to false in config.json to skip this. See load_id_index.py.
+    if not config.get("validate_load_ids", True):
+        return True
+
+    async with ClientManager(config_dir) as clients:
+        with LoadIdIndex(store_path(config_dir)) as index:
+            report = await check_load_ids(
+                clients,
+                index,
+                load_ids,
+                max_in_flight=config.get("max_in_flight_feeder_fetches", 4),
+            )
+    if not report.ok:
+        print(f"Not submitting, the overrides don't match the network:\n{report.describe()}")
+    return report.ok
+
+
+async def run_overrides_file(eas_client, config_dir, config, ledger=None):
+    # Overrides for large studies can be loaded from a CSV or Parquet file by setting overrides_file in config.json (relative
+    # to the config directory). See overrides.py for the file format. The file is streamed one feeder at a time and split
+    # into work packages of at most max_override_values_per_work_package override values each.
+    path = os.path.join(config_dir, config["overrides_file"])
+    max_values = config.get("max_override_values_per_work_package", DEFAULT_MAX_VALUES_PER_WORK_PACKAGE)
 
+    # Validate the whole file first so a bad row doesn't leave a study half submitted.
+    counts = validate_override_file(path, max_values)
+    print(f'Overriding {counts["loads"]} loads on {counts["feeders"]} feeders ({counts["feeder_parts"]} feeder parts)')
+    if not await check_against_network(config_dir, config, override_load_ids(path)):
+        return
+
+    batches = iter_feeder_config_batches(
+        path,
+        years=config["forecast_years"],
+        scenarios=config["scenarios"],
+        load_time=datetime.fromisoformat(config["load_time"]["start1"]),
+        max_values=max_values,
+    )
+    for i, feeder_configs in enumerate(batches):
+        try:
+            result = await submit_work_package(
+                eas_client,
+                build_work_package(FeederConfigsInput(configs=feeder_configs)),
+                f'{config["work_package_name"]}-part-{i:04d}',
+                ledger=ledger,
+            )
+            print_run(result)
+        except Exception as e:
+            print(e)
+
+
+async def run_example(eas_client, config_dir, config, ledger=None):
     # Feeder Configs example set up
     # More entries can be added into the configs list based on the config supplied (or hard coded)
     feeder_configs = FeederConfigsInput(
@@ -39,7 +145,8 @@ async def main(argv):
                 fixedTime=FixedTimeInput(
                     loadTime=datetime.fromisoformat(config["load_time"]["start1"]),
                     # Override two loads load profiles.
-                    # Note if these load ids don't exist in the feeder, this will have no effect so ensure this is mapped correctly.
+                    # Note if these load ids don't exist in the feeder, this will have no effect, so they are checked against the network
+                    # model before submitting (see check_against_network).
                     overrides=
                     [
                         FixedTimeLoadOverrideInput(
@@ -85,65 +192,36 @@ async def main(argv):
         ]
     )
 
+    if not await check_against_network(config_dir, config, feeder_config_load_ids(feeder_configs.configs)):
+        return
+
     try:
-        result = await eas_client.mutation(Mutation.run_work_package(
-            WorkPackageInput(
-                feederConfigs=feeder_configs,
-                generatorConfig=HcGeneratorConfigInput(
-                    model=HcModelConfigInput(
-                        loadVMaxPu=1.2,
-                        loadVMinPu=0.8,
-                        pFactorBaseExports=-1,
-                        pFactorBaseImports=1,
-                        pFactorForecastPv=1,
-                        fixSinglePhaseLoads=False,
-                        maxSinglePhaseLoad=15000.0,
-                        maxLoadServiceLineRatio=1.0,
-                        maxLoadLvLineRatio=2.0,
-                        maxLoadTxRatio=2.0,
-                        maxGenTxRatio=4.0,
-                        fixOverloadingConsumers=True,
-                        fixUndersizedServiceLines=True,
-                        feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
-                        closedLoopVRegEnabled=False,
-                        closedLoopVRegSetPoint=0.9925,
-                        seed=123,
-                    )
-                ),
-                resultProcessorConfig=HcResultProcessorConfigInput(
-                    writerConfig=HcWriterConfigInput(
-
-                        outputWriterConfig=HcWriterOutputConfigInput(
-                            enhancedMetricsConfig=HcEnhancedMetricsConfigInput(
-                                populateEnhancedMetrics=True,
-                                populateEnhancedMetricsProfile=True,
-                                calculateEmergForLoadThermal=True,
-                                calculateNormalForLoadThermal=True,
-                                calculateCO2=True,
-                                populateConstraints=False,
-                                populateWeeklyReports=False,
-                                populateDurationCurves=False,
-                                calculateEmergForGenThermal=True,
-                                calculateNormalForGenThermal=True,
-                            ))),
-                    storedResults=HcStoredResultsConfigInput(
-                        voltageExceptionsRaw=False,
-                        overloadsRaw=False,
-                        energyMetersRaw=False,
-                        energyMeterVoltagesRaw=False
-                    ),
-                    metrics=HcMetricsResultsConfigInput(calculatePerformanceMetrics=True)
-                ),
-                qualityAssuranceProcessing=False
-            ),
-            work_package_name=config["work_package_name"],
-        ))
+        result = await submit_work_package(
+            eas_client,
+            build_work_package(feeder_configs),
+            config["work_package_name"],
+            ledger=ledger,
+        )
 
         print_run(result)
     except Exception as e:
         print(e)
 
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
+
+    if config.get("overrides_file"):
+        await run_overrides_file(eas_client, config_dir, config, ledger)
+    else:
+        await run_example(eas_client, config_dir, config, ledger)
+
     await eas_client.close()
+    if ledger is not None:
+        ledger.close()
 
 
 if __name__ == "__main__":
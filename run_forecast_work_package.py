@@ -7,99 +7,231 @@ configurable set of feeders.
 import asyncio
 import sys
 from datetime import datetime
+from typing import Optional
 
-from zepben.eas import ForecastConfigInput, TimePeriodInput, Mutation, WorkPackageInput, HcGeneratorConfigInput, \
+from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput, HcGeneratorConfigInput, \
     HcModelConfigInput, HcFeederScenarioAllocationStrategy, HcSolveConfigInput, \
     HcResultProcessorConfigInput, HcWriterConfigInput, HcWriterOutputConfigInput, HcEnhancedMetricsConfigInput, \
     HcStoredResultsConfigInput, HcMetricsResultsConfigInput
 
-from utils import get_client, get_config, print_run, get_config_dir
+from ledger import open_ledger, submit_work_package
+from clients import ClientManager
+from cost_estimate import estimate_plan, over_budget, print_estimates, record_submissions
+from feeder_sizes import load_feeder_sizes
+from journal import Journal, journal_path
+from network_fingerprints import FingerprintStore, changed_combinations, hash_config, load_fingerprints, \
+    record_submitted_shards, refresh_statuses, store_path
+from sharding import plan_shards, plan_balanced_shards, plan_combination_shards, submit_journalled_shards, \
+    shard_work_package_name, manifest_path, write_manifest, print_manifest
+from tap_settings import latest_tap_settings, split_shards_by_tap_settings
+from utils import get_config, print_run, get_config_dir, has_flag, logger
 
 
-async def main(argv):
-    config_dir = get_config_dir(argv)
-    config = get_config(config_dir)
-    eas_client = get_client(config_dir)
-
+def build_work_package(config, feeders, years, scenarios, tap_settings=None) -> WorkPackageInput:
     # Forecast Config example set up
     # This can be set up through the config file or by hard coding in the variables below.
     # The below will run a forecast-based work package for the configured feeders, years, and scenarios, over the time period specified in load_time below.
     # Note load_time reflects the base year (historical) load, and must be correctly specified to be a period of load data that exists in your system.
     # Consult your EWB HCM administrator if you do not know what load is available in your environment.
     forecast_config = ForecastConfigInput(
-        feeders=config["feeders"],
-        years=config["forecast_years"],
-        scenarios=config["scenarios"],
+        feeders=feeders,
+        years=years,
+        scenarios=scenarios,
         timePeriod=TimePeriodInput(
             startTime=datetime.fromisoformat(config["load_time"]["start1"]),
             endTime=datetime.fromisoformat(config["load_time"]["end1"]),
         )
     )
 
-    try:
-        result = await eas_client.mutation(Mutation.run_work_package(
-            WorkPackageInput(
-                forecastConfig=forecast_config,
-                generatorConfig=HcGeneratorConfigInput(
-                    model=HcModelConfigInput(
-                        loadVMaxPu=1.2,
-                        loadVMinPu=0.8,
-                        # Override reactive power for base loads/generators using power factor instead of load profile VAr values.
-                        # Set to null to use reactive power from load profiles instead.
-                        pFactorBaseExports=-1,
-                        pFactorBaseImports=1,
-                        pFactorForecastPv=1,
-                        # fixSinglePhaseLoads defaults to true - set False here to disable the single-phase load fixer.
-                        fixSinglePhaseLoads=False,
-                        maxSinglePhaseLoad=15000.0,
-                        maxLoadServiceLineRatio=1.5,
-                        maxLoadLvLineRatio=2.0,
-                        maxLoadTxRatio=3.0,
-                        maxGenTxRatio=10.0,
-                        fixOverloadingConsumers=True,
-                        fixUndersizedServiceLines=True,
-                        feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
-                        # closedLoopVRegEnabled defaults to true. Set False to model regulators as-is from the network model.
-                        closedLoopVRegEnabled=False,
-                        seed=123,
-                    ),
-                    solve=HcSolveConfigInput(stepSizeMinutes=30),
-                ),
-
-                resultProcessorConfig=HcResultProcessorConfigInput(
-                    writerConfig=HcWriterConfigInput(
-                        outputWriterConfig=HcWriterOutputConfigInput(
-                            enhancedMetricsConfig=HcEnhancedMetricsConfigInput(
-                                populateEnhancedMetrics=True,
-                                populateEnhancedMetricsProfile=False,
-                                calculateEmergForLoadThermal=True,
-                                calculateNormalForLoadThermal=True,
-                                calculateCO2=True,
-                                populateConstraints=False,
-                                populateWeeklyReports=False,
-                                populateDurationCurves=False,
-                                calculateEmergForGenThermal=True,
-                                calculateNormalForGenThermal=True,
-                            ))),
-                    # Caution: storing raw results uses significant storage - avoid for large work packages.
-                    storedResults=HcStoredResultsConfigInput(
-                        voltageExceptionsRaw=False,
-                        overloadsRaw=False,
-                        energyMetersRaw=False,
-                        energyMeterVoltagesRaw=False
-                    ),
-                    # calculatePerformanceMetrics is deprecated - prefer populateEnhancedMetrics above.
-                    metrics=HcMetricsResultsConfigInput(calculatePerformanceMetrics=False)
-                ),
-                qualityAssuranceProcessing=False
+    return WorkPackageInput(
+        forecastConfig=forecast_config,
+        generatorConfig=HcGeneratorConfigInput(
+            model=HcModelConfigInput(
+                loadVMaxPu=1.2,
+                loadVMinPu=0.8,
+                # Override reactive power for base loads/generators using power factor instead of load profile VAr values.
+                # Set to null to use reactive power from load profiles instead.
+                pFactorBaseExports=-1,
+                pFactorBaseImports=1,
+                pFactorForecastPv=1,
+                # fixSinglePhaseLoads defaults to true - set False here to disable the single-phase load fixer.
+                fixSinglePhaseLoads=False,
+                maxSinglePhaseLoad=15000.0,
+                maxLoadServiceLineRatio=1.5,
+                maxLoadLvLineRatio=2.0,
+                maxLoadTxRatio=3.0,
+                maxGenTxRatio=10.0,
+                fixOverloadingConsumers=True,
+                fixUndersizedServiceLines=True,
+                feederScenarioAllocationStrategy=HcFeederScenarioAllocationStrategy.ADDITIVE,
+                # closedLoopVRegEnabled defaults to true. Set False to model regulators as-is from the network model.
+                closedLoopVRegEnabled=False,
+                seed=123,
+                # The calibration set to take transformer tap settings from, chosen per feeder by main (see
+                # tap_settings.py).
+                transformerTapSettings=tap_settings,
+            ),
+            solve=HcSolveConfigInput(stepSizeMinutes=30),
+        ),
+
+        resultProcessorConfig=HcResultProcessorConfigInput(
+            writerConfig=HcWriterConfigInput(
+                outputWriterConfig=HcWriterOutputConfigInput(
+                    enhancedMetricsConfig=HcEnhancedMetricsConfigInput(
+                        populateEnhancedMetrics=True,
+                        populateEnhancedMetricsProfile=False,
+                        calculateEmergForLoadThermal=True,
+                        calculateNormalForLoadThermal=True,
+                        calculateCO2=True,
+                        populateConstraints=False,
+                        populateWeeklyReports=False,
+                        populateDurationCurves=False,
+                        calculateEmergForGenThermal=True,
+                        calculateNormalForGenThermal=True,
+                    ))),
+            # Caution: storing raw results uses significant storage - avoid for large work packages.
+            storedResults=HcStoredResultsConfigInput(
+                voltageExceptionsRaw=False,
+                overloadsRaw=False,
+                energyMetersRaw=False,
+                energyMeterVoltagesRaw=False
             ),
-            work_package_name=config["work_package_name"],
-        ))
-        print_run(result)
-    except Exception as e:
-        print(e)
+            # calculatePerformanceMetrics is deprecated - prefer populateEnhancedMetrics above.
+            metrics=HcMetricsResultsConfigInput(calculatePerformanceMetrics=False)
+        ),
+        qualityAssuranceProcessing=False
+    )
+
+
+def build_shard_work_package(config, shard) -> WorkPackageInput:
+    return build_work_package(config, shard["feeders"], shard["years"], shard["scenarios"], shard.get("tap_settings"))
+
+
+async def plan_forecast_shards(config_dir, config, clients: Optional[ClientManager] = None):
+    # Setting balance_shards as well as shard_size packs feeders into shards by their size in EWB (energy consumer and
+    # conductor counts), so every shard takes about as long as the others rather than one giant feeder holding up the
+    # whole study. The sizes are fetched through `clients` if given, or through a ClientManager of its own otherwise.
+    if config.get("balance_shards"):
+        if clients is None:
+            async with ClientManager(config_dir) as clients:
+                return await plan_forecast_shards(config_dir, config, clients)
+        sizes = await load_feeder_sizes(clients, config["feeders"])
+        weights = {feeder: size.weight for feeder, size in sizes.items()}
+        return plan_balanced_shards(weights, config["forecast_years"], config["scenarios"], config["shard_size"])
+    return plan_shards(config["feeders"], config["forecast_years"], config["scenarios"], config["shard_size"])
+
 
-    await eas_client.close()
+async def plan_incremental_shards(config_dir, config, eas_client, clients):
+    """
+    Shards for only the feeder/year/scenario combinations whose network model or config changed since they last ran
+    successfully, along with the feeder fingerprints and config hashes to record them against once submitted.
+    """
+    # A feeder's calibration set is part of its config, so a feeder whose latest tap settings change is run again with
+    # them. The config is hashed once per calibration set rather than per feeder.
+    tap_settings = latest_tap_settings(config_dir, config, config["feeders"])
+    hashes = {calibration_set: hash_config(build_work_package(config, [], [], [], calibration_set))
+              for calibration_set in set(tap_settings.values())}
+    config_hashes = {feeder: hashes[calibration_set] for feeder, calibration_set in tap_settings.items()}
+    with FingerprintStore(store_path(config_dir)) as store:
+        fingerprints = await load_fingerprints(clients, store, config["feeders"])
+        await refresh_statuses(eas_client, store)
+        changed = changed_combinations(
+            store, fingerprints, config_hashes, config["feeders"], config["forecast_years"], config["scenarios"]
+        )
+
+    total = len(config["feeders"]) * len(config["forecast_years"]) * len(config["scenarios"])
+    logger.info(f"{len(changed)} of {total} feeder/year/scenario combinations changed since they last ran")
+    return plan_combination_shards(changed, config.get("shard_size")), fingerprints, config_hashes
+
+
+async def run_forecast(eas_client, clients, config_dir, config, ledger, argv):
+    # Setting shard_size in config.json splits the feeder x year x scenario matrix into separate work packages of at most
+    # shard_size combinations each, submitted concurrently with at most max_in_flight_submissions requests outstanding.
+    # The resulting shard -> work package ID manifest is saved alongside config.json and can be used with
+    # rerun_forecast_shard.py to resubmit a single failed shard.
+    # Each shard is journalled before and after it is submitted. If the batch is interrupted, run this script again with
+    # --resume to submit only the shards that were never acknowledged.
+    # Setting incremental to true in config.json fingerprints each feeder's network model in EWB and submits only the
+    # combinations whose fingerprint or config changed since they last completed, split into shards of shard_size if it
+    # is set. Fingerprints and run history are kept in network_fingerprints.sqlite alongside config.json.
+    incremental = config.get("incremental", False)
+    if incremental:
+        shards, fingerprints, config_hashes = await plan_incremental_shards(config_dir, config, eas_client, clients)
+        if not shards:
+            print("Nothing has changed since the last successful run")
+            return
+    else:
+        shards = await plan_forecast_shards(config_dir, config, clients) if config.get("shard_size") else None
+
+    # Each feeder takes its transformer tap settings from the latest calibration set exported for it with
+    # get_calibration_transformer_settings.py. A work package can only take one calibration set, so feeders with
+    # different sets are split into separate shards. Set reuse_tap_settings to false in config.json to disable this.
+    tap_settings = latest_tap_settings(config_dir, config, config["feeders"])
+    whole = {"shard": 0, "feeders": config["feeders"], "years": config["forecast_years"], "scenarios": config["scenarios"]}
+    if shards is None and len(set(tap_settings.values())) > 1:
+        shards = [whole]
+    if shards is not None:
+        shards = split_shards_by_tap_settings(shards, tap_settings)
+        # Built one at a time for the estimate and dropped, as submit_shards builds each again as it is submitted.
+        planned = ((shard_work_package_name(config["work_package_name"], shard), build_shard_work_package(config, shard))
+                   for shard in shards)
+    else:
+        whole["tap_settings"] = next(iter(tap_settings.values()), None)
+        planned = [(config["work_package_name"], build_shard_work_package(config, whole))]
+
+    # The solves, runtime and output volume of the plan are estimated from past runs before anything is submitted. If
+    # they exceed cost_budget in config.json (any of max_solves, max_runtime_hours and max_output_gb), nothing is
+    # submitted unless --over-budget is given. Pass --estimate-only to print the estimates without submitting anything.
+    estimates = await estimate_plan(eas_client, config_dir, planned)
+    print_estimates(estimates)
+    exceeded = over_budget(estimates, config.get("cost_budget", {}))
+    if exceeded:
+        print("The plan is over budget:\n" + "\n".join(exceeded))
+    if has_flag(argv, "--estimate-only") or (exceeded and not has_flag(argv, "--over-budget")):
+        return
+
+    if shards is not None:
+        with Journal(journal_path(config_dir, config["work_package_name"], "shards"), resume=has_flag(argv, "--resume")) as journal:
+            entries = await submit_journalled_shards(
+                eas_client,
+                journal,
+                shards,
+                lambda shard: build_shard_work_package(config, shard),
+                config["work_package_name"],
+                max_in_flight=config.get("max_in_flight_submissions", 4),
+                ledger=ledger,
+            )
+        write_manifest(manifest_path(config_dir, config["work_package_name"]), config["work_package_name"], entries)
+        print_manifest(entries)
+        if incremental:
+            with FingerprintStore(store_path(config_dir)) as store:
+                record_submitted_shards(store, entries, fingerprints, config_hashes)
+        submitted = {entry["work_package_name"]: entry["work_package_id"] for entry in entries}
+    else:
+        submitted = {}
+        try:
+            result = await submit_work_package(eas_client, planned[0][1], config["work_package_name"], ledger=ledger)
+            print_run(result)
+            if "data" in result:
+                submitted[config["work_package_name"]] = next(iter(result["data"].values()))
+        except Exception as e:
+            print(e)
+    record_submissions(config_dir, estimates, submitted)
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    # Work packages identical to ones already completed or running are not submitted again - their IDs are reused from
+    # the submission ledger saved alongside config.json. Set use_submission_ledger to false in config.json to disable this.
+    ledger = open_ledger(config_dir, config)
+    try:
+        # One set of connections to EAS and EWB for the whole run, shared by planning and submission.
+        async with ClientManager(config_dir) as clients:
+            await run_forecast(clients.eas_client, clients, config_dir, config, ledger, argv)
+    finally:
+        if ledger is not None:
+            ledger.close()
 
 
 if __name__ == "__main__":
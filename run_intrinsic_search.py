@@ -0,0 +1,95 @@
+"""
+Find intrinsic hosting capacity to a fine precision with a coarse-to-fine search (see intrinsic_search.py).
+
+The first run submits a coarse pass for the configured feeders and saves the search state alongside config.json. Once the
+pass has completed, export its headroom per feeder to a CSV (feeder, headroom_kw_per_customer) and run this script
+again with the path to that CSV (given as --headroom=<path>, or entered when prompted): it submits the next round of passes - fine passes around each feeder's bound and
+further coarse passes for feeders that hit the search ceiling. When every feeder has been refined to the fine step, the
+final headroom is written to <work_package_name>.intrinsic_headroom.csv.
+
+Step sizes and the number of steps per pass can be set in config.json with intrinsic_coarse_step_kw,
+intrinsic_fine_step_kw and intrinsic_max_steps.
+
+If submitting a round is interrupted, run this script again with --resume (and the same headroom CSV) to submit only the
+passes of that round that were never acknowledged.
+"""
+
+import asyncio
+import os
+import sys
+
+from zepben.eas import Mutation
+
+from intrinsic_search import new_search_state, plan_passes, apply_headroom, baseline_initial_state, read_headroom_csv, \
+    write_headroom_csv, state_path, read_state, write_state, total_steps
+from journal import Journal, journal_path
+from ledger import open_ledger
+from run_intrinsic_work_package import build_work_package, build_initial_state_selector, build_injection_resource, \
+    build_search
+from sharding import submit_journalled_shards, print_manifest
+from utils import get_client, get_config, get_config_dir, get_option, has_flag
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+
+    path = state_path(config_dir, config["work_package_name"])
+    if os.path.exists(path):
+        state = read_state(path)
+        headroom_path = get_option(argv, "--headroom") or input("Please enter path of the headroom CSV for the last round: ")
+        apply_headroom(state, read_headroom_csv(headroom_path))
+    else:
+        state = new_search_state(
+            config["feeders"],
+            coarse_step_kw=config.get("intrinsic_coarse_step_kw", 5.0),
+            fine_step_kw=config.get("intrinsic_fine_step_kw", 0.25),
+            max_steps=config.get("intrinsic_max_steps", 200),
+        )
+
+    passes = plan_passes(state)
+    if not passes:
+        write_state(path, state)
+        results_path = f"{config_dir}/{config['work_package_name']}.intrinsic_headroom.csv"
+        write_headroom_csv(results_path, state)
+        print(f"Search complete in {len(state['passes'])} rounds and at most {total_steps(state)} search steps, "
+              f"headroom written to {results_path}")
+        return
+
+    initial_state_selector = build_initial_state_selector(config)
+    injection_resource = build_injection_resource()
+
+    eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
+    round_name = f"{config['work_package_name']}-round-{state['round']}"
+    with Journal(journal_path(config_dir, round_name, "passes"), resume=has_flag(argv, "--resume")) as journal:
+        entries = await submit_journalled_shards(
+            eas_client,
+            journal,
+            passes,
+            lambda p: build_work_package(
+                p["feeders"],
+                scenario="base",
+                year=config["forecast_years"][0],
+                initial_state_selector=baseline_initial_state(initial_state_selector, p["baseline_kw"], injection_resource),
+                injection_resource=injection_resource,
+                search=build_search(p["step_kw"], p["max_steps"]),
+            ),
+            round_name,
+            max_in_flight=config.get("max_in_flight_submissions", 4),
+            mutation=Mutation.run_intrinsic_work_package,
+            suffix="pass",
+            ledger=ledger,
+        )
+    await eas_client.close()
+    if ledger is not None:
+        ledger.close()
+
+    state["passes"].append(entries)
+    state["round"] += 1
+    write_state(path, state)
+    print_manifest(entries)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
@@ -3,6 +3,24 @@ This script provides an example of how to run an Intrinsic Hosting Capacity work
 
 Intrinsic mode inverts the standard hosting capacity question: instead of testing a specific DER scenario,
 it finds how much additional load or generation the network can support before hitting a voltage or thermal limit.
+
+Set intrinsic_fanout in config.json to run every combination of scenario, year, initial state selector mode and
+injection method instead, each as its own work package (see intrinsic_fanout.py):
+
+    "intrinsic_fanout": {
+        "selector_modes": ["ZERO_LOAD", "PEAK_FEEDER_EXPORT", "PEAK_FEEDER_IMPORT"],
+        "injection_methods": ["EXPORT_GENERATION", "IMPORT_LOAD"]
+    }
+
+The FIXED_LOAD selector mode also needs the per-customer baseline, as fixed_load in intrinsic_fanout:
+
+    "fixed_load": {"per_customer_load_watts": 1500, "per_customer_gen_watts": 0}
+
+with optional per_customer_load_var and per_customer_gen_var. The scenarios and years default to those in config.json,
+and can be set with scenarios and years in intrinsic_fanout.
+Runs are submitted with at most max_in_flight_submissions (default 4) outstanding, and fan-outs of more than max_runs
+(default 500) runs are refused. Every run is indexed in <work_package_name>.intrinsic_index.csv, and an interrupted
+fan-out can be finished with --resume.
 """
 
 import asyncio
@@ -14,69 +32,185 @@ from zepben.eas import Mutation, IntrinsicWorkPackageInput, IntrinsicSyfConfigIn
     IntrinsicVoltageConstraintsInput, IntrinsicLvVoltageConstraintInput, \
     IntrinsicInjectionResourceConfigInput, IntrinsicInjectionResourceMethod, IntrinsicLoadModelType
 
-from utils import get_client, get_config, print_run, get_config_dir
+from intrinsic_fanout import DEFAULT_MAX_RUNS, check_fixed_load, index_path, plan_runs, print_fanout_summary, \
+    write_index
+from journal import Journal, journal_path
+from ledger import open_ledger, submit_work_package
+from sharding import manifest_path, submit_journalled_shards, write_manifest
+from utils import get_client, get_config, print_run, get_config_dir, has_flag
+
+# Selector modes that look for the worst moment in a window, from start_time to end_time.
+PEAK_SELECTOR_MODES = (
+    IntrinsicInitialStateSelectorMode.PEAK_FEEDER_EXPORT,
+    IntrinsicInitialStateSelectorMode.PEAK_FEEDER_IMPORT,
+)
+
+
+def build_initial_state_selector(config, selector_mode=IntrinsicInitialStateSelectorMode.ZERO_LOAD,
+                                 fixed_load=None) -> IntrinsicInitialLoadStateConfigInput:
+    # Initial state determines the baseline before generation is added.
+    # ZERO_LOAD: empty network - theoretical upper bound, no existing load or DER.
+    # FIXED_TIME: snapshot at a specific timestamp - requires start_time only.
+    # PEAK_FEEDER_EXPORT: worst-case solar moment in a window - most conservative for solar HC.
+    # PEAK_FEEDER_IMPORT: worst-case load moment - most conservative for EV/load growth.
+    # FIXED_LOAD: uniform per-customer baseline - useful for standardised cross-feeder comparisons. The baseline is
+    # taken from fixed_load (see intrinsic_fanout.FIXED_LOAD_FIELDS).
+    if selector_mode == IntrinsicInitialStateSelectorMode.FIXED_LOAD:
+        check_fixed_load(fixed_load)
+    return IntrinsicInitialLoadStateConfigInput(
+        selector_mode=selector_mode,
+        start_time=datetime.fromisoformat(config["load_time"]["start1"]),
+        end_time=datetime.fromisoformat(config["load_time"]["end1"]) if selector_mode in PEAK_SELECTOR_MODES else None,
+        **(fixed_load if selector_mode == IntrinsicInitialStateSelectorMode.FIXED_LOAD else {}),
+    )
+
+
+def build_injection_resource(method=IntrinsicInjectionResourceMethod.EXPORT_GENERATION) -> IntrinsicInjectionResourceConfigInput:
+    # EXPORT_GENERATION: find how much solar/generation the network can absorb.
+    # Change to IMPORT_LOAD to find import headroom (e.g. for EV charging or load growth).
+    return IntrinsicInjectionResourceConfigInput(
+        method=method,
+        load_model_type=IntrinsicLoadModelType.NEGATIVE_LOAD,
+        power_factor=0.95
+    )
+
+
+def build_search(step_kw_per_customer=1.0, max_steps=200) -> IntrinsicSearchConfigInput:
+    # step_kw_per_customer controls precision: smaller = finer results but more iterations.
+    # If headroom equals step_kw_per_customer * max_steps the search hit the limit without
+    # finding a constraint; increase max_steps or step size to find the true upper bound.
+    return IntrinsicSearchConfigInput(
+        step_kw_per_customer=step_kw_per_customer,
+        max_steps=max_steps,
+        lock_out_capacity_zone_on_violation=True,
+        stop_on_hv_violation=True
+    )
+
+
+def build_work_package(
+    feeders,
+    scenario,
+    year,
+    initial_state_selector: IntrinsicInitialLoadStateConfigInput,
+    injection_resource: IntrinsicInjectionResourceConfigInput,
+    search: IntrinsicSearchConfigInput,
+) -> IntrinsicWorkPackageInput:
+    return IntrinsicWorkPackageInput(
+        syf=IntrinsicSyfConfigInput(
+            feeders=feeders,
+            scenario=scenario,
+            year=year
+        ),
+        initial_state_selector=initial_state_selector,
+        # LV voltage limits in volts (phase-to-neutral).
+        # Values here are emergency limits (VH2=260, VL2=207) - use normal limits (VH1=253, VL1=216)
+        # for a more conservative assessment. Adjust to match your network standard.
+        # Add hv= block to IntrinsicVoltageConstraintsInput to also enforce HV voltage limits (in per unit).
+        # Add thermal= block to IntrinsicConstraintsConfigInput to enforce thermal limits.
+        constraints=IntrinsicConstraintsConfigInput(
+            voltage=IntrinsicVoltageConstraintsInput(
+                lv=IntrinsicLvVoltageConstraintInput(
+                    max=260,
+                    min=207
+                )
+            )
+        ),
+        injection_resource=injection_resource,
+        search=search
+    )
+
+
+def plan_fanout(config):
+    """
+    The runs of the intrinsic_fanout in config.json (see intrinsic_fanout.py), and a function that builds the work package
+    of a run.
+    """
+    fanout = config["intrinsic_fanout"]
+    runs = plan_runs(
+        config["feeders"],
+        scenarios=fanout.get("scenarios", config["scenarios"]),
+        years=fanout.get("years", config["forecast_years"]),
+        selector_modes=fanout.get("selector_modes", [IntrinsicInitialStateSelectorMode.ZERO_LOAD.name]),
+        injection_methods=fanout.get("injection_methods", [IntrinsicInjectionResourceMethod.EXPORT_GENERATION.name]),
+        max_runs=fanout.get("max_runs", DEFAULT_MAX_RUNS),
+        fixed_load=fanout.get("fixed_load"),
+    )
+
+    # Built once per mode and method and shared by every run that uses them.
+    selectors = {mode: build_initial_state_selector(config, IntrinsicInitialStateSelectorMode[mode], fanout.get("fixed_load"))
+                 for mode in {run["selector_mode"] for run in runs}}
+    injection_resources = {method: build_injection_resource(IntrinsicInjectionResourceMethod[method])
+                           for method in {run["injection_method"] for run in runs}}
+    search = build_search()
+
+    def build(run) -> IntrinsicWorkPackageInput:
+        return build_work_package(
+            run["feeders"],
+            scenario=run["scenario"],
+            year=run["year"],
+            initial_state_selector=selectors[run["selector_mode"]],
+            injection_resource=injection_resources[run["injection_method"]],
+            search=search,
+        )
+
+    return runs, build
+
+
+async def run_fanout(eas_client, config_dir, config, ledger=None, resume=False):
+    runs, build = plan_fanout(config)
+    name = config["work_package_name"]
+    with Journal(journal_path(config_dir, name, "intrinsic"), resume=resume) as journal:
+        entries = await submit_journalled_shards(
+            eas_client,
+            journal,
+            runs,
+            build,
+            name,
+            max_in_flight=config.get("max_in_flight_submissions", 4),
+            mutation=Mutation.run_intrinsic_work_package,
+            suffix="intrinsic",
+            ledger=ledger,
+        )
+    write_manifest(manifest_path(config_dir, f"{name}-intrinsic"), name, entries)
+    write_index(index_path(config_dir, name), entries)
+    print_fanout_summary(entries)
 
 
 async def main(argv):
     config_dir = get_config_dir(argv)
     config = get_config(config_dir)
     eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
+
+    if config.get("intrinsic_fanout"):
+        await run_fanout(eas_client, config_dir, config, ledger, resume=has_flag(argv, "--resume"))
+        await eas_client.close()
+        if ledger is not None:
+            ledger.close()
+        return
 
     try:
-        result = await eas_client.mutation(Mutation.run_intrinsic_work_package(
-            IntrinsicWorkPackageInput(
-                syf=IntrinsicSyfConfigInput(
-                    feeders=config["feeders"],
-                    scenario="base",
-                    year=config["forecast_years"][0]
-                ),
-                # Initial state determines the baseline before generation is added.
-                # ZERO_LOAD: empty network - theoretical upper bound, no existing load or DER.
-                # FIXED_TIME: snapshot at a specific timestamp - requires start_time only.
-                # PEAK_FEEDER_EXPORT: worst-case solar moment in a window - most conservative for solar HC.
-                # PEAK_FEEDER_IMPORT: worst-case load moment - most conservative for EV/load growth.
-                # FIXED_LOAD: uniform per-customer baseline - useful for standardised cross-feeder comparisons.
-                initial_state_selector=IntrinsicInitialLoadStateConfigInput(
-                    selector_mode=IntrinsicInitialStateSelectorMode.ZERO_LOAD,
-                    start_time=datetime.fromisoformat(config["load_time"]["start1"]),
-                ),
-                # LV voltage limits in volts (phase-to-neutral).
-                # Values here are emergency limits (VH2=260, VL2=207) - use normal limits (VH1=253, VL1=216)
-                # for a more conservative assessment. Adjust to match your network standard.
-                # Add hv= block to IntrinsicVoltageConstraintsInput to also enforce HV voltage limits (in per unit).
-                # Add thermal= block to IntrinsicConstraintsConfigInput to enforce thermal limits.
-                constraints=IntrinsicConstraintsConfigInput(
-                    voltage=IntrinsicVoltageConstraintsInput(
-                        lv=IntrinsicLvVoltageConstraintInput(
-                            max=260,
-                            min=207
-                        )
-                    )
-                ),
-                # EXPORT_GENERATION: find how much solar/generation the network can absorb.
-                # Change to IMPORT_LOAD to find import headroom (e.g. for EV charging or load growth).
-                injection_resource=IntrinsicInjectionResourceConfigInput(
-                    method=IntrinsicInjectionResourceMethod.EXPORT_GENERATION,
-                    load_model_type=IntrinsicLoadModelType.NEGATIVE_LOAD,
-                    power_factor=0.95
-                ),
-                # step_kw_per_customer controls precision: smaller = finer results but more iterations.
-                # If headroom equals step_kw_per_customer * max_steps the search hit the limit without
-                # finding a constraint; increase max_steps or step size to find the true upper bound.
-                search=IntrinsicSearchConfigInput(
-                    step_kw_per_customer=1.0,
-                    max_steps=200,
-                    lock_out_capacity_zone_on_violation=True,
-                    stop_on_hv_violation=True
-                )
+        result = await submit_work_package(
+            eas_client,
+            build_work_package(
+                config["feeders"],
+                scenario="base",
+                year=config["forecast_years"][0],
+                initial_state_selector=build_initial_state_selector(config),
+                injection_resource=build_injection_resource(),
+                search=build_search(),
             ),
-            config["work_package_name"]
-        ))
+            config["work_package_name"],
+            Mutation.run_intrinsic_work_package,
+            ledger,
+        )
         print_run(result)
     except Exception as e:
         print(e)
 
     await eas_client.close()
+    if ledger is not None:
+        ledger.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+"""
+Run the job queue scheduler (see job_queue.py), releasing the work packages and calibrations queued with queue_jobs.py
+to EAS as slots free up:
+
+    python run_job_queue.py ./config [--until-empty]
+
+It runs until stopped, picking up jobs as they're queued, or with --until-empty until nothing is queued and everything
+it released has finished. The limits are set in the job_queue section of config.json:
+
+    "job_queue": {
+        "max_active_work_packages": 8,
+        "reserved_urgent_slots": 1,
+        "max_active_calibrations": 2,
+        "poll_seconds": 30,
+        "submission_grace_seconds": 120
+    }
+
+Stopping the scheduler is safe at any point: the queue is kept in job_queue.sqlite in the config directory, and running
+it again carries on where it left off.
+"""
+
+import asyncio
+import sys
+
+from job_queue import JobQueue, Scheduler, print_queue_table, queue_settings, store_path
+from ledger import open_ledger
+from utils import get_client, get_config, get_config_dir, has_flag, logger
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
+    settings = queue_settings(config)
+
+    with JobQueue(store_path(config_dir)) as queue:
+        scheduler = Scheduler(eas_client, queue, settings, ledger)
+        logger.info(f"Job queue running with at most {settings['max_active_work_packages']} active work packages "
+                    f"({settings['reserved_urgent_slots']} reserved for urgent jobs) and "
+                    f"{settings['max_active_calibrations']} calibrations")
+        try:
+            await scheduler.run(until_idle=has_flag(argv, "--until-empty"))
+        finally:
+            await eas_client.close()
+            if ledger is not None:
+                ledger.close()
+        print_queue_table(queue.entries())
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
@@ -0,0 +1,84 @@
+import asyncio
+import sys
+
+from journal import Journal, journal_path
+from ledger import open_ledger
+from parameter_sweep import apply_point, plan_points, plan_sweep_shards, print_sweep_summary, write_sweep_index
+from run_forecast_work_package import build_work_package
+from sharding import manifest_path, submit_journalled_shards, write_manifest
+from tap_settings import latest_tap_settings, split_shards_by_tap_settings
+from utils import get_client, get_config, get_config_dir, has_flag
+
+"""
+Run a parameter sweep over the model config of the forecast work package in run_forecast_work_package.py, for
+sensitivity studies. Configure the sweep under parameter_sweep in config.json:
+
+    "parameter_sweep": {
+        "method": "latin_hypercube",
+        "points": 200,
+        "seed": 1,
+        "feeders": ["feeder1", "feeder2"],
+        "parameters": {
+            "maxLoadTxRatio": {"min": 1.5, "max": 4.0},
+            "maxGenTxRatio": {"min": 4.0, "max": 10.0},
+            "closedLoopVRegSetPoint": {"values": [0.98, 0.9925, 1.0]}
+        }
+    }
+
+method is grid (the default, which needs steps for each range) or latin_hypercube (which needs points). See
+parameter_sweep.py for the parameter formats. feeders defaults to the feeders in config.json, and the years and
+scenarios are taken from config.json. Sweeps of more than max_points (default 1000) points are refused.
+
+Each point is submitted as its own work package, <work_package_name>-sweep-<point>, with at most
+max_in_flight_submissions (default 4) submissions outstanding. The parameters of each point and the work package it
+was submitted as are written to <work_package_name>.sweep.csv, and the manifest to
+<work_package_name>-sweep.manifest.json. Cached tap settings are applied as in run_forecast_work_package.py, so a point
+whose feeders take their tap settings from more than one calibration set is submitted as a work package per set.
+Points are journalled, so an interrupted sweep can be finished with --resume.
+"""
+
+
+async def main(argv):
+    config_dir = get_config_dir(argv)
+    config = get_config(config_dir)
+    sweep_config = config["parameter_sweep"]
+    points = plan_points(sweep_config)
+    feeders = sweep_config.get("feeders", config["feeders"])
+    shards = split_shards_by_tap_settings(
+        plan_sweep_shards(points, feeders, config["forecast_years"], config["scenarios"]),
+        latest_tap_settings(config_dir, config, feeders),
+    )
+
+    # The work package is built once per calibration set, and each point only replaces its swept model parameters.
+    bases = {}
+    for shard in shards:
+        if shard["tap_settings"] not in bases:
+            bases[shard["tap_settings"]] = build_work_package(
+                config, shard["feeders"], config["forecast_years"], config["scenarios"], shard["tap_settings"]
+            )
+    eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
+    name = config["work_package_name"]
+
+    with Journal(journal_path(config_dir, name, "sweep"), resume=has_flag(argv, "--resume")) as journal:
+        entries = await submit_journalled_shards(
+            eas_client,
+            journal,
+            shards,
+            lambda shard: apply_point(bases[shard["tap_settings"]], shard["parameters"]),
+            name,
+            max_in_flight=config.get("max_in_flight_submissions", 4),
+            suffix="sweep",
+            ledger=ledger,
+        )
+    write_manifest(manifest_path(config_dir, f"{name}-sweep"), name, entries)
+    write_sweep_index(f"{config_dir}/{name}.sweep.csv", entries)
+    print_sweep_summary(entries)
+
+    await eas_client.close()
+    if ledger is not None:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
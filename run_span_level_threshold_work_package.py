@@ -7,10 +7,12 @@ import asyncio
 import sys
 from datetime import datetime
 
-from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput, Mutation, HcGeneratorConfigInput, \
+from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput, HcGeneratorConfigInput, \
     HcModelConfigInput, HcSolveConfigInput, HcWriterConfigInput, HcWriterOutputConfigInput, \
     HcEnhancedMetricsConfigInput, HcStoredResultsConfigInput, HcMetricsResultsConfigInput, HcResultProcessorConfigInput
 
+from ledger import open_ledger, submit_work_package
+from tap_settings import plan_tap_settings_groups
 from utils import get_client, get_config, print_run, get_config_dir
 
 
@@ -18,6 +20,7 @@ async def main(argv):
     config_dir = get_config_dir(argv)
     config = get_config(config_dir)
     eas_client = get_client(config_dir)
+    ledger = open_ledger(config_dir, config)
 
     # Work package with span level threshold config example.
     # The below will run a forecast-based work package for the configured feeders, years, and scenarios, over the time period specified in load_time below.
@@ -33,63 +36,72 @@ async def main(argv):
         )
     )
 
-    try:
-        result = await eas_client.mutation(Mutation.run_work_package(
-            WorkPackageInput(
-                forecastConfig=forecast_config,
-                generatorConfig=HcGeneratorConfigInput(
-                    model=HcModelConfigInput(
-                        seed=123,
-                        simplifyNetwork=True,
-                        # Use span level ratings (designedrating from CIM) during network simplification.
-                        # Ensure rating_threshold is set to an appropriate value when enabling this.
-                        useSpanLevelThreshold=True,
-                        # Tolerable % difference between PLSI of connected AcLineSegments to normalise into a single impedance value.
-                        simplifyPLSIThreshold=10.0,
-                        # Tolerable % difference between span level ratings to collapse connected AcLineSegments into a single line.
-                        ratingThreshold=10.0,
-                        # Emergency current rating as a multiple of normal current rating (2.0 = 200% of normal).
-                        emergAmpScaling=2.0
+    # Feeders take their transformer tap settings from the latest calibration set exported for them with
+    # get_calibration_transformer_settings.py, with a work package per calibration set (see tap_settings.py). Set
+    # reuse_tap_settings to false in config.json to disable this.
+    for work_package_name, tap_settings, feeders in plan_tap_settings_groups(config_dir, config):
+        try:
+            result = await submit_work_package(
+                eas_client,
+                WorkPackageInput(
+                    forecastConfig=forecast_config.model_copy(update={"feeders": feeders}),
+                    generatorConfig=HcGeneratorConfigInput(
+                        model=HcModelConfigInput(
+                            seed=123,
+                            transformerTapSettings=tap_settings,
+                            simplifyNetwork=True,
+                            # Use span level ratings (designedrating from CIM) during network simplification.
+                            # Ensure rating_threshold is set to an appropriate value when enabling this.
+                            useSpanLevelThreshold=True,
+                            # Tolerable % difference between PLSI of connected AcLineSegments to normalise into a single impedance value.
+                            simplifyPLSIThreshold=10.0,
+                            # Tolerable % difference between span level ratings to collapse connected AcLineSegments into a single line.
+                            ratingThreshold=10.0,
+                            # Emergency current rating as a multiple of normal current rating (2.0 = 200% of normal).
+                            emergAmpScaling=2.0
+                        ),
+                        solve=HcSolveConfigInput(stepSizeMinutes=30),
                     ),
-                    solve=HcSolveConfigInput(stepSizeMinutes=30),
-                ),
 
-                resultProcessorConfig=HcResultProcessorConfigInput(
-                    writerConfig=HcWriterConfigInput(
-                        outputWriterConfig=HcWriterOutputConfigInput(
-                            enhancedMetricsConfig=HcEnhancedMetricsConfigInput(
-                                populateEnhancedMetrics=True,
-                                populateEnhancedMetricsProfile=False,
-                                calculateEmergForLoadThermal=True,
-                                calculateNormalForLoadThermal=True,
-                                calculateCO2=True,
-                                populateConstraints=False,
-                                populateWeeklyReports=False,
-                                populateDurationCurves=False,
-                                calculateEmergForGenThermal=True,
-                                calculateNormalForGenThermal=True,
+                    resultProcessorConfig=HcResultProcessorConfigInput(
+                        writerConfig=HcWriterConfigInput(
+                            outputWriterConfig=HcWriterOutputConfigInput(
+                                enhancedMetricsConfig=HcEnhancedMetricsConfigInput(
+                                    populateEnhancedMetrics=True,
+                                    populateEnhancedMetricsProfile=False,
+                                    calculateEmergForLoadThermal=True,
+                                    calculateNormalForLoadThermal=True,
+                                    calculateCO2=True,
+                                    populateConstraints=False,
+                                    populateWeeklyReports=False,
+                                    populateDurationCurves=False,
+                                    calculateEmergForGenThermal=True,
+                                    calculateNormalForGenThermal=True,
+                                )
                             )
-                        )
-                    ),
-                    # Caution: storing raw results uses significant storage - avoid for large work packages.
-                    storedResults=HcStoredResultsConfigInput(
-                        voltageExceptionsRaw=False,
-                        overloadsRaw=False,
-                        energyMetersRaw=False,
-                        energyMeterVoltagesRaw=False
+                        ),
+                        # Caution: storing raw results uses significant storage - avoid for large work packages.
+                        storedResults=HcStoredResultsConfigInput(
+                            voltageExceptionsRaw=False,
+                            overloadsRaw=False,
+                            energyMetersRaw=False,
+                            energyMeterVoltagesRaw=False
+                        ),
+                        # calculatePerformanceMetrics is deprecated - prefer populateEnhancedMetrics above.
+                        metrics=HcMetricsResultsConfigInput(calculatePerformanceMetrics=False)
                     ),
-                    # calculatePerformanceMetrics is deprecated - prefer populateEnhancedMetrics above.
-                    metrics=HcMetricsResultsConfigInput(calculatePerformanceMetrics=False)
+                    qualityAssuranceProcessing=False
                 ),
-                qualityAssuranceProcessing=False
-            ),
-            work_package_name=config["work_package_name"],
-        ))
-        print_run(result)
-    except Exception as e:
-        print(e)
+                work_package_name,
+                ledger=ledger,
+            )
+            print_run(result)
+        except Exception as e:
+            print(e)
 
     await eas_client.close()
+    if ledger is not None:
+        ledger.close()
 
 
 if __name__ == "__main__":
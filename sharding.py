@@ -0,0 +1,235 @@
+"""
+Split the feeder x year x scenario matrix of a forecast work package into shards and submit each shard as its own work
+package, so a single failed feeder or slow model build only holds up its own shard.
+
+Shards are submitted concurrently over a single async EasClient, with a cap on the number of in-flight requests. The
+result is a manifest mapping each shard to the work package ID it was submitted as, which can be saved and later used to
+rerun an individual shard.
+"""
+
+import asyncio
+import json
+import math
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from zepben.eas import Mutation
+from zepben.eas.client.eas_client import EasClient
+
+from feeder_sizes import pack_feeders
+from journal import Journal
+from ledger import Ledger, submit_work_package
+from resilience import find_submitted_work_package
+from utils import logger
+
+
+def plan_shards(feeders: List[str], years: List[int], scenarios: List[str], shard_size: int) -> List[Dict]:
+    """
+    Split feeders x years x scenarios into shards of at most `shard_size` feeder/year/scenario combinations.
+
+    Whole feeders (with all their years and scenarios) are packed together where `shard_size` allows it. Otherwise each
+    year/scenario pair is sharded separately so no shard exceeds `shard_size`.
+    """
+    groups, feeders_per_shard = _shard_groups(years, scenarios, shard_size)
+    return _shards(groups, [list(feeders[i:i + feeders_per_shard]) for i in range(0, len(feeders), feeders_per_shard)])
+
+
+def plan_balanced_shards(
+    weights: Dict[str, float],
+    years: List[int],
+    scenarios: List[str],
+    shard_size: int,
+) -> List[Dict]:
+    """
+    Split feeders x years x scenarios into the same number of shards as plan_shards, each of at most `shard_size`
+    combinations, but with feeders packed by their `weights` (see feeder_sizes.py) so every shard has about the same
+    total weight. A single giant feeder then gets a shard of mostly small feeders rather than holding up a full one.
+    """
+    groups, feeders_per_shard = _shard_groups(years, scenarios, shard_size)
+    bins = math.ceil(len(weights) / feeders_per_shard)
+    return _shards(groups, pack_feeders(weights, bins, feeders_per_shard))
+
+
+def plan_combination_shards(combinations: List[Tuple[str, int, str]], shard_size: Optional[int] = None) -> List[Dict]:
+    """
+    Shards covering exactly the given feeder/year/scenario combinations, such as those left to run by an incremental
+    study. A forecast work package runs every year and scenario for each of its feeders, so feeders that need the same
+    years and scenarios are grouped together, and each group is split by plan_shards if `shard_size` is set.
+    """
+    years_by_feeder = defaultdict(lambda: defaultdict(set))
+    for feeder, year, scenario in combinations:
+        years_by_feeder[feeder][scenario].add(year)
+
+    feeders_by_group = defaultdict(list)
+    for feeder, years_by_scenario in years_by_feeder.items():
+        scenarios_by_years = defaultdict(list)
+        for scenario, years in years_by_scenario.items():
+            scenarios_by_years[tuple(sorted(years))].append(scenario)
+        for years, scenarios in scenarios_by_years.items():
+            feeders_by_group[(years, tuple(sorted(scenarios)))].append(feeder)
+
+    shards = []
+    for (years, scenarios), feeders in sorted(feeders_by_group.items()):
+        feeders = sorted(feeders)
+        if shard_size:
+            group_shards = plan_shards(feeders, list(years), list(scenarios), shard_size)
+        else:
+            group_shards = [{"feeders": feeders, "years": list(years), "scenarios": list(scenarios)}]
+        shards += [{**shard, "shard": len(shards) + i} for i, shard in enumerate(group_shards)]
+    return shards
+
+
+def _shard_groups(years: List[int], scenarios: List[str], shard_size: int) -> Tuple[List[Tuple[List, List]], int]:
+    if shard_size < 1:
+        raise ValueError(f"shard_size must be at least 1, got {shard_size}")
+
+    combinations_per_feeder = len(years) * len(scenarios)
+    if shard_size >= combinations_per_feeder:
+        return [(years, scenarios)], shard_size // combinations_per_feeder
+    return [([year], [scenario]) for year in years for scenario in scenarios], shard_size
+
+
+def _shards(groups: List[Tuple[List, List]], feeder_groups: List[List[str]]) -> List[Dict]:
+    shards = []
+    for shard_years, shard_scenarios in groups:
+        for shard_feeders in feeder_groups:
+            shards.append({
+                "shard": len(shards),
+                "feeders": shard_feeders,
+                "years": list(shard_years),
+                "scenarios": list(shard_scenarios),
+            })
+    return shards
+
+
+def shard_work_package_name(work_package_name: str, shard: Dict, suffix: str = "shard") -> str:
+    return f"{work_package_name}-{suffix}-{shard['shard']:04d}"
+
+
+async def submit_shards(
+    eas_client: EasClient,
+    shards: List[Dict],
+    build_work_package: Callable[[Dict], Any],
+    work_package_name: str,
+    max_in_flight: int = 4,
+    mutation: Callable = Mutation.run_work_package,
+    suffix: str = "shard",
+    ledger: Optional[Ledger] = None,
+    journal: Optional[Journal] = None,
+) -> List[Dict]:
+    """
+    Submit each shard as a separate work package, with at most `max_in_flight` mutations outstanding at once.
+
+    `build_work_package` is called with the shard just before it is submitted, so only the in-flight work packages are
+    held in memory. `mutation` can be swapped for another mutation with the same signature, such as
+    Mutation.run_intrinsic_work_package. With a `ledger`, shards identical to work packages already run reuse their IDs.
+    With a `journal`, each shard is recorded just before it is submitted and again once it is acknowledged or rejected.
+    Returns one manifest entry per shard, in the same order as `shards`.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def submit(shard: Dict) -> Dict:
+        async with semaphore:
+            entry = {
+                **shard,
+                "work_package_name": shard_work_package_name(work_package_name, shard, suffix),
+                "work_package_id": None,
+                "errors": [],
+            }
+            if journal is not None:
+                journal.submitting(shard)
+            try:
+                result = await submit_work_package(
+                    eas_client, build_work_package(shard), entry["work_package_name"], mutation, ledger
+                )
+                if "data" in result:
+                    entry["work_package_id"] = next(iter(result["data"].values()))
+                else:
+                    entry["errors"] = [err["message"] for err in result["errors"]]
+            except Exception as e:
+                entry["errors"] = [str(e)]
+
+            if entry["work_package_id"] is not None:
+                logger.info(f"{entry['work_package_name']} submitted as work package {entry['work_package_id']}")
+                if journal is not None:
+                    journal.acknowledge(entry)
+            else:
+                logger.error(f"{entry['work_package_name']} failed to submit: {'; '.join(entry['errors'])}")
+                if journal is not None:
+                    journal.fail(entry)
+            return entry
+
+    return list(await asyncio.gather(*(submit(shard) for shard in shards)))
+
+
+async def submit_journalled_shards(
+    eas_client: EasClient,
+    journal: Journal,
+    shards: List[Dict],
+    build_work_package: Callable[[Dict], Any],
+    work_package_name: str,
+    **kwargs,
+) -> List[Dict]:
+    """
+    submit_shards with a write-ahead `journal`: the plan is journalled first, then only the shards not yet acknowledged
+    are submitted. When resuming, the journalled plan is used and the entries of shards acknowledged before are kept.
+    Shards that were being submitted when the batch stopped are looked up by work package name first, and only submitted
+    again if EAS has no such work package (see resolve_in_doubt_shards). Returns one manifest entry per planned shard, in
+    plan order.
+    """
+    journal.plan(shards)
+    held = await resolve_in_doubt_shards(eas_client, journal, work_package_name, kwargs.get("suffix", "shard"))
+    held_shards = {entry["shard"] for entry in held}
+    pending = [shard for shard in journal.pending() if shard["shard"] not in held_shards]
+    entries = journal.acknowledged() + held + await submit_shards(
+        eas_client, pending, build_work_package, work_package_name, journal=journal, **kwargs
+    )
+    return sorted(entries, key=lambda entry: entry["shard"])
+
+
+async def resolve_in_doubt_shards(eas_client: EasClient, journal: Journal, work_package_name: str, suffix: str) -> List[Dict]:
+    """
+    Look up each shard the journal has in doubt by its work package name, acknowledging those EAS already has. Returns
+    the entries of shards that couldn't be looked up, which are held back rather than risk submitting them twice.
+    """
+    held = []
+    for shard, submitted_at in journal.in_doubt():
+        entry = {**shard, "work_package_name": shard_work_package_name(work_package_name, shard, suffix),
+                 "work_package_id": None, "errors": []}
+        try:
+            entry["work_package_id"] = await find_submitted_work_package(eas_client, entry["work_package_name"], submitted_at)
+        except Exception as e:
+            entry["errors"] = [f"was being submitted when the batch stopped and couldn't be looked up, not submitting it "
+                               f"again: {e}"]
+            logger.error(f"{entry['work_package_name']} {entry['errors'][0]}")
+            held.append(entry)
+            continue
+
+        if entry["work_package_id"] is not None:
+            logger.info(f"{entry['work_package_name']} was submitted as work package {entry['work_package_id']} before "
+                        f"the batch stopped")
+            journal.acknowledge(entry)
+        else:
+            logger.warning(f"{entry['work_package_name']} was being submitted when the batch stopped but never reached "
+                           f"EAS, submitting it again")
+    return held
+
+
+def manifest_path(config_dir: str, work_package_name: str) -> str:
+    return f"{config_dir}/{work_package_name}.manifest.json"
+
+
+def write_manifest(path: str, work_package_name: str, entries: List[Dict]):
+    with open(path, "w") as file:
+        json.dump({"work_package_name": work_package_name, "shards": entries}, file, indent=2)
+
+
+def read_manifest(path: str) -> Dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def print_manifest(entries: List[Dict]):
+    for entry in entries:
+        status = entry["work_package_id"] if entry["work_package_id"] is not None else f"FAILED ({'; '.join(entry['errors'])})"
+        print(f'{entry["work_package_name"]} feeders={len(entry["feeders"])} work_package_id={status}')
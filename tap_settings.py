@@ -0,0 +1,408 @@
+"""
+Local store of the transformer tap settings produced by calibration runs, so tap settings can be looked up by calibration
+set, feeder and transformer without querying EAS and parsing its response every time.
+
+The store is a single SQLite file in the config directory with one row per calibration set, feeder and transformer, keyed
+and ordered on those three columns. Each feeder of a calibration set is only ever fetched once: on export only the
+feeders not yet fetched for a set are, so feeders added to config.json later still get their tap settings from sets
+already in the store. Lookups read the file through SQLite's memory-mapped I/O.
+
+The submitters use the store to apply each feeder's latest tap settings to its work package: a work package takes a
+single calibration set (HcModelConfigInput.transformerTapSettings), so feeders are grouped by the most recent
+calibration set with settings for them, and each group is run as a separate work package. How recent a set is comes from
+when its calibration run completed in EAS, recorded on export, rather than from when it was exported. run_calibration.py
+uses it to skip feeders whose tap settings are already known.
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from zepben.eas import GqlTxTapRecordFields, HcCalibrationFields, Query
+from zepben.eas.client.eas_client import EasClient
+
+from utils import logger
+
+STORE_FILE_NAME = "tap_settings.sqlite"
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibration_sets (
+    calibration_set TEXT PRIMARY KEY,
+    feeders INTEGER NOT NULL,
+    transformers INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    -- When the calibration run completed in EAS, or null if it isn't known.
+    calibrated_at REAL
+);
+CREATE TABLE IF NOT EXISTS tap_settings (
+    calibration_set TEXT NOT NULL,
+    feeder TEXT NOT NULL,
+    transformer TEXT NOT NULL,
+    control_enabled INTEGER,
+    high_step INTEGER,
+    low_step INTEGER,
+    nominal_tap_num INTEGER,
+    step_voltage_increment REAL,
+    tap_position INTEGER,
+    PRIMARY KEY (calibration_set, feeder, transformer)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fetched_feeders (
+    calibration_set TEXT NOT NULL,
+    feeder TEXT NOT NULL,
+    PRIMARY KEY (calibration_set, feeder)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tap_settings_by_transformer ON tap_settings (transformer, calibration_set);
+"""
+
+TAP_FIELDS = {
+    "control_enabled": GqlTxTapRecordFields.control_enabled,
+    "high_step": GqlTxTapRecordFields.high_step,
+    "low_step": GqlTxTapRecordFields.low_step,
+    "nominal_tap_num": GqlTxTapRecordFields.nominal_tap_num,
+    "step_voltage_increment": GqlTxTapRecordFields.step_voltage_increment,
+    "tap_position": GqlTxTapRecordFields.tap_position,
+}
+
+
+class TapSetting(NamedTuple):
+    calibration_set: str
+    feeder: str
+    transformer: str
+    control_enabled: Optional[bool]
+    high_step: Optional[int]
+    low_step: Optional[int]
+    nominal_tap_num: Optional[int]
+    step_voltage_increment: Optional[float]
+    tap_position: Optional[int]
+
+
+def store_path(config_dir: str) -> str:
+    return f"{config_dir}/{STORE_FILE_NAME}"
+
+
+class TapSettingsStore:
+    """The tap settings store at `path`, created if it doesn't exist. Can be used as a context manager to close it."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+        self.connection.executescript(_SCHEMA)
+        # Stores created before calibration times were recorded.
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(calibration_sets)")}
+        if "calibrated_at" not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE calibration_sets ADD COLUMN calibrated_at REAL")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def calibration_sets(self) -> Dict[str, Dict]:
+        """
+        The calibration sets in the store, with their feeder and transformer counts, when they were fetched and when
+        their calibration run completed.
+        """
+        rows = self.connection.execute(
+            "SELECT calibration_set, feeders, transformers, fetched_at, calibrated_at FROM calibration_sets"
+        )
+        return {name: {"feeders": feeders, "transformers": transformers, "fetched_at": fetched_at,
+                       "calibrated_at": calibrated_at}
+                for name, feeders, transformers, fetched_at, calibrated_at in rows}
+
+    def set_calibrated_at(self, calibration_set: str, calibrated_at: float):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE calibration_sets SET calibrated_at = ? WHERE calibration_set = ?", (calibrated_at, calibration_set)
+            )
+
+    def fetched_feeders(self, calibration_set: str) -> Set[str]:
+        """The feeders whose tap settings have been fetched for a calibration set, including those with none."""
+        # Stores written before fetched feeders were recorded only have their tap settings to go by.
+        rows = self.connection.execute(
+            "SELECT feeder FROM fetched_feeders WHERE calibration_set = ? "
+            "UNION SELECT DISTINCT feeder FROM tap_settings WHERE calibration_set = ?",
+            (calibration_set, calibration_set),
+        )
+        return {feeder for feeder, in rows}
+
+    def write(self, calibration_set: str, records_by_feeder: Dict[str, List[Dict]], calibrated_at: Optional[float] = None):
+        """
+        Store the tap settings of a calibration set for some of its feeders, as returned by getTransformerTapSettings for
+        each feeder, along with when its calibration run completed if known. Feeders of the set stored before are kept.
+        """
+        rows = [
+            (calibration_set, feeder, record["id"], *(record.get(_camel(f)) for f in TAP_FIELDS))
+            for feeder, records in records_by_feeder.items()
+            for record in records
+        ]
+        feeders = [(calibration_set, feeder) for feeder in records_by_feeder]
+        # One transaction per export of a set, so its feeders are either stored completely or not at all.
+        with self.connection:
+            self.connection.executemany("DELETE FROM tap_settings WHERE calibration_set = ? AND feeder = ?", feeders)
+            self.connection.executemany(f"INSERT INTO tap_settings VALUES ({', '.join('?' * len(TapSetting._fields))})", rows)
+            self.connection.executemany("INSERT OR IGNORE INTO fetched_feeders VALUES (?, ?)", feeders)
+            transformers, = self.connection.execute(
+                "SELECT COUNT(*) FROM tap_settings WHERE calibration_set = ?", (calibration_set,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT INTO calibration_sets (calibration_set, feeders, transformers, fetched_at, calibrated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (calibration_set) DO UPDATE SET feeders = excluded.feeders, "
+                "transformers = excluded.transformers, fetched_at = excluded.fetched_at, "
+                "calibrated_at = COALESCE(excluded.calibrated_at, calibrated_at)",
+                (calibration_set, len(self.fetched_feeders(calibration_set)), transformers, time.time(), calibrated_at),
+            )
+
+    def lookup(
+        self,
+        calibration_set: Optional[str] = None,
+        feeder: Optional[str] = None,
+        transformer: Optional[str] = None,
+    ) -> List[TapSetting]:
+        """The stored tap settings matching all of the given filters, ordered by calibration set, feeder and transformer."""
+        filters = {"calibration_set": calibration_set, "feeder": feeder, "transformer": transformer}
+        where = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        rows = self.connection.execute(
+            "SELECT * FROM tap_settings"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " ORDER BY calibration_set, feeder, transformer",
+            [value for value in filters.values() if value is not None],
+        )
+        return [TapSetting(*row[:3], None if row[3] is None else bool(row[3]), *row[4:]) for row in rows]
+
+    def feeders(self, calibration_set: str) -> List[str]:
+        rows = self.connection.execute(
+            "SELECT DISTINCT feeder FROM tap_settings WHERE calibration_set = ? ORDER BY feeder", (calibration_set,)
+        )
+        return [feeder for feeder, in rows]
+
+    def latest_calibration_sets(self, max_age_seconds: Optional[float] = None) -> Dict[str, str]:
+        """
+        The most recently calibrated set with tap settings for each feeder, leaving out sets calibrated more than
+        `max_age_seconds` ago. Sets whose calibration time isn't known (their run is no longer in EAS) go by when they
+        were exported instead.
+        """
+        rows = self.connection.execute(
+            "SELECT t.feeder, c.calibration_set FROM (SELECT DISTINCT calibration_set, feeder FROM tap_settings) t "
+            "JOIN (SELECT calibration_set, COALESCE(calibrated_at, fetched_at) AS calibrated_at FROM calibration_sets) c "
+            "ON c.calibration_set = t.calibration_set "
+            "WHERE c.calibrated_at >= ? ORDER BY c.calibrated_at, c.calibration_set",
+            (0 if max_age_seconds is None else time.time() - max_age_seconds,),
+        )
+        # Ordered oldest first, so each feeder ends up with its latest set.
+        return dict(rows.fetchall())
+
+    def calibrated_feeders(self, max_age_seconds: Optional[float] = None) -> Set[str]:
+        """
+        The feeders fetched for any set calibrated within `max_age_seconds`, including those with no tap settings as they
+        have no tap changing transformers.
+        """
+        rows = self.connection.execute(
+            "SELECT DISTINCT f.feeder FROM (SELECT calibration_set, feeder FROM fetched_feeders "
+            "UNION SELECT calibration_set, feeder FROM tap_settings) f "
+            "JOIN calibration_sets c ON c.calibration_set = f.calibration_set "
+            "WHERE COALESCE(c.calibrated_at, c.fetched_at) >= ?",
+            (0 if max_age_seconds is None else time.time() - max_age_seconds,),
+        )
+        return {feeder for feeder, in rows}
+
+
+def latest_tap_settings(config_dir: str, config: Dict, feeders: Iterable[str]) -> Dict[str, Optional[str]]:
+    """
+    The calibration set to take each feeder's tap settings from, or None for feeders with no tap settings in the store
+    from a calibration completed within `tap_settings_max_age_days` (any age if not set). Every feeder gets None if
+    `reuse_tap_settings` is false in config.json.
+    """
+    feeders = list(feeders)
+    path = store_path(config_dir)
+    if not config.get("reuse_tap_settings", True) or not os.path.exists(path):
+        return {feeder: None for feeder in feeders}
+
+    with TapSettingsStore(path) as store:
+        latest = store.latest_calibration_sets(_max_age_seconds(config))
+        calibrated = store.calibrated_feeders(_max_age_seconds(config))
+    # Feeders calibrated without any tap settings have no tap changing transformers, so there is nothing to apply.
+    missing = [feeder for feeder in feeders if feeder not in calibrated]
+    if missing and len(missing) < len(feeders):
+        logger.warning(f"No cached tap settings for {len(missing)} of {len(feeders)} feeders, run a calibration for them "
+                       f"to apply calibrated taps: {missing[:10]}")
+    return {feeder: latest.get(feeder) for feeder in feeders}
+
+
+def group_by_tap_settings(calibration_sets: Dict[str, Optional[str]]) -> List[Tuple[Optional[str], List[str]]]:
+    """
+    The feeders grouped by the calibration set to take their tap settings from, in calibration set order with the
+    feeders without tap settings last.
+    """
+    groups: Dict[Optional[str], List[str]] = {}
+    for feeder, calibration_set in calibration_sets.items():
+        groups.setdefault(calibration_set, []).append(feeder)
+    return sorted(groups.items(), key=lambda group: (group[0] is None, group[0] or ""))
+
+
+def plan_tap_settings_groups(config_dir: str, config: Dict) -> List[Tuple[str, Optional[str], List[str]]]:
+    """
+    The work packages to run the feeders in config.json as, each a (work package name, calibration set, feeders) tuple.
+    There is one per calibration set (see latest_tap_settings), named after `work_package_name` with a `-taps-<index>`
+    suffix if there is more than one.
+    """
+    groups = group_by_tap_settings(latest_tap_settings(config_dir, config, config["feeders"]))
+    if len(groups) <= 1:
+        return [(config["work_package_name"], groups[0][0] if groups else None, config["feeders"])]
+    return [(f'{config["work_package_name"]}-taps-{i:02d}', calibration_set, feeders)
+            for i, (calibration_set, feeders) in enumerate(groups)]
+
+
+def split_shards_by_tap_settings(shards: List[Dict], calibration_sets: Dict[str, Optional[str]]) -> List[Dict]:
+    """
+    Split each shard so all of its feeders take their tap settings from the same calibration set, given as the shard's
+    `tap_settings`. Shards are renumbered in order.
+    """
+    split = []
+    for shard in shards:
+        for calibration_set, feeders in group_by_tap_settings({f: calibration_sets.get(f) for f in shard["feeders"]}):
+            split.append({**shard, "shard": len(split), "feeders": feeders, "tap_settings": calibration_set})
+    return split
+
+
+def feeders_needing_calibration(config_dir: str, config: Dict, feeders: Iterable[str]) -> List[str]:
+    """
+    The feeders not fetched for any calibration set in the store within `tap_settings_max_age_days`, so the rest aren't
+    calibrated again. Feeders fetched without tap settings, having no tap changing transformers, count as calibrated,
+    though latest_tap_settings gives them no set to take tap settings from.
+    """
+    feeders = list(feeders)
+    path = store_path(config_dir)
+    if not config.get("reuse_tap_settings", True) or not os.path.exists(path):
+        return feeders
+
+    with TapSettingsStore(path) as store:
+        calibrated = store.calibrated_feeders(_max_age_seconds(config))
+    return [feeder for feeder in feeders if feeder not in calibrated]
+
+
+def _max_age_seconds(config: Dict) -> Optional[float]:
+    max_age_days = config.get("tap_settings_max_age_days")
+    return None if max_age_days is None else max_age_days * 24 * 60 * 60
+
+
+def _camel(name: str) -> str:
+    first, *rest = name.split("_")
+    return first + "".join(part.title() for part in rest)
+
+
+async def fetch_calibration_sets(eas_client: EasClient) -> List[str]:
+    result = await eas_client.query(Query.get_calibration_sets())
+    if "data" not in result:
+        raise RuntimeError("\n".join(err["message"] for err in result["errors"]))
+    return list(result["data"]["getCalibrationSets"])
+
+
+async def fetch_calibration_times(eas_client: EasClient, calibration_sets: Iterable[str], max_in_flight: int = 8) -> Dict[str, float]:
+    """
+    When the latest completed calibration run of each calibration set completed, leaving out sets with no completed run
+    in EAS or whose runs couldn't be listed.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(calibration_set: str) -> Optional[float]:
+        async with semaphore:
+            try:
+                result = await eas_client.query(
+                    Query.list_calibration_runs(name=calibration_set),
+                    HcCalibrationFields.name,
+                    HcCalibrationFields.completed_at,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to list the calibration runs of {calibration_set}: {e}")
+                return None
+        if "data" not in result:
+            logger.warning(f"Failed to list the calibration runs of {calibration_set}: "
+                           + "; ".join(err["message"] for err in result["errors"]))
+            return None
+        times = [_parse_time(run["completedAt"]) for run in result["data"]["listCalibrationRuns"] or []
+                 if run["name"] == calibration_set and run["completedAt"]]
+        return max(times, default=None)
+
+    calibration_sets = list(calibration_sets)
+    times = await asyncio.gather(*(fetch(calibration_set) for calibration_set in calibration_sets))
+    return {calibration_set: t for calibration_set, t in zip(calibration_sets, times) if t is not None}
+
+
+def _parse_time(value: str) -> float:
+    calibrated_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if calibrated_at.tzinfo is None:
+        calibrated_at = calibrated_at.replace(tzinfo=timezone.utc)
+    return calibrated_at.timestamp()
+
+
+async def fetch_tap_settings(
+    eas_client: EasClient,
+    calibration_set: str,
+    feeders: Iterable[str],
+    max_in_flight: int = 8,
+) -> Dict[str, List[Dict]]:
+    """Fetch the tap settings of a calibration set for each feeder, with at most `max_in_flight` queries at once."""
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(feeder: str) -> List[Dict]:
+        async with semaphore:
+            result = await eas_client.query(
+                Query.get_transformer_tap_settings(calibration_set, feeder=feeder),
+                GqlTxTapRecordFields.id,
+                *TAP_FIELDS.values(),
+            )
+        if "data" not in result:
+            raise RuntimeError(f"Failed to fetch tap settings for {calibration_set}/{feeder}: "
+                               + "; ".join(err["message"] for err in result["errors"]))
+        return result["data"]["getTransformerTapSettings"] or []
+
+    feeders = sorted(set(feeders))
+    records = await asyncio.gather(*(fetch(feeder) for feeder in feeders))
+    return dict(zip(feeders, records))
+
+
+async def export_tap_settings(
+    eas_client: EasClient,
+    store: TapSettingsStore,
+    calibration_sets: Iterable[str],
+    feeders: Iterable[str],
+    max_in_flight: int = 8,
+) -> List[str]:
+    """
+    Fetch and store the tap settings of each calibration set for the given feeders, skipping the feeders already fetched
+    for that set, along with when its calibration run completed. Returns the calibration sets that were fetched.
+    """
+    feeders = list(feeders)
+    calibration_sets = list(calibration_sets)
+    stored = store.calibration_sets()
+    calibration_times = await fetch_calibration_times(
+        eas_client,
+        [c for c in calibration_sets if c not in stored or stored[c]["calibrated_at"] is None],
+        max_in_flight,
+    )
+
+    exported = []
+    for calibration_set in calibration_sets:
+        fetched = store.fetched_feeders(calibration_set)
+        missing = [feeder for feeder in feeders if feeder not in fetched]
+        if not missing:
+            if calibration_set in calibration_times:
+                store.set_calibrated_at(calibration_set, calibration_times[calibration_set])
+            logger.info(f"Tap settings for {calibration_set} already stored, skipping")
+            continue
+
+        records_by_feeder = await fetch_tap_settings(eas_client, calibration_set, missing, max_in_flight)
+        store.write(calibration_set, records_by_feeder, calibration_times.get(calibration_set))
+        logger.info(f"Stored tap settings for {sum(len(r) for r in records_by_feeder.values())} transformers on "
+                    f"{len(records_by_feeder)} feeders from {calibration_set}")
+        exported.append(calibration_set)
+    return exported
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput
+
+from benchmarks.mock_eas_server import MockEasServer
+from benchmarks.run_benchmarks import mock_client
+from cost_estimate import DEFAULT_SECONDS_PER_SOLVE, CostHistory, Estimate, estimate_plan
+from results_export import exported_bytes
+
+
+def record(history, work_package_id, solves=100):
+    history.record_submission(work_package_id, Estimate(work_package_id, 1, solves, False, 0.0, 0.0))
+
+
+def test_refresh_only_queries_unfinished_work_packages(tmp_path):
+    async def refresh_twice():
+        with MockEasServer(job_seconds=0) as server, CostHistory(str(tmp_path / "cost_history.sqlite")) as history:
+            completed = server.state._add_work_package("completed")
+            cancelled = server.state._add_work_package("cancelled")
+            server.state.work_packages[cancelled]["cancelled"] = True
+            for work_package_id in (completed, cancelled, "deleted"):
+                record(history, work_package_id)
+
+            eas_client = mock_client(server)
+            try:
+                await history.refresh(eas_client)
+                first = server.state.counts["getWorkPackageById"]
+                await history.refresh(eas_client)
+                second = server.state.counts["getWorkPackageById"] - first
+            finally:
+                await eas_client.close()
+            statuses = dict(history.connection.execute("SELECT work_package_id, status FROM runs"))
+            runtime = history.connection.execute(
+                "SELECT runtime_seconds FROM runs WHERE work_package_id = ?", (completed,)
+            ).fetchone()[0]
+            return completed, cancelled, first, second, statuses, runtime
+
+    completed, cancelled, first, second, statuses, runtime = asyncio.run(refresh_twice())
+    assert first == 3
+    assert second == 0
+    assert statuses == {completed: "COMPLETED", cancelled: "CANCELLED", "deleted": "DELETED"}
+    assert runtime is not None
+
+
+def test_histories_without_statuses_are_migrated(tmp_path):
+    path = str(tmp_path / "cost_history.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE runs (work_package_id TEXT PRIMARY KEY, work_package_name TEXT NOT NULL, "
+                       "solves INTEGER NOT NULL, raw_results INTEGER NOT NULL, submitted_at REAL NOT NULL, "
+                       "runtime_seconds REAL, output_bytes INTEGER)")
+    connection.execute("INSERT INTO runs VALUES ('old', 'old', 10, 0, 0, 5.0, NULL)")
+    connection.commit()
+    connection.close()
+
+    with CostHistory(path) as history:
+        assert history.unfinished() == ["old"]
+        assert history.rates().seconds_per_solve == 0.5
+
+
+def test_a_plan_can_be_estimated_as_it_is_built(tmp_path):
+    built = []
+
+    def planned():
+        for i in range(3):
+            built.append(i)
+            yield f"study-{i}", WorkPackageInput(forecastConfig=ForecastConfigInput(
+                feeders=[f"feeder-{i}"], years=[2030, 2031], scenarios=["base"],
+                timePeriod=TimePeriodInput(startTime=datetime(2024, 1, 1), endTime=datetime(2024, 1, 2)),
+            ))
+
+    # Nothing in the history to refresh, so EAS isn't asked for anything.
+    estimates = asyncio.run(estimate_plan(None, str(tmp_path), planned()))
+    assert built == [0, 1, 2]
+    assert [(e.work_package_name, e.solves) for e in estimates] == [(f"study-{i}", 2 * 24) for i in range(3)]
+    assert estimates[0].runtime_seconds == 48 * DEFAULT_SECONDS_PER_SOLVE
+
+
+def test_exported_bytes_counts_the_files_of_complete_partitions(tmp_path):
+    written = tmp_path / "written.parquet"
+    written.write_bytes(b"x" * 100)
+    skipped = tmp_path / "skipped.parquet"
+    skipped.write_bytes(b"x" * 20)
+    entries = [
+        {"path": str(written), "status": "EXPORTED"},
+        {"path": str(skipped), "status": "SKIPPED"},
+        {"path": str(tmp_path / "failed.parquet"), "status": "FAILED"},
+    ]
+    assert exported_bytes(entries) == 120
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime
+
+from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput
+
+from benchmarks.mock_eas_server import MockEasServer
+from benchmarks.run_benchmarks import mock_client
+import pytest
+
+from job_queue import FORECAST, NORMAL, QUEUED, SUBMITTED, SUBMITTING, JobQueue, Scheduler, queue_settings, \
+    work_package_entry
+from progress import active_work_package_ids
+
+
+def forecast(feeder) -> WorkPackageInput:
+    return WorkPackageInput(forecastConfig=ForecastConfigInput(
+        feeders=[feeder],
+        years=[2030],
+        scenarios=["base"],
+        timePeriod=TimePeriodInput(startTime=datetime(2024, 1, 1), endTime=datetime(2025, 1, 1)),
+    ))
+
+
+def test_interrupted_work_packages_are_only_submitted_again_if_eas_doesnt_have_them(tmp_path):
+    with JobQueue(str(tmp_path / "job_queue.sqlite")) as queue:
+        queue.enqueue("study", FORECAST, NORMAL, [work_package_entry(f"study-{f}", forecast(f)) for f in ("a", "b")])
+        # The scheduler stopped while submitting both, and only the first reached EAS.
+        for entry in queue.entries():
+            queue.update(entry["id"], SUBMITTING)
+
+        async def restart():
+            with MockEasServer() as server:
+                existing = server.state._add_work_package("study-a")
+                eas_client = mock_client(server)
+                try:
+                    scheduler = Scheduler(eas_client, queue, queue_settings({}))
+                    await scheduler._resolve_interrupted()
+                    resolved = {entry["name"]: (entry["status"], entry["submitted_id"]) for entry in queue.entries()}
+                    await scheduler._release_work_packages()
+                finally:
+                    await eas_client.close()
+                return existing, resolved, len(server.state.work_packages)
+
+        existing, resolved, work_packages = asyncio.run(restart())
+        assert resolved == {"study-a": (SUBMITTED, existing), "study-b": (QUEUED, None)}
+        assert work_packages == 2
+        assert all(entry["status"] == SUBMITTED for entry in queue.entries())
+
+
+@pytest.mark.parametrize("payload", [None, "3", [], {}, {"active": ["wp-1"]}])
+def test_unexpected_active_work_packages_are_unknown(payload):
+    assert active_work_package_ids({"data": {"getActiveWorkPackages": payload}}) is None
+
+
+def test_active_work_packages_are_pending_and_in_progress():
+    payload = {"pending": ["wp-1"], "inProgress": [{"id": "wp-2", "progressPercent": 50}]}
+    assert active_work_package_ids({"data": {"getActiveWorkPackages": payload}}) == {"wp-1", "wp-2"}
+    assert active_work_package_ids({"data": {"getActiveWorkPackages": {"pending": []}}}) == set()
+
+
+class UnexpectedActiveWorkPackages:
+    """An EAS client whose getActiveWorkPackages answers with a payload the scheduler doesn't know."""
+
+    def __init__(self):
+        self.mutations = 0
+
+    async def query(self, query, *fields):
+        return {"data": {"getActiveWorkPackages": {"active": []}}}
+
+    async def mutation(self, *args, **kwargs):
+        self.mutations += 1
+        return {"data": {"runWorkPackage": "wp"}}
+
+
+def test_nothing_is_released_when_the_active_count_is_unknown(tmp_path):
+    with JobQueue(str(tmp_path / "job_queue.sqlite")) as queue:
+        queue.enqueue("study", FORECAST, NORMAL, [work_package_entry(f"study-{f}", forecast(f)) for f in ("a", "b")])
+        eas_client = UnexpectedActiveWorkPackages()
+        scheduler = Scheduler(eas_client, queue, queue_settings({}))
+
+        assert asyncio.run(scheduler.active_work_packages()) is None
+        asyncio.run(scheduler._release_work_packages())
+        assert eas_client.mutations == 0
+        assert all(entry["status"] == QUEUED for entry in queue.entries())
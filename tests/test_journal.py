@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime
+
+from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput
+
+from benchmarks.mock_eas_server import MockEasServer
+from benchmarks.run_benchmarks import mock_client
+from journal import ACKNOWLEDGED, FAILED, SUBMITTING, Journal, replay, replay_states
+from sharding import plan_shards, shard_work_package_name, submit_journalled_shards
+
+UNITS = [{"shard": i, "feeders": [f"feeder-{i}"]} for i in range(4)]
+
+
+def entry(unit, work_package_id=None):
+    return {**unit, "work_package_name": f"study-shard-{unit['shard']:04d}", "work_package_id": work_package_id,
+            "errors": []}
+
+
+def run_partly(path):
+    """A batch that stopped with shard 0 acknowledged, shard 1 rejected, shard 2 in doubt and shard 3 never started."""
+    with Journal(path) as journal:
+        journal.plan(UNITS)
+        for unit in UNITS[:3]:
+            journal.submitting(unit)
+        journal.acknowledge(entry(UNITS[0], "wp-0"))
+        journal.fail(entry(UNITS[1]))
+
+
+def test_resume_replays_the_state_of_every_unit(tmp_path):
+    path = str(tmp_path / "study.shard.journal.jsonl")
+    run_partly(path)
+
+    with Journal(path, resume=True) as journal:
+        assert journal.plan(UNITS) == UNITS
+        assert journal.pending() == UNITS[1:]
+        assert [unit for unit, _ in journal.in_doubt()] == [UNITS[2]]
+        assert journal.in_doubt()[0][1] > 0
+        assert journal.acknowledged() == [entry(UNITS[0], "wp-0")]
+
+    assert replay_states(path) == {"0": ACKNOWLEDGED, "1": FAILED, "2": SUBMITTING, "3": "planned"}
+
+
+def test_resume_keeps_the_journalled_plan(tmp_path):
+    path = str(tmp_path / "study.shard.journal.jsonl")
+    run_partly(path)
+
+    with Journal(path, resume=True) as journal:
+        assert journal.plan(UNITS[:2]) == UNITS
+
+
+def test_a_record_cut_short_by_a_crash_is_ignored(tmp_path):
+    path = str(tmp_path / "study.shard.journal.jsonl")
+    run_partly(path)
+    with open(path, "a") as file:
+        file.write('{"event": "acknowledged", "unit": "2", "ent')
+
+    assert len(replay(path)) == 6
+    with Journal(path, resume=True) as journal:
+        journal.plan(UNITS)
+        assert [unit for unit, _ in journal.in_doubt()] == [UNITS[2]]
+
+
+def test_a_new_batch_replaces_the_journal(tmp_path):
+    path = str(tmp_path / "study.shard.journal.jsonl")
+    run_partly(path)
+
+    with Journal(path) as journal:
+        journal.plan(UNITS[:1])
+        assert journal.pending() == UNITS[:1]
+        assert journal.in_doubt() == []
+    assert replay_states(path) == {"0": "planned"}
+
+
+def test_resuming_a_missing_journal_starts_a_new_batch(tmp_path):
+    path = str(tmp_path / "study.shard.journal.jsonl")
+    with Journal(path, resume=True) as journal:
+        assert journal.plan(UNITS) == UNITS
+        assert journal.pending() == UNITS
+
+
+def build(shard) -> WorkPackageInput:
+    return WorkPackageInput(forecastConfig=ForecastConfigInput(
+        feeders=shard["feeders"],
+        years=shard["years"],
+        scenarios=shard["scenarios"],
+        timePeriod=TimePeriodInput(startTime=datetime(2024, 1, 1), endTime=datetime(2025, 1, 1)),
+    ))
+
+
+def test_resume_submits_only_what_eas_doesnt_have(tmp_path):
+    path = str(tmp_path / "study.shard.journal.jsonl")
+    shards = plan_shards(["a", "b", "c"], [2030], ["base"], shard_size=1)
+    # The batch stopped while submitting shards 0 and 1, of which only shard 0 reached EAS.
+    with Journal(path) as journal:
+        journal.plan(shards)
+        journal.submitting(shards[0])
+        journal.submitting(shards[1])
+
+    async def resume():
+        with MockEasServer() as server:
+            existing = server.state._add_work_package(shard_work_package_name("study", shards[0]))
+            eas_client = mock_client(server)
+            try:
+                with Journal(path, resume=True) as journal:
+                    entries = await submit_journalled_shards(eas_client, journal, shards, build, "study")
+            finally:
+                await eas_client.close()
+            return existing, entries, len(server.state.work_packages)
+
+    existing, entries, work_packages = asyncio.run(resume())
+    assert entries[0]["work_package_id"] == existing
+    assert all(entry["work_package_id"] is not None for entry in entries)
+    assert work_packages == 3
+
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+from zepben.eas import ForecastConfigInput, TimePeriodInput, WorkPackageInput
+
+from ledger import SUBMITTED, Ledger, canonical_json, work_package_hash
+
+
+def forecast(feeders, years=(2030, 2031), scenarios=("base", "high")) -> WorkPackageInput:
+    return WorkPackageInput(forecastConfig=ForecastConfigInput(
+        feeders=list(feeders),
+        years=list(years),
+        scenarios=list(scenarios),
+        timePeriod=TimePeriodInput(startTime=datetime(2024, 1, 1), endTime=datetime(2025, 1, 1)),
+    ))
+
+
+def test_feeder_year_and_scenario_order_does_not_change_the_hash():
+    assert canonical_json(forecast(["b", "a"])) == canonical_json(forecast(["a", "b"]))
+    assert work_package_hash(forecast(["b", "a"], (2031, 2030), ("high", "base"))) == work_package_hash(forecast(["a", "b"]))
+
+
+def test_different_work_has_a_different_hash():
+    assert work_package_hash(forecast(["a"])) != work_package_hash(forecast(["a", "b"]))
+    assert work_package_hash(forecast(["a"], years=(2030,))) != work_package_hash(forecast(["a"]))
+
+
+def test_unset_fields_are_left_out_of_the_canonical_form():
+    assert "null" not in canonical_json(forecast(["a"]))
+
+
+class Forecast(BaseModel):
+    feeders: list
+
+
+class Intrinsic(BaseModel):
+    feeders: list
+
+
+def test_the_input_type_is_part_of_the_hash():
+    assert canonical_json(Forecast(feeders=["a"])) == canonical_json(Intrinsic(feeders=["a"]))
+    assert work_package_hash(Forecast(feeders=["a"])) != work_package_hash(Intrinsic(feeders=["a"]))
+
+
+def test_record_lookup_and_update_status(tmp_path):
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        assert ledger.lookup("abc") is None
+        ledger.record("abc", "WorkPackageInput", "wp-1", "study")
+        assert ledger.lookup("abc")["status"] == SUBMITTED
+
+        ledger.update_status("wp-1", "COMPLETED")
+        entry = ledger.lookup("abc")
+        assert (entry["work_package_id"], entry["work_package_name"], entry["status"]) == ("wp-1", "study", "COMPLETED")
+
+    # The ledger persists between runs.
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        assert ledger.lookup("abc")["work_package_id"] == "wp-1"
@@ -0,0 +1,56 @@
+import asyncio
+
+from benchmarks.mock_eas_server import MockEasServer
+from benchmarks.run_benchmarks import mock_client
+from network_fingerprints import (
+    DELETED, SETTLED_CHUNK_SIZE, FingerprintStore, changed_combinations, record_submitted_shards, refresh_statuses,
+)
+
+
+def submit(store, work_package_id, feeders, fingerprints, config_hashes):
+    record_submitted_shards(
+        store,
+        [{"work_package_id": work_package_id, "feeders": feeders, "years": [2030], "scenarios": ["base"]}],
+        fingerprints, config_hashes,
+    )
+
+
+def test_refresh_statuses_updates_every_unfinished_work_package(tmp_path):
+    async def refresh_twice():
+        with MockEasServer(job_seconds=0) as server, FingerprintStore(str(tmp_path / "fingerprints.sqlite")) as store:
+            work_package_ids = [server.state._add_work_package(f"wp-{i}") for i in range(5)]
+            fingerprints = {f"feeder-{i}": "f" for i in range(6)}
+            config_hashes = {f"feeder-{i}": "h" for i in range(6)}
+            for i, work_package_id in enumerate(work_package_ids + ["deleted"]):
+                submit(store, work_package_id, [f"feeder-{i}"], fingerprints, config_hashes)
+
+            eas_client = mock_client(server)
+            try:
+                await refresh_statuses(eas_client, store, max_in_flight=2)
+                first = server.state.counts["getWorkPackageById"]
+                await refresh_statuses(eas_client, store, max_in_flight=2)
+                second = server.state.counts["getWorkPackageById"] - first
+            finally:
+                await eas_client.close()
+            return dict(store.connection.execute("SELECT work_package_id, status FROM runs")), first, second
+
+    statuses, first, second = asyncio.run(refresh_twice())
+    assert first == 6
+    assert second == 0
+    assert statuses.pop("deleted") == DELETED
+    assert set(statuses.values()) == {"COMPLETED"}
+
+
+def test_settled_only_covers_the_requested_feeders(tmp_path):
+    feeders = [f"feeder-{i}" for i in range(SETTLED_CHUNK_SIZE + 10)]
+    fingerprints = {feeder: "f" for feeder in feeders}
+    config_hashes = {feeder: "h" for feeder in feeders}
+    with FingerprintStore(str(tmp_path / "fingerprints.sqlite")) as store:
+        submit(store, "wp", feeders, fingerprints, config_hashes)
+
+        assert {row[0] for row in store.settled(["feeder-0", "feeder-1"])} == {"feeder-0", "feeder-1"}
+        assert len(store.settled(feeders)) == len(feeders)
+        assert changed_combinations(store, fingerprints, config_hashes, feeders, [2030], ["base"]) == []
+        assert changed_combinations(
+            store, fingerprints, {**config_hashes, "feeder-3": "h2"}, ["feeder-3", "feeder-4"], [2030], ["base"]
+        ) == [("feeder-3", 2030, "base")]
@@ -0,0 +1,73 @@
+import csv
+from datetime import datetime
+
+import pytest
+
+from overrides import iter_feeder_config_batches, override_load_ids, validate_override_file
+
+LOAD_TIME = datetime(2024, 1, 1)
+
+
+def write_overrides(path, rows):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["feeder", "load_id", "step", "load_watts", "load_var", "gen_watts", "gen_var"])
+        writer.writerows(rows)
+    return str(path)
+
+
+def feeder_rows(feeder, loads, steps):
+    """Rows overriding load_watts and gen_watts of `loads` loads for `steps` steps: two values per load per step."""
+    return [(feeder, f"{feeder}-load-{load}", step, 1000 + step, "", 10 * step, "")
+            for load in range(loads) for step in range(steps)]
+
+
+def batches(path, max_values):
+    return list(iter_feeder_config_batches(path, [2030], ["base"], LOAD_TIME, max_values))
+
+
+def test_small_feeders_share_a_batch(tmp_path):
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 2, 3) + feeder_rows("b", 1, 3))
+    assert [[config.feeder for config in batch] for batch in batches(path, 100)] == [["a", "b"]]
+
+
+def test_batches_hold_at_most_max_values(tmp_path):
+    # 12 values for a and 6 for b.
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 2, 3) + feeder_rows("b", 1, 3))
+    assert [[config.feeder for config in batch] for batch in batches(path, 12)] == [["a"], ["b"]]
+
+
+def test_large_feeders_are_split_by_step(tmp_path):
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 2, 5))
+    # 4 values per step, so 2 steps fit in each part.
+    parts = batches(path, 8)
+    assert [len(batch) for batch in parts] == [1, 1, 1]
+    overrides = [batch[0].fixed_time.overrides for batch in parts]
+    assert [len(part[0].load_watts_override) for part in overrides] == [2, 2, 1]
+    assert [part[0].load_watts_override[0] for part in overrides] == [1000, 1002, 1004]
+    # Every part still overrides every load, and quantities left empty aren't overridden.
+    assert all(len(part) == 2 and part[0].load_var_override is None for part in overrides)
+
+
+def test_validate_counts_feeders_loads_and_parts(tmp_path):
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 2, 5) + feeder_rows("b", 1, 1))
+    assert validate_override_file(path, 8) == {"feeders": 2, "loads": 3, "feeder_parts": 4}
+    assert override_load_ids(path) == {"a": {"a-load-0", "a-load-1"}, "b": {"b-load-0"}}
+
+
+def test_a_feeder_split_across_the_file_is_rejected(tmp_path):
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 1, 1) + feeder_rows("b", 1, 1) + feeder_rows("a", 1, 1))
+    with pytest.raises(ValueError, match="not contiguous"):
+        validate_override_file(path)
+
+
+def test_override_lists_must_have_the_same_length(tmp_path):
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 1, 3) + [("a", "other", 0, 1, "", 1, "")])
+    with pytest.raises(ValueError, match="same length"):
+        validate_override_file(path)
+
+
+def test_too_many_values_per_step_is_rejected(tmp_path):
+    path = write_overrides(tmp_path / "overrides.csv", feeder_rows("a", 3, 1))
+    with pytest.raises(ValueError, match="values per step"):
+        validate_override_file(path, 4)
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from zepben.eas import ForecastConfigInput, HcGeneratorConfigInput, HcModelConfigInput, TimePeriodInput, WorkPackageInput
+
+from parameter_sweep import apply_point, expand_grid, latin_hypercube, plan_points, plan_sweep_shards
+
+RANGES = {
+    "maxLoadTxRatio": {"min": 1.5, "max": 4.0},
+    "maxGenTxRatio": {"min": 4.0, "max": 10.0},
+}
+
+
+def test_latin_hypercube_samples_every_stratum_once():
+    points = latin_hypercube(RANGES, 20, seed=3)
+    assert len(points) == 20
+    for name, spec in RANGES.items():
+        u = (np.array([point[name] for point in points]) - spec["min"]) / (spec["max"] - spec["min"])
+        assert sorted(np.floor(u * 20).astype(int)) == list(range(20))
+
+
+def test_latin_hypercube_is_reproducible_for_a_seed():
+    assert latin_hypercube(RANGES, 10, seed=1) == latin_hypercube(RANGES, 10, seed=1)
+    assert latin_hypercube(RANGES, 10, seed=1) != latin_hypercube(RANGES, 10, seed=2)
+
+
+def test_latin_hypercube_samples_values_evenly():
+    points = latin_hypercube({"closedLoopVRegSetPoint": {"values": [0.98, 0.99, 1.0]}}, 6)
+    assert sorted(point["closedLoopVRegSetPoint"] for point in points) == [0.98, 0.98, 0.99, 0.99, 1.0, 1.0]
+
+
+def test_grid_runs_every_combination():
+    points = expand_grid({"maxLoadTxRatio": {"min": 1.0, "max": 2.0, "steps": 3}, "closedLoopVRegSetPoint": {"values": [0.98, 1.0]}})
+    assert points == [
+        {"maxLoadTxRatio": load, "closedLoopVRegSetPoint": set_point}
+        for load in [1.0, 1.5, 2.0] for set_point in [0.98, 1.0]
+    ]
+
+
+def test_integer_grids_dont_repeat_values():
+    assert expand_grid({"seed": {"min": 1, "max": 3, "steps": 10, "integer": True}}) == [{"seed": 1}, {"seed": 2}, {"seed": 3}]
+
+
+@pytest.mark.parametrize("sweep_config", [
+    {"parameters": {"notAParameter": {"values": [1]}}},
+    {"parameters": {"maxLoadTxRatio": {"min": 2.0, "max": 1.0, "steps": 2}}},
+    {"parameters": {"maxLoadTxRatio": {"min": 1.0, "max": 2.0}}},
+    {"method": "latin_hypercube", "points": 0, "parameters": RANGES},
+    {"method": "latin_hypercube", "points": 11, "max_points": 10, "parameters": RANGES},
+    {"method": "random", "parameters": RANGES},
+])
+def test_bad_sweeps_are_refused(sweep_config):
+    with pytest.raises(ValueError):
+        plan_points(sweep_config)
+
+
+def test_apply_point_only_replaces_the_swept_parameters():
+    base = WorkPackageInput(
+        forecastConfig=ForecastConfigInput(
+            feeders=["a"], years=[2030], scenarios=["base"],
+            timePeriod=TimePeriodInput(startTime=datetime(2024, 1, 1), endTime=datetime(2025, 1, 1)),
+        ),
+        generatorConfig=HcGeneratorConfigInput(model=HcModelConfigInput(maxLoadTxRatio=3.0, loadVMaxPu=1.2)),
+    )
+    swept = apply_point(base, {"maxLoadTxRatio": 2.0})
+    assert swept.generator_config.model.max_load_tx_ratio == 2.0
+    assert swept.generator_config.model.load_v_max_pu == 1.2
+    assert swept.forecast_config is base.forecast_config
+    assert base.generator_config.model.max_load_tx_ratio == 3.0
+
+
+def test_sweep_shards_carry_their_point():
+    shards = plan_sweep_shards([{"maxLoadTxRatio": 2.0}, {"maxLoadTxRatio": 3.0}], ["a"], [2030], ["base"])
+    assert [(shard["shard"], shard["point"], shard["label"]) for shard in shards] == [
+        (0, 0, "maxLoadTxRatio=2"), (1, 1, "maxLoadTxRatio=3"),
+    ]
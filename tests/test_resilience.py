@@ -0,0 +1,88 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from resilience import CircuitBreaker, RetryPolicy, make_resilient
+
+QUERY = SimpleNamespace(value="query")
+
+
+class BlockingClient:
+    """An EAS client whose calls block until released, recording the calls that reached it."""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def execute_custom_operation(self, *fields, operation_type, operation_name=None):
+        self.started.append(operation_name)
+        await self.release.wait()
+        return {"data": {operation_name: True}}
+
+
+def call(eas_client, name):
+    return asyncio.create_task(eas_client.execute_custom_operation(
+        SimpleNamespace(_field_name=name), operation_type=QUERY, operation_name=name,
+    ))
+
+
+def test_only_one_caller_becomes_the_probe():
+    async def acquire_both():
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+        breaker.record_failure()
+        await asyncio.sleep(0.02)
+        first = await breaker.acquire()
+        second = asyncio.create_task(breaker.acquire())
+        await asyncio.sleep(0.05)
+        waiting = not second.done()
+        breaker.record_success()
+        return first, waiting, await second
+
+    assert asyncio.run(acquire_both()) == (True, True, False)
+
+
+def test_cancelling_a_call_that_isnt_the_probe_leaves_the_probe_running():
+    async def cancel_other_call():
+        eas_client = make_resilient(BlockingClient(), RetryPolicy(max_attempts=1), CircuitBreaker(reset_seconds=0.01))
+        breaker = eas_client.circuit_breaker
+        before = call(eas_client, "before")
+        await asyncio.sleep(0)
+
+        # The breaker opens while `before` is still in flight, and `probe` is let through once it can be.
+        breaker.failures = breaker.failure_threshold
+        breaker._open()
+        breaker.opened_at = time.monotonic() - 1
+        probe = call(eas_client, "probe")
+        await asyncio.sleep(0)
+
+        before.cancel()
+        await asyncio.sleep(0)
+        after = call(eas_client, "after")
+        await asyncio.sleep(0.05)
+        started = list(eas_client.started)
+
+        eas_client.release.set()
+        await asyncio.wait_for(asyncio.gather(probe, after), timeout=1)
+        return started, breaker.state
+
+    started, state = asyncio.run(cancel_other_call())
+    assert started == ["before", "probe"]
+    assert state == "closed"
+
+
+def test_cancelling_the_probe_lets_another_call_probe():
+    async def cancel_probe():
+        eas_client = make_resilient(BlockingClient(), RetryPolicy(max_attempts=1), CircuitBreaker(reset_seconds=0.01))
+        breaker = eas_client.circuit_breaker
+        breaker.failures = breaker.failure_threshold
+        breaker._open()
+        breaker.opened_at = time.monotonic() - 1
+
+        probe = call(eas_client, "probe")
+        await asyncio.sleep(0)
+        probe.cancel()
+        await asyncio.sleep(0)
+        eas_client.release.set()
+        return await asyncio.wait_for(call(eas_client, "next"), timeout=1), breaker.state
+
+    assert asyncio.run(cancel_probe()) == ({"data": {"next": True}}, "closed")
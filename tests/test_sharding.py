@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import feeder_sizes
+from feeder_sizes import FeederSize, load_feeder_sizes, pack_feeders
+from sharding import plan_balanced_shards, plan_combination_shards, plan_shards, shard_work_package_name
+
+FEEDERS = [f"feeder-{i}" for i in range(5)]
+
+
+def combinations(shards):
+    return sorted((feeder, year, scenario) for shard in shards for feeder in shard["feeders"]
+                  for year in shard["years"] for scenario in shard["scenarios"])
+
+
+def test_whole_feeders_are_packed_into_shards():
+    shards = plan_shards(FEEDERS, [2030, 2031], ["base", "high"], shard_size=8)
+    assert [shard["feeders"] for shard in shards] == [FEEDERS[:2], FEEDERS[2:4], FEEDERS[4:]]
+    assert all(shard["years"] == [2030, 2031] and shard["scenarios"] == ["base", "high"] for shard in shards)
+    assert [shard["shard"] for shard in shards] == [0, 1, 2]
+
+
+def test_feeders_are_split_by_year_and_scenario_when_they_dont_fit_in_a_shard():
+    shards = plan_shards(FEEDERS, [2030, 2031], ["base", "high"], shard_size=3)
+    assert all(len(shard["feeders"]) * len(shard["years"]) * len(shard["scenarios"]) <= 3 for shard in shards)
+    assert combinations(shards) == combinations([{"feeders": FEEDERS, "years": [2030, 2031], "scenarios": ["base", "high"]}])
+
+
+def test_shard_size_must_be_positive():
+    with pytest.raises(ValueError):
+        plan_shards(FEEDERS, [2030], ["base"], shard_size=0)
+
+
+def test_shards_are_named_by_number():
+    assert shard_work_package_name("study", {"shard": 7}) == "study-shard-0007"
+    assert shard_work_package_name("study", {"shard": 7}, "sweep") == "study-sweep-0007"
+
+
+def test_lpt_packing_balances_weight():
+    weights = {"giant": 10.0, "a": 6.0, "b": 5.0, "c": 5.0, "d": 4.0}
+    groups = pack_feeders(weights, 3)
+    assert sorted(sum(weights[f] for f in group) for group in groups) == [10.0, 10.0, 10.0]
+    assert ["giant"] in groups
+
+
+def test_lpt_packing_respects_the_group_limit():
+    weights = {f"feeder-{i}": float(i) for i in range(7)}
+    groups = pack_feeders(weights, 4, max_per_bin=2)
+    assert all(len(group) <= 2 for group in groups)
+    assert sorted(f for group in groups for f in group) == sorted(weights)
+    with pytest.raises(ValueError):
+        pack_feeders(weights, 3, max_per_bin=2)
+
+
+def test_balanced_shards_have_as_many_shards_as_plain_ones():
+    weights = {feeder: float(i + 1) for i, feeder in enumerate(FEEDERS)}
+    shards = plan_balanced_shards(weights, [2030], ["base"], shard_size=2)
+    assert len(shards) == len(plan_shards(FEEDERS, [2030], ["base"], shard_size=2))
+    assert combinations(shards) == combinations(plan_shards(FEEDERS, [2030], ["base"], shard_size=2))
+
+
+def test_feeders_whose_size_cant_be_fetched_get_the_median_size(tmp_path, monkeypatch):
+    async def fetch_feeder_size(clients, feeder):
+        if feeder == "broken":
+            raise ConnectionError("EWB went away")
+        return FeederSize(feeder, int(feeder[-1]) * 100, 0)
+
+    monkeypatch.setattr(feeder_sizes, "fetch_feeder_size", fetch_feeder_size)
+    clients = SimpleNamespace(config_dir=str(tmp_path))
+    sizes = asyncio.run(load_feeder_sizes(clients, ["f1", "broken", "f2", "f3"]))
+    assert sizes["broken"] == FeederSize("broken", 200, 0)
+    assert sizes["f3"] == FeederSize("f3", 300, 0)
+    # The estimate isn't cached, so the feeder is fetched again next time.
+    assert "broken" not in feeder_sizes.read_cache(feeder_sizes.cache_path(str(tmp_path)))
+
+
+def test_combination_shards_cover_exactly_the_given_combinations():
+    wanted = [("a", 2030, "base"), ("a", 2031, "base"), ("b", 2030, "base"), ("b", 2031, "base"), ("c", 2031, "high")]
+    shards = plan_combination_shards(wanted)
+    assert combinations(shards) == sorted(wanted)
+    assert [shard["shard"] for shard in shards] == list(range(len(shards)))
+    assert {"feeders": ["a", "b"], "years": [2030, 2031], "scenarios": ["base"], "shard": 0} in shards
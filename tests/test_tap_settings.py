@@ -0,0 +1,35 @@
+import time
+
+from tap_settings import TapSettingsStore, feeders_needing_calibration, latest_tap_settings, store_path
+
+RECORD = {"id": "tx-1", "controlEnabled": True, "highStep": 16, "lowStep": 1, "nominalTapNum": 8,
+          "stepVoltageIncrement": 0.625, "tapPosition": 9}
+
+
+def test_latest_set_goes_by_calibration_time(tmp_path):
+    now = time.time()
+    with TapSettingsStore(store_path(str(tmp_path))) as store:
+        store.write("new", {"a": [RECORD]}, calibrated_at=now - 60)
+        store.write("old", {"a": [RECORD], "b": [RECORD]}, calibrated_at=now - 10 * 24 * 3600)
+
+    assert latest_tap_settings(str(tmp_path), {}, ["a", "b", "c"]) == {"a": "new", "b": "old", "c": None}
+    assert latest_tap_settings(str(tmp_path), {"tap_settings_max_age_days": 1}, ["a", "b"]) == {"a": "new", "b": None}
+    assert latest_tap_settings(str(tmp_path), {"reuse_tap_settings": False}, ["a"]) == {"a": None}
+
+
+def test_feeders_without_tap_changers_arent_calibrated_again(tmp_path):
+    with TapSettingsStore(store_path(str(tmp_path))) as store:
+        store.write("set", {"a": [RECORD], "no-taps": []}, calibrated_at=time.time())
+
+    assert feeders_needing_calibration(str(tmp_path), {}, ["a", "no-taps", "new"]) == ["new"]
+    # There are no tap settings to apply to a feeder without tap changers.
+    assert latest_tap_settings(str(tmp_path), {}, ["no-taps"]) == {"no-taps": None}
+
+
+def test_feeders_calibrated_too_long_ago_need_calibrating(tmp_path):
+    with TapSettingsStore(store_path(str(tmp_path))) as store:
+        store.write("set", {"a": [RECORD], "no-taps": []}, calibrated_at=time.time() - 10 * 24 * 3600)
+
+    config = {"tap_settings_max_age_days": 1}
+    assert feeders_needing_calibration(str(tmp_path), config, ["a", "no-taps"]) == ["a", "no-taps"]
+    assert feeders_needing_calibration(str(tmp_path), {}, ["a", "no-taps"]) == []
@@ -1,32 +1,53 @@
 import json
-from typing import Dict, List
-
-import grpc.aio
-from zepben.eas.client.eas_client import EasClient
-from zepben.ewb import connect_with_token, Feeder, NetworkConsumerClient
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional
 
+import instrumentation
 import logging
+import resilience
+
+# The SDKs are imported where they're used rather than here, as every script imports this module and loading the EWB SDK
+# alone takes around half a second - which the EAS-only scripts shouldn't pay for.
+if TYPE_CHECKING:
+    import grpc.aio
+    from zepben.eas.client.eas_client import EasClient
+    from zepben.ewb import Feeder
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
 logger = logging.getLogger()
 
 
 def get_config_dir(argv):
-    return argv[1] if len(argv) > 1 else "."
+    args = [arg for arg in argv[1:] if not arg.startswith("--")]
+    return args[0] if args else "."
+
+
+def has_flag(argv, flag) -> bool:
+    return flag in argv[1:]
+
+
+def get_option(argv, option, default=None):
+    """The value of `--option=value` in argv, or `default` if it isn't given."""
+    prefix = f"{option}="
+    return next((arg[len(prefix):] for arg in argv[1:] if arg.startswith(prefix)), default)
 
 
 def get_config(config_dir):
     config = read_json_config(f"{config_dir}/config.json")
-    config["feeders"] = list({f for f in config["feeders"]})
-    config["forecast_years"] = list({f for f in config["forecast_years"]})
-    config["scenarios"] = list({f for f in config["scenarios"]})
+    # Deduplicated and sorted, so the same config always builds the same work packages.
+    config["feeders"] = sorted(set(config["feeders"]))
+    config["forecast_years"] = sorted(set(config["forecast_years"]))
+    config["scenarios"] = sorted(set(config["scenarios"]))
     return config
 
 
-def get_client(config_dir, async_=True) -> EasClient:
-    auth_config = read_json_config(f"{config_dir}/auth_config.json")
+def get_client(config_dir, async_=True) -> "EasClient":
+    from zepben.eas.client.eas_client import EasClient
 
-    return EasClient(
+    auth_config = read_auth_config(config_dir)
+
+    eas_client = EasClient(
         host=auth_config["eas_server"]["host"],
         port=auth_config["eas_server"]["port"],
         protocol=auth_config["eas_server"]["protocol"],
@@ -35,6 +56,67 @@ def get_client(config_dir, async_=True) -> EasClient:
         ca_filename=auth_config["eas_server"].get("ca_filename"),
         asynchronous=async_,
     )
+    if start_instrumentation(config_dir):
+        instrumentation.instrument_eas_client(eas_client)
+    # Wrapped around the instrumentation, so each attempt is recorded separately.
+    settings = retry_settings(config_dir)
+    if settings is not None:
+        resilience.make_resilient(
+            eas_client,
+            resilience.RetryPolicy(
+                max_attempts=settings.get("max_attempts", 5),
+                base_delay=settings.get("base_delay_seconds", 0.5),
+                max_delay=settings.get("max_delay_seconds", 30.0),
+            ),
+            resilience.CircuitBreaker(
+                failure_threshold=settings.get("breaker_failure_threshold", 5),
+                reset_seconds=settings.get("breaker_reset_seconds", 30.0),
+                max_reset_seconds=settings.get("breaker_max_reset_seconds", 300.0),
+            ),
+        )
+    return eas_client
+
+
+@lru_cache
+def retry_settings(config_dir) -> Optional[Dict]:
+    """
+    The `retries` section of **config.json** (see resilience.py), or None if retries are turned off with
+    `"retries": false`. EAS calls are retried with the defaults if there's no section.
+    """
+    try:
+        settings = read_json_config(f"{config_dir}/config.json").get("retries", {})
+    except FileNotFoundError:
+        settings = {}
+    if settings is False:
+        return None
+    return settings or {}
+
+
+@lru_cache
+def start_instrumentation(config_dir) -> bool:
+    """
+    Start recording client metrics if **config.json** has an `instrumentation` section (see instrumentation.py). Only
+    the first call per process starts anything, and every call returns whether clients should be instrumented.
+    """
+    try:
+        settings = read_json_config(f"{config_dir}/config.json").get("instrumentation")
+    except FileNotFoundError:
+        return False
+    if not settings:
+        return False
+
+    instrumentation.start(
+        os.path.join(config_dir, settings.get("output", "metrics.prom")),
+        cprofile=settings.get("cprofile", False),
+        trace_allocations=settings.get("tracemalloc", False),
+    )
+    return True
+
+
+@lru_cache
+def read_auth_config(config_dir) -> Dict:
+    # Parsed once per process - callers must treat the returned dict as read-only.
+    return read_json_config(f"{config_dir}/auth_config.json")
 
 
 def read_json_config(config_file_path: str) -> Dict:
@@ -71,18 +153,33 @@ def print_progress(result):
     logger.info("------------------------------")
 
 
-def get_ewb_channel(config_dir) -> grpc.aio.Channel:
-    auth_config = read_json_config(f"{config_dir}/auth_config.json")
+def print_progress_changes(changes):
+    for work_package_id, changed in changes.items():
+        if not changed:
+            logger.info(f"{work_package_id}: no longer active")
+        else:
+            logger.info(f"{work_package_id}: " + ", ".join(f"{field} {old} -> {new}" for field, (old, new) in changed.items()))
+
+
+def get_ewb_channel(config_dir, **kwargs) -> "grpc.aio.Channel":
+    from zepben.ewb import connect_with_token
+
+    auth_config = read_auth_config(config_dir)
     channel = connect_with_token(
         host=auth_config["ewb_server"]["host"],
         rpc_port=auth_config["ewb_server"]["rpc_port"],
         access_token=auth_config["ewb_server"]["access_token"],
-        ca_filename=auth_config["ewb_server"].get("ca_path", None)
+        ca_filename=auth_config["ewb_server"].get("ca_path", None),
+        **kwargs
     )
+    if start_instrumentation(config_dir):
+        return instrumentation.InstrumentedChannel(channel)
     return channel
 
 
-async def fetch_feeders(config_dir) -> List[Feeder]:
+async def fetch_feeders(config_dir) -> List["Feeder"]:
+    from zepben.ewb import Feeder, NetworkConsumerClient
+
     channel = get_ewb_channel(config_dir)
     client = NetworkConsumerClient(channel)
     (await client.get_network_hierarchy()).throw_on_error()